@@ -0,0 +1,104 @@
+"""
+Progress events for analyses running in the background (progressive /analyze).
+
+Each analysis publishes its events to a ProgressChannel: pages extracted,
+previews of the first pages, each finished stage, then `done` or `failed`.
+Browsers follow a channel over Server-Sent Events. Every subscriber
+replays the channel from the first event, so a client that connects after
+the upload returns still sees the early pages.
+
+Channels live in the worker process that runs the analysis and are dropped
+ANALYSIS_PROGRESS_TTL seconds after they finish. The final result is kept
+in the content store, so /analyzer/status keeps working after that.
+"""
+import os
+import threading
+import time
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+ANALYSIS_PROGRESS_TTL = int(os.getenv('ANALYSIS_PROGRESS_TTL', '600'))
+ANALYSIS_KEEPALIVE_SECONDS = 15
+
+FINAL_EVENTS = ('done', 'failed')
+
+
+class ProgressChannel:
+    """Append-only event log of one analysis that any number of subscribers can follow."""
+
+    def __init__(self, analysis_id):
+        self.analysis_id = analysis_id
+        self.events = []
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def publish(self, event, data):
+        with self._changed:
+            self.events.append((event, data))
+            if event in FINAL_EVENTS:
+                self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def follow(self, keepalive=ANALYSIS_KEEPALIVE_SECONDS):
+        """Yield (event, data) from the first event until the analysis finishes; (None, None) as keepalive."""
+        cursor = 0
+        while True:
+            with self._changed:
+                if cursor >= len(self.events) and not self.finished:
+                    self._changed.wait(keepalive)
+                pending = self.events[cursor:]
+                cursor += len(pending)
+                finished = self.finished
+            if not pending:
+                if finished:
+                    return
+                yield None, None
+            for event, data in pending:
+                yield event, data
+                if event in FINAL_EVENTS:
+                    return
+
+
+class ProgressRegistry:
+    """Channels of this process's running and recently finished analyses."""
+
+    def __init__(self, ttl=ANALYSIS_PROGRESS_TTL):
+        self.ttl = ttl
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def create(self, analysis_id):
+        channel = ProgressChannel(analysis_id)
+        with self._lock:
+            self._expire()
+            self._channels[analysis_id] = channel
+        return channel
+
+    def get(self, analysis_id):
+        with self._lock:
+            return self._channels.get(analysis_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [key for key, channel in self._channels.items()
+                   if channel.finished and channel.finished_at < cutoff]
+        for key in expired:
+            del self._channels[key]
+        if expired:
+            debug_print(f"🧹 Dropped {len(expired)} finished analysis progress channel(s)")
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for channel in self._channels.values() if not channel.finished)
+            return {"running": running, "channels": len(self._channels)}
+
+
+# Process-wide registry of analysis progress channels
+progress_channels = ProgressRegistry()
@@ -0,0 +1,160 @@
+"""
+Exact-match answer cache sitting in front of the LLM client.
+
+Two tiers:
+- a bounded in-memory LRU per worker process
+- a persistent SQLite tier shared by all workers on the host
+
+Keys are sha256 hashes of the model, the full message list (system prompt,
+session memory and the user's message) and the sampling parameters.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+ANSWER_CACHE_DB = os.getenv('ANSWER_CACHE_DB', os.path.join(os.getcwd(), 'answer_cache.db'))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', str(7 * 24 * 3600)))  # 7 days
+ANSWER_CACHE_MEMORY_ITEMS = int(os.getenv('ANSWER_CACHE_MEMORY_ITEMS', '512'))
+ANSWER_CACHE_MAX_ROWS = int(os.getenv('ANSWER_CACHE_MAX_ROWS', '20000'))
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True').lower() == 'true'
+
+# Run size-based eviction once every N writes instead of on every insert
+EVICT_EVERY_WRITES = 100
+
+
+def make_cache_key(model, messages, **params):
+    """Hash model + messages (system prompt, memory, message) + sampling params."""
+    blob = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """Two-tier (LRU memory + SQLite) exact-match cache of LLM answers."""
+
+    def __init__(self, db_path=ANSWER_CACHE_DB, ttl=ANSWER_CACHE_TTL,
+                 memory_items=ANSWER_CACHE_MEMORY_ITEMS, max_rows=ANSWER_CACHE_MAX_ROWS):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+
+        self._memory = OrderedDict()  # key -> (answer, expires_at)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---- persistent tier ----
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_accessed ON answers (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _evict(self):
+        """Drop expired rows, then the least recently used rows over max_rows."""
+        conn = self._db()
+        conn.execute("DELETE FROM answers WHERE expires_at < ?", (time.time(),))
+        conn.execute("""
+            DELETE FROM answers WHERE key IN (
+                SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_rows,))
+        conn.commit()
+
+    # ---- public API ----
+    def get(self, key):
+        """Return the cached answer for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                answer, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                del self._memory[key]
+
+            try:
+                conn = self._db()
+                row = conn.execute(
+                    "SELECT answer, expires_at FROM answers WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                debug_print(f"⚠️ Answer cache read failed: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key, answer, ttl=None):
+        """Store an answer in both tiers."""
+        if not answer or not answer.strip():
+            return
+        now = time.time()
+        expires_at = now + (ttl or self.ttl)
+        with self._lock:
+            self._remember(key, answer, expires_at)
+            try:
+                conn = self._db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, answer, created_at, accessed_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, answer, now, now, expires_at)
+                )
+                conn.commit()
+                self._writes += 1
+                if self._writes % EVICT_EVERY_WRITES == 0:
+                    self._evict()
+            except sqlite3.Error as e:
+                debug_print(f"⚠️ Answer cache write failed: {e}")
+
+    def _remember(self, key, answer, expires_at):
+        self._memory[key] = (answer, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "memory_items": len(self._memory)
+        }
+
+
+# Process-wide cache used by llm_client
+answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
@@ -9,13 +9,14 @@ print("✅ Eventlet monkey patch applied")
 import os
 import sys
 import json
+import math
 import re
 import time
 import uuid
 import base64
 import shutil
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
 
 # Third-party imports
@@ -27,7 +28,8 @@ from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 # Flask and extensions
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, flash, jsonify, send_from_directory
+    session, flash, jsonify, send_from_directory,
+    Response, stream_with_context
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO, emit, join_room, leave_room
@@ -38,15 +40,33 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Local modules (imported after load_dotenv so they see .env settings)
+from utils import DEBUG_MODE, debug_print
+from llm_client import llm_client, LLMError, LLMUnavailableError
+from answer_cache import answer_cache
+from semantic_cache import semantic_cache, semantic_scope
+from background_jobs import job_queue
+from memory_manager import compact_message, compact_memory, build_memory_messages
+from rate_limit import rate_limited, rate_limiter
+from pdf_extraction import extract_pdf_text, iter_pdf_pages, pdf_page_count, PDF_MAX_PAGES
+from extraction_cache import extraction_cache, file_sha256
+from materials_corpus import materials_corpus
+from material_search import material_search
+from retrieval import RAG_FILE_TOKEN_BUDGET, content_terms, document_passages, retriever, format_passages
+from content_store import content_store
+from server_session import ServerSessionInterface
+from upload_spool import SpoolingRequest, SpooledUpload, MemoryProbe, upload_stats, UPLOAD_SPOOL_DIR
+from analysis_progress import progress_channels
+from table_extraction import extract_tables, TABLE_LIMIT
+from ocr import ocr_image, ocr_stats
+from image_prep import VisionImageSet, prepare_vision_image, image_prep_stats
+from file_registry import file_registry, FILE_REGISTRY_TTL
+from disk_janitor import disk_janitor
+from pdf_images import extract_pdf_images, touch_image, touch_images, PDF_IMAGE_DIR
+
 # ============================================
 # Configuration
 # ============================================
-DEBUG_MODE = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
-
-def debug_print(*args, **kwargs):
-    if DEBUG_MODE:
-        print(*args, **kwargs)
-
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
 
 def allowed_file(filename):
@@ -60,9 +80,15 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-pro
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///tellavista.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads')
-app.config['IMAGE_FOLDER'] = os.path.join(os.getcwd(), 'extracted_images')
+app.config['IMAGE_FOLDER'] = PDF_IMAGE_DIR
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB limit for video uploads
 
+# Large multipart uploads are streamed to temp files instead of memory
+app.request_class = SpoolingRequest
+
+# Session values live server-side (Redis or disk); the cookie only holds the session id
+app.session_interface = ServerSessionInterface()
+
 # Create upload folders if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['IMAGE_FOLDER'], exist_ok=True)
@@ -85,25 +111,50 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 # ============================================
 # Missing stub functions (to be implemented)
 # ============================================
-def extract_text_from_pdf(file):
-    """Stub: extract text from PDF file."""
+def extract_text_from_pdf(file, max_pages=PDF_MAX_PAGES):
+    """Extract text from a PDF file (large documents are parsed by parallel worker processes)."""
     try:
-        # In a real implementation, use PyPDF2, pdfplumber, etc.
-        return "PDF text extraction not implemented."
-    except Exception:
+        return extract_pdf_text(file, max_pages=max_pages)
+    except Exception as e:
+        debug_print(f"❌ PDF text extraction failed: {e}")
         return ""
 
 def extract_text_from_pdf_turbo(file):
-    """Stub: enhanced text extraction."""
-    return extract_text_from_pdf(file)
+    """Text extraction for the analyzer: the full page cap, timed."""
+    started = time.time()
+    text = extract_text_from_pdf(file, max_pages=PDF_MAX_PAGES)
+    debug_print(f"⏱️ Extracted {len(text)} chars of PDF text in {time.time() - started:.2f}s")
+    return text
 
-def extract_images_from_pdf(file, session_id):
-    """Stub: extract images from PDF."""
-    return []
+def cached_extraction(digest, kind, compute, should_cache=lambda value: value is not None):
+    """Reuse an extraction result for identical file bytes (see extraction_cache)."""
+    if extraction_cache is None or not digest:
+        return compute()
+    return extraction_cache.get_or_compute(digest, kind, compute, should_cache=should_cache)
+
+def extract_pdf_text_cached(data, max_pages=PDF_MAX_PAGES, digest=None):
+    """Text of a PDF given as bytes (or a path plus its digest); later uploads of the same file skip extraction."""
+    return cached_extraction(
+        digest or file_sha256(data), f"text-p{max_pages}",
+        lambda: extract_text_from_pdf(data, max_pages=max_pages),
+        should_cache=bool  # never cache a failed extraction
+    )
+
+def extract_images_from_pdf(file, digest=None):
+    """Distinct content images of a PDF, stored once as WebP with thumbnails (see pdf_images.py)."""
+    try:
+        return extract_pdf_images(file, digest=digest)
+    except Exception as e:
+        debug_print(f"❌ Image extraction failed: {e}")
+        return []
 
-def extract_tables_from_pdf(file):
-    """Stub: extract tables from PDF."""
-    return []
+def extract_tables_from_pdf(file, digest=None, limit=TABLE_LIMIT):
+    """Up to `limit` tables with markdown, parsing only pages that look like they hold one."""
+    try:
+        return extract_tables(file, digest=digest, limit=limit)
+    except Exception as e:
+        debug_print(f"❌ Table extraction failed: {e}")
+        return []
 
 def analyze_document_structure(text):
     """Stub: analyze document structure."""
@@ -114,16 +165,23 @@ def analyze_document_structure(text):
     }
 
 def is_diagram_or_visual(text):
-    """Stub: determine if image is diagram."""
-    return False
+    """True when OCR found no usable text: a diagram, chart or photo for the vision model."""
+    if text == "DIAGRAM_OR_VISUAL_CONTENT":
+        return True
+    return len([word for word in text.split() if sum(ch.isalpha() for ch in word) >= 2]) < 5
 
 def extract_text_from_image(file):
-    """Stub: OCR on image."""
-    return "DIAGRAM_OR_VISUAL_CONTENT"
+    """OCR text of an image (cached by hash); DIAGRAM_OR_VISUAL_CONTENT for diagrams, which skip OCR."""
+    try:
+        result = ocr_image(file)
+    except Exception as e:
+        debug_print(f"❌ OCR failed: {e}")
+        return "DIAGRAM_OR_VISUAL_CONTENT"
+    return result["text"] if result["text"].strip() else "DIAGRAM_OR_VISUAL_CONTENT"
 
 def cleanup_stale_files():
-    """Stub: clean up old uploaded files."""
-    pass
+    """Run one disk janitor sweep now; the janitor thread also runs one every JANITOR_INTERVAL seconds."""
+    return disk_janitor.run_once()
 
 # ============================================
 # Database Models
@@ -220,25 +278,76 @@ class Video(db.Model):
         }
 
 # ============================================
-# SESSION MEMORY FUNCTIONS (temporary, last 5 messages)
+# SESSION MEMORY FUNCTIONS (temporary, last 5 exchanges + running summary)
 # ============================================
 def get_session_memory():
     """Retrieve the current session's chat memory."""
     if 'chat_memory' not in session:
         session['chat_memory'] = []
+    if 'pending_answer' in session:
+        resolve_pending_answer()
     return session['chat_memory']
 
 def add_to_session_memory(role, content, max_messages=5):
-    """Add a message to session memory, keeping only the last `max_messages` exchanges."""
+    """
+    Add a message to session memory.
+
+    Answers are stored as plain text, and exchanges beyond `max_messages` or
+    over the token budget are folded into session['chat_summary'] instead of
+    being resent verbatim.
+    """
     memory = get_session_memory()
     memory.append({
         "role": role,
-        "content": content
+        "content": compact_message(role, content)
     })
-    # Keep only last N messages (each exchange = user + assistant → 2 messages per exchange)
-    if len(memory) > max_messages * 2:
-        memory = memory[-max_messages * 2:]
+    # Each exchange = user + assistant → 2 messages per exchange
+    memory, summary = compact_memory(memory, session.get('chat_summary', ''), max_messages=max_messages * 2)
     session['chat_memory'] = memory
+    session['chat_summary'] = summary
+
+def get_memory_messages(memory=None):
+    """Prompt messages for the session: running summary, then recent turns."""
+    if memory is None:
+        memory = get_session_memory()
+    return build_memory_messages(memory, session.get('chat_summary', ''))
+
+def mark_pending_answer(question):
+    """
+    Remember a question whose answer is still streaming.
+
+    The session cookie is sent before a streamed body, so the answer cannot be
+    written to session memory by the stream itself. The next request picks it
+    up from UserQuestions instead (see resolve_pending_answer).
+    """
+    session['pending_answer'] = {
+        "question": question,
+        "since": datetime.utcnow().isoformat()
+    }
+
+def resolve_pending_answer():
+    """Move a finished streamed answer from the database into session memory."""
+    pending = session.pop('pending_answer', None)
+    if not pending:
+        return
+
+    try:
+        username = session.get('user', {}).get('username')
+        since = datetime.fromisoformat(pending['since'])
+        record = UserQuestions.query.filter(
+            UserQuestions.username == username,
+            UserQuestions.question == pending['question'],
+            UserQuestions.timestamp >= since
+        ).order_by(UserQuestions.timestamp.desc()).first()
+
+        if record:
+            add_to_session_memory("user", record.question)
+            add_to_session_memory("assistant", record.answer)
+        elif datetime.utcnow() - since < timedelta(minutes=5):
+            # Stream may still be running; check again on the next request
+            session['pending_answer'] = pending
+    except Exception as e:
+        debug_print(f"⚠️ Could not resolve pending answer: {e}")
 
 # ============================================
 # Helper Functions
@@ -353,36 +462,6 @@ def create_default_user():
         except Exception as e:
             print(f"❌ Error creating default user: {e}")
 
-# ============================================
-# Session Cleanup Functions
-# ============================================
-def cleanup_old_files():
-    """Remove old uploaded files from session and disk."""
-    try:
-        current_time = time.time()
-        # Clean files older than 1 hour (3600 seconds)
-        if session.get('last_upload_time') and (current_time - session.get('last_upload_time', 0)) > 3600:
-            # Remove file from disk
-            if session.get('last_file_path'):
-                try:
-                    if os.path.exists(session['last_file_path']):
-                        os.remove(session['last_file_path'])
-                        debug_print(f"🗑️ Cleaned up old file: {session['last_file_path']}")
-                except Exception as e:
-                    debug_print(f"⚠️ Could not delete file: {e}")
-
-            # Clear session references
-            session.pop('last_file_id', None)
-            session.pop('last_file_type', None)
-            session.pop('last_file_name', None)
-            session.pop('last_file_path', None)
-            session.pop('last_image_base64', None)
-            session.pop('last_file_preview', None)
-            session.pop('last_upload_time', None)
-
-    except Exception as e:
-        debug_print(f"⚠️ Cleanup error: {e}")
-
 # ============================================
 # File Processing Helper Functions
 # ============================================
@@ -396,6 +475,97 @@ def encode_image_to_base64(file):
         debug_print(f"❌ Error encoding image to base64: {e}")
         return None
 
+def image_mime_type(filename):
+    """MIME type of an uploaded image from its file name."""
+    if filename.lower().endswith('.png'):
+        return 'image/png'
+    if filename.lower().endswith('.gif'):
+        return 'image/gif'
+    return 'image/jpeg'
+
+# ============================================
+# Registered uploads (see file_registry.py)
+# ============================================
+MAX_FILE_REFERENCES = 10  # file_ids accepted per question
+
+def register_uploaded_file(file, username, with_ocr=False):
+    """
+    Store an uploaded PDF or image in the file registry, with its extracted text.
+
+    Returns the registry record, whose file_id follow-up questions send instead
+    of the file, or None for unsupported types. Images also store their
+    vision-ready copy, plus OCR text when `with_ocr` is set.
+    """
+    filename = file.filename.lower()
+    if filename.endswith('.pdf'):
+        with SpooledUpload(file) as upload:
+            text = extract_pdf_text_cached(upload.path, digest=upload.sha256)
+            return file_registry.register(upload, username, file.filename, 'pdf', upload.sha256, upload.size,
+                                          text=text)
+
+    if filename.endswith(('.png', '.jpg', '.jpeg', '.gif')):
+        file.seek(0)
+        image_bytes = file.read()
+        mime_type = image_mime_type(filename)
+        text = extract_text_from_image(image_bytes) if with_ocr else ""
+        return file_registry.register(
+            image_bytes, username, file.filename, 'image', file_sha256(image_bytes), len(image_bytes),
+            text="" if text == "DIAGRAM_OR_VISUAL_CONTENT" else text,
+            vision=prepare_vision_image(image_bytes, mime_type), mime_type=mime_type
+        )
+    return None
+
+def resolve_file_ids(file_ids, username):
+    """Registry records of the file_ids a question refers to, and the ids that no longer resolve."""
+    if isinstance(file_ids, str):
+        file_ids = [file_ids]
+    wanted = []
+    for value in file_ids or []:
+        if isinstance(value, str):
+            wanted.extend(file_id.strip() for file_id in value.split(',') if file_id.strip())
+
+    records, expired = [], []
+    for file_id in list(dict.fromkeys(wanted))[:MAX_FILE_REFERENCES]:
+        record = file_registry.get(file_id, username)
+        if record is None:
+            expired.append(file_id)
+        else:
+            records.append(record)
+    return records, expired
+
+def add_registered_files(records, file_texts, vision_images, question=""):
+    """
+    Add the stored text of registered PDFs and the vision copies of registered images to a question.
+
+    The PDFs share RAG_FILE_TOKEN_BUDGET; a longer one contributes only the
+    passages most relevant to the question.
+    """
+    documents = sum(1 for record in records if record["type"] == "pdf" and record["text"])
+    token_budget = RAG_FILE_TOKEN_BUDGET // max(1, documents)
+    for record in records:
+        if record["type"] == "pdf":
+            if record["text"]:
+                text = document_passages.excerpt(record["text"], question, record["sha256"], token_budget)
+                file_texts.append(f"[PDF: {record['filename']}]\n{text}")
+            continue
+
+        prepared = file_registry.vision_image(record)
+        if prepared is not None:
+            added = vision_images.add_prepared(prepared, record["filename"], record["sha256"])
+        else:
+            image_bytes = file_registry.read_bytes(record)
+            added = image_bytes is not None and vision_images.add(
+                image_bytes, record["filename"], record.get("mime_type", 'image/jpeg'))
+            if image_bytes is None and record["text"]:
+                file_texts.append(f"[Image text: {record['filename']}]\n{record['text']}")
+        if not added:
+            debug_print(f"🖼️ Skipping duplicate or missing image {record['filename']}")
+
+def file_reference(record):
+    """Public part of a registry record, returned to the client."""
+    return {"file_id": record["file_id"], "filename": record["filename"], "type": record["type"],
+            "expires_in": FILE_REGISTRY_TTL}
+
 def is_academic_book(title, topic, department):
     """Determine if a book title appears to be academic based on keywords."""
     if not title:
@@ -970,6 +1140,7 @@ def signup():
 
             print(f"✅ Successfully created user: {username}")
 
+            session.regenerate()
             session['user'] = {
                 'username': username,
                 'email': email,
@@ -1022,6 +1193,7 @@ def login():
                     user.last_login = datetime.utcnow()
                     db.session.commit()
 
+                    session.regenerate()  # a session id planted before login must not become logged in
                     session['user'] = {
                         'username': user.username,
                         'email': user.email,
@@ -1077,10 +1249,131 @@ def analyze_page():
     user = session.get('user')
     return render_template('analyze.html', user=user)
 
+# ============================================
+# PDF analysis pipeline (shared by the blocking and progressive modes)
+# ============================================
+ANALYSIS_PREVIEW_PAGES = int(os.getenv('ANALYSIS_PREVIEW_PAGES', '3'))  # pages sent with their text
+ANALYSIS_PAGE_EVENTS = 50  # at most this many page-progress events per document
+UNREADABLE_PDF_ERROR = "PDF is unreadable or contains too little text"
+
+def extract_text_with_progress(path, progress):
+    """PDF text, publishing page progress (and previews of the first pages) as pages arrive."""
+    try:
+        page_count = pdf_page_count(path)
+        progress.publish('stage', {"stage": "text", "status": "running", "pages": page_count})
+        step = max(1, page_count // ANALYSIS_PAGE_EVENTS)
+        parts = []
+        for page_number, page_text in iter_pdf_pages(path):
+            if page_text:
+                parts.append(page_text)
+            if page_number <= ANALYSIS_PREVIEW_PAGES or page_number % step == 0 or page_number == page_count:
+                event = {"page": page_number, "pages": page_count}
+                if page_number <= ANALYSIS_PREVIEW_PAGES:
+                    event["preview"] = page_text[:600]
+                progress.publish('page', event)
+        return "\n\n".join(parts)
+    except Exception as e:
+        debug_print(f"❌ PDF text extraction failed: {e}")
+        return ""
+
+def run_pdf_analysis(path, filename, file_hash, session_id, progress=None):
+    """
+    Extract text, images, tables and structure of the PDF at path.
+
+    Returns the analyzer content dict, or None when the PDF has too little
+    text. With a ProgressChannel, every finished stage is published to it.
+    """
+    def stage_done(stage, **data):
+        if progress is not None:
+            progress.publish('stage', dict(stage=stage, status="done", **data))
+
+    if progress is not None:
+        extract_text = lambda: extract_text_with_progress(path, progress)
+    else:
+        extract_text = lambda: extract_text_from_pdf_turbo(path)
+    text = cached_extraction(file_hash, f"text-p{PDF_MAX_PAGES}", extract_text, should_cache=bool)
+
+    if not text or len(text.strip()) < 100:
+        return None
+    stage_done("text", text_length=len(text), preview=text[:500])
+
+    images = extract_images_from_pdf(path, digest=file_hash)  # cached inside
+    stage_done("images", image_count=len(images))
+    tables = extract_tables_from_pdf(path, digest=file_hash)  # cached per page inside
+    stage_done("tables", table_count=len(tables))
+
+    # Analyze document structure
+    document_analysis = cached_extraction(file_hash, "structure", lambda: analyze_document_structure(text))
+    stage_done("structure", main_topics=document_analysis.get('main_topics', [])[:3])
+
+    debug_print(f"✅ PDF analysis complete:")
+    debug_print(f"   - Text: {len(text)} characters")
+    debug_print(f"   - Images: {len(images)} extracted")
+    debug_print(f"   - Tables: {len(tables)} extracted")
+    debug_print(f"   - Main topics: {len(document_analysis.get('main_topics', []))}")
+
+    return {
+        "type": "pdf",
+        "status": "ready",
+        "text": text,
+        "images": images,
+        "tables": tables,
+        "document_analysis": document_analysis,
+        "filename": filename,
+        "file_hash": file_hash,
+        "session_id": session_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "text_length": len(text),
+        "image_count": len(images),
+        "table_count": len(tables)
+    }
+
+def analysis_summary(content):
+    """The /analyze response for finished analyzer content."""
+    text = content.get("text", "")
+    return {
+        "success": True,
+        "filename": content.get("filename"),
+        "text_length": len(text),
+        "image_count": len(content.get("images", [])),
+        "table_count": len(content.get("tables", [])),
+        "preview": text[:500] + "..." if len(text) > 500 else text,
+        "session_id": content.get("session_id"),
+        "main_topics": content.get("document_analysis", {}).get('main_topics', [])[:3]
+    }
+
+def run_progressive_analysis(channel, path, filename, file_hash, session_id):
+    """Background half of a progressive /analyze: extract, store the result, publish done/failed."""
+    try:
+        content = run_pdf_analysis(path, filename, file_hash, session_id, progress=channel)
+        if content is None:
+            content_store.update(session_id, status="failed", error=UNREADABLE_PDF_ERROR)
+            channel.publish('failed', {"success": False, "error": UNREADABLE_PDF_ERROR})
+            return
+        content_store.put(session_id, content)
+        channel.publish('done', analysis_summary(content))
+    except Exception as e:
+        debug_print(f"❌ Progressive analysis error: {str(e)}")
+        traceback.print_exc()
+        content_store.update(session_id, status="failed", error=f"Processing failed: {str(e)}")
+        channel.publish('failed', {"success": False, "error": f"Processing failed: {str(e)}"})
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 @app.route('/analyze', methods=['POST'])
 @login_required
+@rate_limited('analyze', '10/300')
 def analyze_pdf():
-    """Handle PDF upload and extraction."""
+    """
+    Handle PDF upload and extraction.
+
+    With progressive=1 the extraction runs in the background: the response
+    (202) carries a progress_url streaming page-level progress as
+    Server-Sent Events, ending with a `done` event holding the usual summary.
+    """
 
     try:
         if 'file' not in request.files:
@@ -1095,83 +1388,244 @@ def analyze_pdf():
 
         # Generate session ID
         session_id = str(uuid.uuid4())
-
-        # Read file content
-        file_content = file.read()
-        if len(file_content) == 0:
-            return jsonify({"success": False, "error": "Uploaded file is empty"}), 400
-
-        # Create multiple streams for extraction
-        from io import BytesIO
-        file_streams = [BytesIO(file_content) for _ in range(3)]
-
-        # Extract content
-        debug_print("📄 Starting comprehensive extraction...")
-        text = extract_text_from_pdf_turbo(file_streams[0])
-
-        if not text or len(text.strip()) < 100:
-            return jsonify({"success": False, "error": "PDF is unreadable or contains too little text"}), 400
-
-        images = extract_images_from_pdf(file_streams[1], session_id)
-        tables = extract_tables_from_pdf(file_streams[2])
-
-        # Analyze document structure
-        document_analysis = analyze_document_structure(text)
-
-        # Store in session
-        analyzer_content = {
-            "type": "pdf",
-            "text": text,
-            "images": images,
-            "tables": tables,
-            "document_analysis": document_analysis,
-            "filename": file.filename,
-            "session_id": session_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "text_length": len(text),
-            "image_count": len(images),
-            "table_count": len(tables)
-        }
-
-        session['analyzer_content'] = analyzer_content
-
-        debug_print(f"✅ PDF analysis complete:")
-        debug_print(f"   - Text: {len(text)} characters")
-        debug_print(f"   - Images: {len(images)} extracted")
-        debug_print(f"   - Tables: {len(tables)} extracted")
-        debug_print(f"   - Main topics: {len(document_analysis.get('main_topics', []))}")
-
-        return jsonify({
-            "success": True,
-            "filename": file.filename,
-            "text_length": len(text),
-            "image_count": len(images),
-            "table_count": len(tables),
-            "preview": text[:500] + "..." if len(text) > 500 else text,
-            "session_id": session_id,
-            "main_topics": document_analysis.get('main_topics', [])[:3]
-        })
+        progressive = str(request.values.get('progressive', '')).lower() in ('1', 'true', 'yes')
+
+        # The upload stays in its spooled temp file; every extractor reads it by path
+        with SpooledUpload(file) as upload, MemoryProbe('analyze') as probe:
+            if upload.size == 0:
+                return jsonify({"success": False, "error": "Uploaded file is empty"}), 400
+
+            # Identical uploads (same course PDF) reuse earlier extraction results
+            file_hash = upload.sha256
+
+            if progressive:
+                # The spooled file is removed with the request, so keep a link for the background task
+                path = upload.keep(os.path.join(UPLOAD_SPOOL_DIR, f"analysis-{session_id}.pdf"))
+                save_analyzer_content({
+                    "type": "pdf",
+                    "status": "processing",
+                    "filename": file.filename,
+                    "file_hash": file_hash,
+                    "session_id": session_id,
+                    "timestamp": datetime.utcnow().isoformat()
+                })
+                channel = progress_channels.create(session_id)
+                eventlet.spawn(run_progressive_analysis, channel, path, file.filename, file_hash, session_id)
+                return jsonify({
+                    "success": True,
+                    "status": "processing",
+                    "filename": file.filename,
+                    "session_id": session_id,
+                    "progress_url": url_for('analyze_progress', analysis_id=session_id)
+                }), 202
+
+            debug_print("📄 Starting comprehensive extraction...")
+            analyzer_content = run_pdf_analysis(upload.path, file.filename, file_hash, session_id)
+            if analyzer_content is None:
+                return jsonify({"success": False, "error": UNREADABLE_PDF_ERROR}), 400
+
+            # Store server-side; the session only keeps the reference
+            save_analyzer_content(analyzer_content)
+            debug_print(f"   - Upload: {upload.size / 1024 / 1024:.1f} MB spooled to disk, peak memory +{probe.peak_mb} MB")
+
+            return jsonify(analysis_summary(analyzer_content))
 
     except Exception as e:
         debug_print(f"❌ Analyze error: {str(e)}")
         traceback.print_exc()
         return jsonify({"success": False, "error": f"Processing failed: {str(e)}"}), 500
 
+@app.route('/analyze/progress/<analysis_id>')
+@login_required
+def analyze_progress(analysis_id):
+    """Server-Sent Events with the progress of a progressive /analyze, replayed from the start."""
+    if session.get('analyzer_content_id') != analysis_id:
+        return jsonify({"success": False, "error": "Unknown analysis"}), 404
+    channel = progress_channels.get(analysis_id)
+
+    @stream_with_context
+    def generate():
+        if channel is None:
+            # Finished a while ago or running in another worker: report the stored state
+            content = content_store.get(analysis_id) or {}
+            status = content.get("status", "ready" if content else "failed")
+            if status == "ready":
+                yield sse_event(analysis_summary(content), event='done')
+            elif status == "failed":
+                yield sse_event({"success": False, "error": content.get("error", "Analysis expired")}, event='failed')
+            else:
+                # Still processing elsewhere: let EventSource reconnect (and re-check) shortly
+                yield "retry: 2000\n\n"
+                yield sse_event({"stage": "text", "status": "running"}, event='stage')
+            return
+        for event, data in channel.follow():
+            yield ": keepalive\n\n" if event is None else sse_event(data, event=event)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 # ============================================
 # Turbo AI-Style Notes Generation Function
 # ============================================
+NOTES_CHUNK_TOKENS = int(os.getenv('NOTES_CHUNK_TOKENS', '6000'))      # text per map call
+NOTES_REDUCE_TOKENS = int(os.getenv('NOTES_REDUCE_TOKENS', '24000'))   # partial notes per reduce call
+NOTES_MAX_PARALLEL = int(os.getenv('NOTES_MAX_PARALLEL', '4'))         # concurrent map calls per document
+NOTES_MAP_MODEL = os.getenv('NOTES_MAP_MODEL', 'openai/gpt-4o-mini')
+NOTES_MODEL = "openai/gpt-4-turbo"
+NOTES_QUEUE_TIMEOUT = float(os.getenv('NOTES_QUEUE_TIMEOUT', '120'))  # background jobs wait for an LLM slot
+
+SECTION_NOTES_PROMPT = """
+You are an expert academic tutor. You will receive ONE section of a longer lecture document.
+Write concise but complete study notes for this section only:
+- Keep every definition, formula, process and example that appears in the section.
+- Use clear Markdown headings and short paragraphs.
+- Do not add an introduction or conclusion for the whole document.
+"""
+
+MERGE_NOTES_PROMPT = """
+You are an expert academic editor. You will receive partial study notes written for consecutive sections of one document.
+Merge them into one set of notes: remove repetition, keep every distinct fact, definition, formula and example, and keep the original order of topics.
+"""
+
+def estimate_tokens(text):
+    """Rough token count for prompt budgeting (about 4 characters per token)."""
+    return len(text or "") // 4 + 1
+
+def split_text_into_sections(text, max_tokens=NOTES_CHUNK_TOKENS):
+    """Split text into sections of at most `max_tokens`, breaking on paragraph boundaries."""
+    max_chars = max_tokens * 4
+    sections = []
+    current = []
+    current_size = 0
+
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        # A single oversized paragraph is cut into fixed-size pieces
+        pieces = [paragraph[i:i + max_chars] for i in range(0, len(paragraph), max_chars)]
+        for piece in pieces:
+            if current and current_size + len(piece) > max_chars:
+                sections.append("\n\n".join(current))
+                current, current_size = [], 0
+            current.append(piece)
+            current_size += len(piece) + 2
+
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+def run_bounded(fn, items, max_parallel=NOTES_MAX_PARALLEL):
+    """Run fn over items on a bounded green pool, returning (results, errors) in order."""
+    def safe_call(item):
+        try:
+            return fn(item), None
+        except Exception as e:
+            return None, e
+
+    pool = eventlet.GreenPool(max_parallel)
+    outcomes = list(pool.imap(safe_call, items))
+    return [r for r, _ in outcomes], [e for _, e in outcomes]
+
+def map_reduce_notes(text, filename, system_prompt, task_prompt):
+    """
+    Chunked note generation for documents too large for one prompt.
+
+    Map: partial notes per section, NOTES_MAX_PARALLEL calls at a time.
+    Reduce: merge partial notes (hierarchically if they are still too large),
+    then one final pass with the full lecture-notes prompt.
+
+    Every call goes through llm_client's answer cache, so when a section fails
+    and the job is retried, only the failed sections hit OpenRouter again.
+    """
+    sections = split_text_into_sections(text)
+    total = len(sections)
+    debug_print(f"🧩 Map-reduce notes for {filename}: {total} sections, {NOTES_MAX_PARALLEL} in parallel")
+
+    def section_notes(indexed_section):
+        index, section = indexed_section
+        return llm_client.chat(
+            [
+                {"role": "system", "content": SECTION_NOTES_PROMPT},
+                {"role": "user", "content": f"DOCUMENT: {filename}\nSECTION {index} OF {total}:\n\n{section}"}
+            ],
+            model=NOTES_MAP_MODEL,
+            temperature=0.2,
+            max_tokens=1500,
+            timeout=120,
+            title="Nellavista Turbo-Style Notes Generator",
+            queue_timeout=NOTES_QUEUE_TIMEOUT
+        )
+
+    partials, errors = run_bounded(section_notes, list(enumerate(sections, 1)))
+    failed = [i for i, e in enumerate(errors, 1) if e is not None]
+    if failed:
+        raise LLMError(f"Note generation failed for sections {failed} of {total}")
+
+    def merge_group(group):
+        return llm_client.chat(
+            [
+                {"role": "system", "content": MERGE_NOTES_PROMPT},
+                {"role": "user", "content": "\n\n---\n\n".join(group)}
+            ],
+            model=NOTES_MAP_MODEL,
+            temperature=0.2,
+            max_tokens=3000,
+            timeout=120,
+            title="Nellavista Turbo-Style Notes Generator",
+            queue_timeout=NOTES_QUEUE_TIMEOUT
+        )
+
+    # Intermediate reduce rounds until the partial notes fit one final prompt
+    while len(partials) > 1 and sum(estimate_tokens(p) for p in partials) > NOTES_REDUCE_TOKENS:
+        groups, group, group_tokens = [], [], 0
+        for partial in partials:
+            tokens = estimate_tokens(partial)
+            if group and group_tokens + tokens > NOTES_REDUCE_TOKENS // 2:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(partial)
+            group_tokens += tokens
+        groups.append(group)
+        if len(groups) == len(partials):
+            break
+
+        partials, errors = run_bounded(merge_group, groups)
+        if any(e is not None for e in errors):
+            raise LLMError("Note generation failed while merging sections")
+
+    return llm_client.chat(
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": task_prompt + "\n\nPARTIAL NOTES (one per document section, in order):\n\n" + "\n\n---\n\n".join(partials)}
+        ],
+        model=NOTES_MODEL,
+        temperature=0.2,
+        max_tokens=7000,
+        timeout=180,
+        title="Nellavista Turbo-Style Notes Generator",
+        queue_timeout=NOTES_QUEUE_TIMEOUT
+    )
+
 def generate_turbo_style_notes(text, tables, images, filename, document_analysis):
-    """Generate comprehensive lecture-style notes using AI."""
-    try:
-        # Build summaries
-        tables_summary = f"Found {len(tables)} table(s)."
-        if tables:
-            for i, table in enumerate(tables[:3], 1):
-                tables_summary += f"\nTable {i} (page {table.get('page', '?')}): {table.get('text', '')[:200]}"
+    """
+    Generate comprehensive lecture-style notes using AI (map-reduce for large documents).
+
+    Raises LLMError when the AI service fails, so the notes job is marked
+    failed and /understand can be called again.
+    """
+    # Build summaries
+    tables_summary = f"Found {len(tables)} table(s)."
+    if tables:
+        for i, table in enumerate(tables[:3], 1):
+            tables_summary += f"\nTable {i} (page {table.get('page', '?')}): {table.get('text', '')[:200]}"
 
-        images_summary = f"Found {len(images)} image(s)."
+    images_summary = f"Found {len(images)} image(s)."
 
-        PDF_ANALYSIS_PROMPT = """
+    PDF_ANALYSIS_PROMPT = """
 You are an expert academic tutor and textbook author. Your task is to transform raw extracted content from a PDF into ULTIMATE LECTURE-STYLE NOTES that are clear, comprehensive, and exam-focused.
 
 Your output must:
@@ -1185,7 +1639,7 @@ Your output must:
 Remember: Your output should serve both slow learners (clear explanations) and fast learners (advanced insights).
 """
 
-        enhanced_prompt = f"""
+    enhanced_prompt = f"""
 EXTRACTED TABLES SUMMARY:
 {tables_summary}
 
@@ -1203,46 +1657,27 @@ Transform this raw material into ULTIMATE LECTURE-STYLE NOTES that:
 REMEMBER: Your output should serve both slow learners (clear explanations) and fast learners (advanced insights).
 """
 
-        # Call AI API
-        headers = {
-            "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://nelavista.com",
-            "X-Title": "Nellavista Turbo-Style Notes Generator"
-        }
-
-        payload = {
-            "model": "openai/gpt-4-turbo",
-            "messages": [
+    # Call AI API
+    if estimate_tokens(text) > NOTES_CHUNK_TOKENS:
+        notes = map_reduce_notes(text, filename, PDF_ANALYSIS_PROMPT, enhanced_prompt)
+    else:
+        notes = llm_client.chat(
+            [
                 {"role": "system", "content": PDF_ANALYSIS_PROMPT},
-                {"role": "user", "content": enhanced_prompt}
+                {"role": "user", "content": enhanced_prompt + f"\n\nRAW DOCUMENT TEXT:\n\n{text}"}
             ],
-            "temperature": 0.2,
-            "max_tokens": 7000
-        }
-
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=180
+            model=NOTES_MODEL,
+            temperature=0.2,
+            max_tokens=7000,
+            timeout=180,
+            title="Nellavista Turbo-Style Notes Generator",
+            queue_timeout=NOTES_QUEUE_TIMEOUT
         )
 
-        if response.status_code == 200:
-            data = response.json()
-            notes = data["choices"][0]["message"]["content"]
-
-            # Enhance with extracted content
-            enhanced_notes = enhance_notes_with_extractions(notes, tables, images)
-
-            return enhanced_notes
-        else:
-            debug_print(f"❌ AI API error: {response.status_code}")
-            raise Exception(f"AI service error: {response.status_code}")
+    # Enhance with extracted content
+    enhanced_notes = enhance_notes_with_extractions(notes, tables, images)
 
-    except Exception as e:
-        debug_print(f"❌ AI note generation failed: {e}")
-        return generate_structured_fallback(text, tables, images, filename, document_analysis)
+    return enhanced_notes
 
 def enhance_notes_with_extractions(notes, tables, images):
     """Enhance AI notes with actual extracted content."""
@@ -1269,7 +1704,7 @@ def enhance_notes_with_extractions(notes, tables, images):
 
         for i, img in enumerate(images[:3], 1):
             image_section += f"### Image {i} (Page {img.get('page', '?')})\n\n"
-            image_section += f"![{img.get('alt', 'Diagram')}]({img.get('url', '')})\n"
+            image_section += f"[![{img.get('alt', 'Diagram')}]({img.get('thumbnail_url') or img.get('url', '')})]({img.get('url', '')})\n"
             image_section += f"*{img.get('alt', 'Document diagram')}*\n\n"
 
         enhanced += image_section
@@ -1316,7 +1751,7 @@ def generate_structured_fallback(text, tables, images, filename, document_analys
     if images:
         notes += f"## 🖼️ Extracted Images ({len(images)} found)\n\n"
         for img in images[:2]:
-            notes += f"![{img.get('alt', 'Diagram')}]({img.get('url', '')})\n"
+            notes += f"[![{img.get('alt', 'Diagram')}]({img.get('thumbnail_url') or img.get('url', '')})]({img.get('url', '')})\n"
             notes += f"*{img.get('alt', 'Document image')}*\n\n"
 
     # Content preview
@@ -1332,19 +1767,92 @@ def generate_structured_fallback(text, tables, images, filename, document_analys
 
     return notes
 
+@job_queue.task('turbo_notes')
+def build_turbo_notes(text, tables, images, filename, document_analysis):
+    """Background job: generate notes and the payload /understand used to return."""
+    try:
+        notes = generate_turbo_style_notes(text, tables, images, filename, document_analysis)
+        fallback = False
+    except LLMError as e:
+        debug_print(f"❌ AI note generation failed: {e}")
+        raise  # the job fails and can be retried
+    except Exception as e:
+        debug_print(f"❌ Note generation error, using the structured extraction: {e}")
+        notes = generate_structured_fallback(text, tables, images, filename, document_analysis)
+        fallback = True
+
+    # Prepare data for frontend
+    image_urls = []
+    for img in images[:5]:
+        if os.path.exists(img.get("path", "")):
+            image_urls.append({
+                "url": img.get("url", ""),
+                "thumbnail_url": img.get("thumbnail_url") or img.get("url", ""),
+                "alt": img.get("alt", "Diagram"),
+                "page": img.get("page", 1),
+                "pages": img.get("pages", [img.get("page", 1)])
+            })
+
+    table_data = []
+    for table in tables[:5]:
+        table_data.append({
+            "markdown": table.get("markdown", ""),
+            "page": table.get("page", 1),
+            "preview": table.get("text", "")[:150] + "..."
+        })
+
+    debug_print(f"✅ Generated {len(notes.split())} words of comprehensive notes")
+
+    return {
+        "success": True,
+        "mode": "structured_fallback" if fallback else "turbo_comprehensive",
+        "fallback": fallback,
+        "markdown": notes,
+        "filename": filename,
+        "images": image_urls,
+        "tables": table_data,
+        "note_type": "lecture_textbook_style",
+        "word_count": len(notes.split()),
+        "has_tables": len(tables) > 0,
+        "has_images": len(images) > 0,
+        "notes_timestamp": datetime.utcnow().isoformat()
+    }
+
+# ============================================
+# Analyzer content (server-side, see content_store.py)
+# ============================================
+def load_analyzer_content():
+    """The current session's analyzer content from the content store, or None."""
+    content_id = session.get('analyzer_content_id')
+    if not content_id:
+        return None
+    content = content_store.get(content_id)
+    if content is None:
+        session.pop('analyzer_content_id', None)
+    else:
+        touch_images(content.get("images"))  # the images live as long as the analysis that shows them
+    return content
+
+def save_analyzer_content(content):
+    """Store analyzer content server-side and keep only its id in the session cookie."""
+    content_store.put(content["session_id"], content)
+    session['analyzer_content_id'] = content["session_id"]
+    session.pop('analyzer_content', None)  # drop content left in cookies by older versions
+
 @app.route('/understand', methods=['POST'])
 @login_required
+@rate_limited('understand', '5/300')
 def understand_content():
-    """Generate Turbo AI-style comprehensive notes."""
+    """Queue Turbo AI-style note generation and return a job id to poll."""
 
     try:
-        if 'analyzer_content' not in session:
+        if 'analyzer_content_id' not in session:
             return jsonify({
                 "success": False,
                 "error": "No PDF uploaded. Please upload a PDF first."
             }), 400
 
-        content = session.get('analyzer_content')
+        content = load_analyzer_content()
 
         if not content:
             return jsonify({
@@ -1352,6 +1860,15 @@ def understand_content():
                 "error": "Session expired. Please upload the PDF again."
             }), 400
 
+        if content.get("status") == "processing":
+            return jsonify({
+                "success": False,
+                "error": "The PDF is still being analyzed. Please wait for it to finish."
+            }), 409
+
+        if content.get("status") == "failed":
+            return jsonify({"success": False, "error": content.get("error", UNREADABLE_PDF_ERROR)}), 400
+
         # Get extracted content
         text = content.get("text", "")
         images = content.get("images", [])
@@ -1370,47 +1887,22 @@ def understand_content():
         debug_print(f"   - Tables to incorporate: {len(tables)}")
         debug_print(f"   - Images to reference: {len(images)}")
 
-        # Generate comprehensive notes
-        notes = generate_turbo_style_notes(text, tables, images, filename, document_analysis)
-
-        # Update session
-        content["generated_notes"] = notes
-        content["notes_timestamp"] = datetime.utcnow().isoformat()
-        content["markdown"] = notes
-        session['analyzer_content'] = content
-
-        # Prepare data for frontend
-        image_urls = []
-        for img in images[:5]:
-            if os.path.exists(img.get("path", "")):
-                image_urls.append({
-                    "url": img.get("url", ""),
-                    "alt": img.get("alt", "Diagram"),
-                    "page": img.get("page", 1)
-                })
-
-        table_data = []
-        for table in tables[:5]:
-            table_data.append({
-                "markdown": table.get("markdown", ""),
-                "page": table.get("page", 1),
-                "preview": table.get("text", "")[:150] + "..."
-            })
+        # Generate comprehensive notes in the background
+        job_id = job_queue.enqueue(
+            'turbo_notes', text, tables, images, filename, document_analysis,
+            owner=session['user']['username']
+        )
 
-        debug_print(f"✅ Generated {len(notes.split())} words of comprehensive notes")
+        content["notes_job_id"] = job_id
+        content.pop("generated_notes", None)
+        save_analyzer_content(content)
 
         return jsonify({
             "success": True,
-            "mode": "turbo_comprehensive",
-            "markdown": notes,
-            "filename": filename,
-            "images": image_urls,
-            "tables": table_data,
-            "note_type": "lecture_textbook_style",
-            "word_count": len(notes.split()),
-            "has_tables": len(tables) > 0,
-            "has_images": len(images) > 0
-        })
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": url_for('get_analyzer_status', job_id=job_id)
+        }), 202
 
     except Exception as e:
         debug_print(f"[UNDERSTAND] Error: {e}")
@@ -1425,18 +1917,13 @@ def understand_content():
 def clear_analyzer_content():
     """Clear uploaded content."""
     try:
-        content = session.get('analyzer_content', {})
-        session_id = content.get('session_id')
+        session_id = session.get('analyzer_content_id')
 
-        # Remove session images folder
+        # Extracted images are shared between documents; the disk janitor expires them
         if session_id:
-            session_folder = os.path.join(app.config['IMAGE_FOLDER'], session_id)
-            if os.path.exists(session_folder):
-                shutil.rmtree(session_folder)
-                debug_print(f"Cleared image folder: {session_folder}")
-
-        if 'analyzer_content' in session:
-            session.pop('analyzer_content')
+            content_store.delete(session_id)
+        session.pop('analyzer_content_id', None)
+        session.pop('analyzer_content', None)
 
         debug_print("✅ Analyzer content cleared")
 
@@ -1455,9 +1942,27 @@ def clear_analyzer_content():
 @app.route('/analyzer/status', methods=['GET'])
 @login_required
 def get_analyzer_status():
-    """Get processing status."""
+    """Get processing status, including the note generation job (queued/running/done/failed)."""
     try:
-        content = session.get('analyzer_content')
+        content = load_analyzer_content()
+        job_id = request.args.get('job_id') or (content or {}).get('notes_job_id')
+
+        job_info = None
+        if job_id:
+            job = job_queue.get(job_id)
+            if job and job.get('owner') == session['user']['username']:
+                job_info = {"id": job_id, "status": job['status'], "error": job.get('error')}
+                if job['status'] == 'done':
+                    job_info['result'] = job['result']
+
+                    # Keep the finished notes with the analyzer content
+                    if content and content.get('notes_job_id') == job_id and 'generated_notes' not in content:
+                        content["generated_notes"] = job['result']['markdown']
+                        content["notes_timestamp"] = job['result'].get('notes_timestamp')
+                        content["markdown"] = job['result']['markdown']
+                        save_analyzer_content(content)
+            else:
+                job_info = {"id": job_id, "status": "unknown", "error": "Job not found or expired"}
 
         if content and content.get('type') == 'pdf':
             has_notes = 'generated_notes' in content
@@ -1466,19 +1971,22 @@ def get_analyzer_status():
                 "has_content": True,
                 "has_notes": has_notes,
                 "content_type": 'pdf',
+                "status": content.get('status', 'ready'),
                 "filename": content.get('filename'),
                 "image_count": len(content.get('images', [])),
                 "table_count": len(content.get('tables', [])),
                 "text_length": len(content.get('text', '')),
                 "notes_length": len(content.get('generated_notes', '')) if has_notes else 0,
-                "session_id": content.get('session_id', 'unknown')
+                "session_id": content.get('session_id', 'unknown'),
+                "job": job_info
             })
         else:
             return jsonify({
                 "success": True,
                 "has_content": False,
                 "has_notes": False,
-                "message": "No PDF content uploaded"
+                "message": "No PDF content uploaded",
+                "job": job_info
             })
 
     except Exception as e:
@@ -1492,7 +2000,9 @@ def get_analyzer_status():
 def serve_extracted_image(filename):
     """Serve extracted images."""
     try:
-        return send_from_directory(app.config['IMAGE_FOLDER'], filename)
+        response = send_from_directory(app.config['IMAGE_FOLDER'], filename)
+        touch_image(os.path.basename(filename).split('.')[0])
+        return response
     except Exception as e:
         debug_print(f"Error serving image {filename}: {e}")
         return "Image not found", 404
@@ -1637,6 +2147,123 @@ def safe_markdown_to_html(text):
 # ============================================
 # AI TUTOR ROUTES - WITH SESSION MEMORY (last 5 messages) & HTML‑ONLY OUTPUT
 # ============================================
+GRACEFUL_FALLBACK = "I'm having a little trouble answering right now, but please try again."
+
+def material_url(path, page=None):
+    """Static URL of a study material; PDFs open at the given page."""
+    url = url_for('static', filename='materials/' + path)
+    return f"{url}#page={page}" if page and path.lower().endswith('.pdf') else url
+
+def material_sources(passages):
+    """Client-facing citation list for retrieved passages ([1], [2], ... in the answer)."""
+    return [
+        {
+            "id": number,
+            "chunk": passage["id"],
+            "title": passage["title"],
+            "page": passage["page"],
+            "score": passage["score"],
+            "url": material_url(passage["path"], passage["page"])
+        }
+        for number, passage in enumerate(passages, 1)
+    ]
+
+def save_question_record(username, question, answer):
+    """Persist a question/answer pair to the UserQuestions table."""
+    try:
+        question_record = UserQuestions(
+            username=username,
+            question=question,
+            answer=answer,
+            memory_layer='chat'
+        )
+        db.session.add(question_record)
+        db.session.commit()
+        print(f"💾 Saved Q&A to database for user {username} (id: {question_record.id})")
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Failed to save message to database: {e}")
+        traceback.print_exc()
+
+def get_semantic_scope(username, course=None):
+    """Semantic cache scope for a user: requested course, else profile department."""
+    department = None
+    if not course:
+        try:
+            profile = UserProfile.query.filter_by(username=username).first()
+            department = profile.department if profile else None
+        except Exception as e:
+            debug_print(f"⚠️ Could not load profile for cache scope: {e}")
+    return semantic_scope(course=course, department=department)
+
+def wants_event_stream(flag):
+    """True when the client asked for a streamed (SSE) answer."""
+    if str(flag).lower() in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def service_busy_response(error):
+    """Quick 503 with Retry-After when the AI upstream is shedding load or its circuit is open."""
+    retry_after = max(1, math.ceil(error.retry_after))
+    response = jsonify({
+        "success": False,
+        "answer": GRACEFUL_FALLBACK,
+        "error": "The AI tutor is busy right now. Please try again shortly.",
+        "retry_after": retry_after
+    })
+    return response, 503, {"Retry-After": str(retry_after)}
+
+def uploaded_file_count():
+    """Rate-limit cost of /ask_with_files: one token plus one per attached file."""
+    return 1 + len([f for f in request.files.getlist('files') if f and f.filename])
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def stream_tutor_answer(username, messages, question, model="openai/gpt-4o-mini", cache_scope=None, sources=None,
+                        extra=None):
+    """
+    Stream an AI tutor answer to the browser as Server-Sent Events.
+
+    Emits one `data: {"token": ...}` event per delta and a final `done` event
+    carrying the full answer (and the course material `sources` it was grounded in, plus any `extra` fields). The answer is
+    saved to UserQuestions when the stream completes and merged into session memory on the next request.
+    """
+    mark_pending_answer(question)
+
+    @stream_with_context
+    def generate():
+        parts = []
+        try:
+            for token in llm_client.stream_chat(messages, model=model, temperature=0.5, max_tokens=1500, timeout=30):
+                parts.append(token)
+                yield sse_event({"token": token})
+        except LLMUnavailableError as e:
+            yield sse_event({"success": False, "answer": GRACEFUL_FALLBACK,
+                             "retry_after": max(1, math.ceil(e.retry_after))}, event="done")
+            return
+        except LLMError as e:
+            debug_print(f"❌ Streaming answer failed: {e}")
+            yield sse_event({"success": True, "answer": GRACEFUL_FALLBACK, "partial": bool(parts)}, event="done")
+            return
+
+        final_answer = "".join(parts)
+        if not final_answer.strip():
+            yield sse_event({"success": True, "answer": GRACEFUL_FALLBACK}, event="done")
+            return
+
+        save_question_record(username, question, final_answer)
+        if cache_scope:
+            semantic_cache.add(question, final_answer, cache_scope, sources=sources)
+        yield sse_event({"success": True, "answer": final_answer, "sources": sources or [], **(extra or {})}, event="done")
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @app.route('/talk-to-nelavista')
 @login_required
 def talk_to_nelavista():
@@ -1645,14 +2272,14 @@ def talk_to_nelavista():
 
 @app.route('/ask_with_files', methods=['POST'])
 @login_required
+@rate_limited('ask_with_files', '10/60', cost=uploaded_file_count)
 def ask_with_files():
-    GRACEFUL_FALLBACK = "I'm having a little trouble answering right now, but please try again."
-
     try:
         username = session['user']['username']
 
         message = request.form.get('message', '').strip()
-        if not message and 'files' not in request.files:
+        file_ids = request.form.getlist('file_ids')
+        if not message and 'files' not in request.files and not file_ids:
             return jsonify({"success": True, "answer": GRACEFUL_FALLBACK})
 
         # ---- SESSION MEMORY ----
@@ -1660,39 +2287,22 @@ def ask_with_files():
 
         # Process files
         file_texts = []
-        vision_images = []
-        has_pdfs = False
+        vision_images = VisionImageSet()  # resized, re-encoded and deduplicated
 
+        # Files uploaded earlier are referenced by file_id; new uploads are registered for follow-ups
+        records, expired_file_ids = resolve_file_ids(file_ids, username)
+        uploaded = []
         if 'files' in request.files:
             files = request.files.getlist('files')
             for file in files:
                 if file and file.filename and file.filename.strip():
-                    filename = file.filename.lower()
-
-                    if filename.endswith('.pdf'):
-                        has_pdfs = True
-                        file.seek(0)
-                        text = extract_text_from_pdf(file)
-                        if text:
-                            file_texts.append(f"[PDF: {file.filename}]\n{text}")
-
-                    elif filename.endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                        file.seek(0)
-                        image_bytes = file.read()
-                        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-
-                        if filename.endswith('.png'):
-                            mime_type = 'image/png'
-                        elif filename.endswith('.gif'):
-                            mime_type = 'image/gif'
-                        else:
-                            mime_type = 'image/jpeg'
-
-                        vision_images.append({
-                            'base64': image_base64,
-                            'mime_type': mime_type,
-                            'filename': file.filename
-                        })
+                    record = register_uploaded_file(file, username)
+                    if record:
+                        uploaded.append(record)
+        add_registered_files(records + uploaded, file_texts, vision_images, question=message)
+        file_info = {"files": [file_reference(record) for record in uploaded]}
+        if expired_file_ids:
+            file_info["expired_file_ids"] = expired_file_ids
 
         user_content_parts = []
         if message:
@@ -1701,7 +2311,8 @@ def ask_with_files():
             user_content_parts.append("DOCUMENT CONTENT:\n" + "\n\n".join(file_texts))
 
         if not user_content_parts and not vision_images:
-            return jsonify({"success": True, "answer": "Please provide a message or upload files for analysis."})
+            return jsonify({"success": True, "answer": "Please provide a message or upload files for analysis.",
+                            **file_info})
 
         user_content = "\n\n".join(user_content_parts) if user_content_parts else "Please analyze the uploaded image(s)."
 
@@ -1770,8 +2381,7 @@ Teach clearly, patiently, and in a way students love to read and keep using. Eve
 Your final answer should be so clear and pleasant that a student would *want* to read it and come back for more."""
         messages = [{"role": "system", "content": system_prompt}]
 
-        for mem in session_memory:
-            messages.append({"role": mem["role"], "content": mem["content"]})
+        messages.extend(get_memory_messages(session_memory))
 
         openrouter_model = "openai/gpt-4o-mini"
 
@@ -1789,56 +2399,26 @@ Your final answer should be so clear and pleasant that a student would *want* to
         else:
             messages.append({"role": "user", "content": user_content})
 
-        headers = {
-            "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://nelavista.com",
-            "X-Title": "Nelavista AI Tutor"
-        }
-
-        payload = {
-            "model": openrouter_model,
-            "messages": messages,
-            "temperature": 0.5,
-            "max_tokens": 1500
-        }
-
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload, timeout=30)
+        if wants_event_stream(request.form.get('stream')):
+            return stream_tutor_answer(username, messages, user_content, model=openrouter_model, extra=file_info)
 
-        if response.status_code != 200:
+        try:
+            ai_response = llm_client.chat(messages, model=openrouter_model, temperature=0.5, max_tokens=1500, timeout=30)
+        except LLMUnavailableError as e:
+            return service_busy_response(e)
+        except LLMError:
             return jsonify({"success": True, "answer": GRACEFUL_FALLBACK})
 
-        response_json = response.json()
-        ai_response = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-
-        if not ai_response or not ai_response.strip():
-            ai_response = GRACEFUL_FALLBACK
-
         final_answer = ai_response
 
         # ===== SAVE TO DATABASE =====
-        try:
-            question_record = UserQuestions(
-                username=username,
-                question=user_content,
-                answer=final_answer,
-                memory_layer='chat'
-            )
-            db.session.add(question_record)
-            db.session.commit()
-            print(f"💾 Saved Q&A to database for user {username} (id: {question_record.id})")
-        except Exception as e:
-            db.session.rollback()
-            print(f"❌ Failed to save message to database: {e}")
-            traceback.print_exc()
+        save_question_record(username, user_content, final_answer)
         # =============================
 
         add_to_session_memory("user", user_content)
         add_to_session_memory("assistant", final_answer)
 
-        cleanup_old_files()
-
-        return jsonify({"success": True, "answer": final_answer})
+        return jsonify({"success": True, "answer": final_answer, **file_info})
 
     except Exception as e:
         debug_print(f"❌ Unhandled error in /ask_with_files: {e}")
@@ -1847,9 +2427,8 @@ Your final answer should be so clear and pleasant that a student would *want* to
 
 @app.route('/ask', methods=['POST'])
 @login_required
+@rate_limited('ask', '20/60')
 def ask():
-    GRACEFUL_FALLBACK = "I'm having a little trouble answering right now, but please try again."
-
     try:
         data = request.get_json() or {}
         message = data.get('message', '').strip()
@@ -1863,6 +2442,29 @@ def ask():
 
         session_memory = get_session_memory()
 
+        # ---- FILES uploaded earlier (file_ids from /upload or /ask_with_files) ----
+        records, expired_file_ids = resolve_file_ids(data.get('file_ids') or data.get('file_id'), username)
+        file_texts, vision_images = [], VisionImageSet()
+        add_registered_files(records, file_texts, vision_images, question=message)
+        file_info = {"expired_file_ids": expired_file_ids} if expired_file_ids else {}
+
+        # ---- SEMANTIC CACHE (first question of a conversation only) ----
+        # Follow-up questions depend on the conversation so far and are never matched,
+        # and neither are questions about files.
+        cache_scope = None
+        if semantic_cache and not session_memory and not records:
+            cache_scope = get_semantic_scope(username, data.get('course'))
+            cached = semantic_cache.lookup(message, cache_scope)
+            if cached:
+                save_question_record(username, message, cached["answer"])
+                add_to_session_memory("user", message)
+                add_to_session_memory("assistant", cached["answer"])
+                payload = {"success": True, "answer": cached["answer"], "sources": cached["sources"], "cached": True,
+                           **file_info}
+                if wants_event_stream(data.get('stream')):
+                    return Response(sse_event(payload, event="done"), mimetype='text/event-stream')
+                return jsonify(payload)
+
         system_prompt = """You are Nelavista, an advanced AI tutor created by Afeez Adewale Tella for Nigerian university students (100–400 level).
 
 ## YOUR ROLE
@@ -1922,59 +2524,61 @@ Your final answer should be so clear and pleasant that a student would *want* to
 
         messages = [{"role": "system", "content": system_prompt}]
 
-        for mem in session_memory:
-            messages.append({"role": mem["role"], "content": mem["content"]})
+        # ---- RETRIEVAL: ground the answer in the course materials ----
+        # A follow-up without a topic of its own ("give me another example") is about the previous question
+        retrieval_query = message
+        if not content_terms(message):
+            retrieval_query = next((turn["content"] for turn in reversed(session_memory)
+                                    if turn.get("role") == "user"), "")
+        passages = retriever.retrieve(retrieval_query, course=data.get('course'))
+        sources = material_sources(passages)
+        if passages:
+            messages.append({"role": "system", "content": format_passages(passages)})
 
-        messages.append({"role": "user", "content": message})
-
-        headers = {
-            "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://nelavista.com",
-            "X-Title": "Nelavista AI Tutor"
-        }
+        messages.extend(get_memory_messages(session_memory))
 
-        payload = {
-            "model": "openai/gpt-4o-mini",
-            "messages": messages,
-            "temperature": 0.5,
-            "max_tokens": 1500
-        }
+        user_content = message
+        if file_texts:
+            user_content += "\n\nDOCUMENT CONTENT:\n" + "\n\n".join(file_texts)
+        model = "openai/gpt-4o-mini"
+        if vision_images:
+            content_parts = [{"type": "text", "text": user_content}]
+            for image_data in vision_images:
+                content_parts.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{image_data['mime_type']};base64,{image_data['base64']}"
+                    }
+                })
+            messages.append({"role": "user", "content": content_parts})
+            model = "openai/gpt-4o"
+        else:
+            messages.append({"role": "user", "content": user_content})
 
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload, timeout=30)
+        if wants_event_stream(data.get('stream')):
+            return stream_tutor_answer(username, messages, message, model=model, cache_scope=cache_scope,
+                                       sources=sources, extra=file_info)
 
-        if response.status_code != 200:
+        try:
+            ai_response = llm_client.chat(messages, model=model, temperature=0.5, max_tokens=1500, timeout=30)
+        except LLMUnavailableError as e:
+            return service_busy_response(e)
+        except LLMError:
             return jsonify({"success": True, "answer": GRACEFUL_FALLBACK})
 
-        response_json = response.json()
-        ai_response = response_json.get("choices", [{}])[0].get("message", {}).get("content", "")
-
-        if not ai_response or not ai_response.strip():
-            ai_response = GRACEFUL_FALLBACK
-
         final_answer = ai_response
 
         # ===== SAVE TO DATABASE =====
-        try:
-            question_record = UserQuestions(
-                username=username,
-                question=message,
-                answer=final_answer,
-                memory_layer='chat'
-            )
-            db.session.add(question_record)
-            db.session.commit()
-            print(f"💾 Saved Q&A to database for user {username} (id: {question_record.id})")
-        except Exception as e:
-            db.session.rollback()
-            print(f"❌ Failed to save message to database: {e}")
-            traceback.print_exc()
+        save_question_record(username, message, final_answer)
         # =============================
 
+        if cache_scope:
+            semantic_cache.add(message, final_answer, cache_scope, sources=sources)
+
         add_to_session_memory("user", message)
         add_to_session_memory("assistant", final_answer)
 
-        return jsonify({"success": True, "answer": final_answer})
+        return jsonify({"success": True, "answer": final_answer, "sources": sources, **file_info})
 
     except Exception as e:
         debug_print(f"❌ Unhandled error in /ask: {e}")
@@ -1997,16 +2601,7 @@ def upload_file():
 
     username = session['user']['username']
 
-    # Delete the previous uploaded file if it exists
-    old_file_path = session.get('last_file_path')
-    if old_file_path and os.path.exists(old_file_path):
-        try:
-            os.remove(old_file_path)
-            debug_print(f"🗑️ Deleted old file: {old_file_path}")
-        except Exception as e:
-            debug_print(f"⚠️ Error deleting old file: {e}")
-
-    # Clear old file session data
+    # Clear old file session data (the earlier upload stays available by its file_id)
     session.pop('last_file_path', None)
     session.pop('last_file_type', None)
     session.pop('last_file_content', None)
@@ -2021,29 +2616,20 @@ def upload_file():
         if not allowed_file(filename):
             return jsonify({"success": False, "error": "Unsupported file type. Use PDF or images."}), 400
 
-        file_size = 0
-
-        # Read file content once
-        file_data = file.read()
-        file_size = len(file_data)
-        file.seek(0)
-
-        if filename.endswith('.pdf'):
-            # Generate unique file ID
-            file_id = str(uuid.uuid4())
+        # Stored once; follow-up questions send the file_id instead of the file
+        record = register_uploaded_file(file, username, with_ocr=True)
 
+        if record and record["type"] == "pdf":
             # Store references in session
-            session['last_file_id'] = file_id
+            session['last_file_id'] = record["file_id"]
             session['last_file_type'] = 'pdf'
             session['last_file_name'] = filename
             session['last_upload_time'] = time.time()
 
-            # Extract text for preview (simplified)
-            file.seek(0)
-            text = extract_text_from_pdf(file)
+            text = record["text"]
             preview = text[:300] + "..." if text else "PDF uploaded successfully"
 
-            debug_print(f"📄 PDF uploaded: {filename}, Size: {file_size} bytes")
+            debug_print(f"📄 PDF uploaded: {filename}, Size: {record['size']} bytes")
 
             return jsonify({
                 "success": True,
@@ -2051,52 +2637,38 @@ def upload_file():
                 "preview": preview,
                 "type": "pdf",
                 "filename": file.filename,
-                "size_kb": round(file_size / 1024, 1),
+                "size_kb": round(record["size"] / 1024, 1),
                 "has_text": bool(text),
-                "file_id": file_id
+                "file_id": record["file_id"],
+                "expires_in": FILE_REGISTRY_TTL
             })
 
-        elif filename.endswith(('.png', '.jpg', '.jpeg', '.gif')):
-            # Generate unique filename for image
-            file_id = str(uuid.uuid4())
-            ext = filename.rsplit('.', 1)[1].lower()
-            image_filename = f"{file_id}.{ext}"
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-
-            # Save image to disk
-            with open(image_path, 'wb') as f:
-                f.write(file_data)
-
-            # Encode image to base64 for vision
-            image_base64 = base64.b64encode(file_data).decode('utf-8')
-
+        elif record:
             # Store references in session
-            session['last_file_id'] = file_id
+            session['last_file_id'] = record["file_id"]
             session['last_file_type'] = 'image'
-            session['last_file_name'] = image_filename
-            session['last_file_path'] = image_path
-            session['last_image_base64'] = image_base64
+            session['last_file_name'] = file.filename
             session['last_upload_time'] = time.time()
 
-            # Extract text via OCR for fallback
-            file.seek(0)
-            text = extract_text_from_image(file)
+            # OCR text (kept in the registry as fallback); none means a diagram or photo
+            text = record["text"] or "DIAGRAM_OR_VISUAL_CONTENT"
 
             # Determine if it's text or diagram
             is_diagram = is_diagram_or_visual(text)
 
-            debug_print(f"🖼️ Image saved: {image_filename}, Size: {file_size} bytes")
+            debug_print(f"🖼️ Image registered: {file.filename}, Size: {record['size']} bytes")
 
             return jsonify({
                 "success": True,
                 "message": "Image uploaded - ready for vision analysis",
                 "type": "image",
                 "filename": file.filename,
-                "size_kb": round(file_size / 1024, 1),
+                "size_kb": round(record["size"] / 1024, 1),
                 "is_diagram": is_diagram,
                 "has_text": text != "DIAGRAM_OR_VISUAL_CONTENT" and len(text.strip()) > 10,
                 "vision_ready": True,
-                "file_id": file_id
+                "file_id": record["file_id"],
+                "expires_in": FILE_REGISTRY_TTL
             })
 
         else:
@@ -2394,48 +2966,93 @@ def materials():
         materials=materials
     )
 
+MATERIALS_EXTERNAL_FALLBACK = os.getenv('MATERIALS_EXTERNAL_FALLBACK', 'False').lower() == 'true'
+
+def search_external_materials(query, limit=5, department=None):
+    """Scrape PDFDrive and OpenLibrary in parallel (slow; only used as a fallback)."""
+    def search_pdfdrive():
+        pdfs = []
+        try:
+            pdf_html = requests.get(
+                f"https://www.pdfdrive.com/search?q={query}",
+                headers={"User-Agent": "Mozilla/5.0"},
+                timeout=10
+            ).text
+            soup = BeautifulSoup(pdf_html, 'html.parser')
+            for book in soup.select('.file-left')[:limit * 2]:
+                title = book.select_one('img')['alt']
+                if department and not is_academic_book(title, query, department):
+                    continue
+                link = "https://www.pdfdrive.com" + book.parent['href']
+                pdfs.append({'title': title, 'link': link})
+        except Exception as e:
+            pdfs = [{"error": str(e)}]
+        return pdfs[:limit]
+
+    def search_openlibrary():
+        books = []
+        try:
+            ol_data = requests.get(
+                f"https://openlibrary.org/search.json?q={query}",
+                timeout=10
+            ).json()
+            for doc in ol_data.get("docs", [])[:limit * 2]:
+                title = doc.get("title", "")
+                if department and not is_academic_book(title, query, department):
+                    continue
+                books.append({
+                    "title": doc.get("title"),
+                    "author": ', '.join(doc.get("author_name", [])) if doc.get("author_name") else "Unknown",
+                    "link": f"https://openlibrary.org{doc.get('key')}"
+                })
+        except Exception as e:
+            books = [{"error": str(e)}]
+        return books[:limit]
+
+    pdfdrive = eventlet.spawn(search_pdfdrive)
+    openlibrary = eventlet.spawn(search_openlibrary)
+    return pdfdrive.wait(), openlibrary.wait()
+
+def search_local_materials(query, limit=10, course=None):
+    """BM25 search over static/materials with links that open the matching page."""
+    found = material_search.search(query, limit=limit, course=course)
+    for result in found["results"]:
+        result["url"] = material_url(result["path"], result["page"])
+    return found
+
 @app.route('/api/materials')
 def get_study_materials():
-    """API endpoint to fetch study materials."""
+    """Search the local study materials library (external sources only as a fallback)."""
     query = request.args.get("q", "python")
-
-    pdfs = []
+    course = request.args.get("course")
     try:
-        pdf_html = requests.get(
-            f"https://www.pdfdrive.com/search?q={query}",
-            headers={"User-Agent": "Mozilla/5.0"},
-            timeout=10
-        ).text
-        soup = BeautifulSoup(pdf_html, 'html.parser')
-        for book in soup.select('.file-left')[:5]:
-            title = book.select_one('img')['alt']
-            link = "https://www.pdfdrive.com" + book.parent['href']
-            pdfs.append({'title': title, 'link': link})
-    except Exception as e:
-        pdfs = [{"error": str(e)}]
+        limit = max(1, min(int(request.args.get("limit", 10)), 50))
+    except ValueError:
+        limit = 10
 
-    books = []
-    try:
-        ol_data = requests.get(
-            f"https://openlibrary.org/search.json?q={query}",
-            timeout=10
-        ).json()
-        for doc in ol_data.get("docs", [])[:5]:
-            books.append({
-                "title": doc.get("title"),
-                "author": ', '.join(doc.get("author_name", [])) if doc.get("author_name") else "Unknown",
-                "link": f"https://openlibrary.org{doc.get('key')}"
-            })
-    except Exception as e:
-        books = [{"error": str(e)}]
+    started = time.time()
+    found = search_local_materials(query, limit=limit, course=course)
+    took_ms = round((time.time() - started) * 1000, 1)
+
+    # External scraping is slow and flaky: only on request, or when enabled and nothing matched locally
+    external = request.args.get("external", "").lower() in ('1', 'true', 'yes')
+    pdfs, books = [], []
+    if external or (not found["results"] and MATERIALS_EXTERNAL_FALLBACK):
+        pdfs, books = search_external_materials(query)
 
     return jsonify({
         "query": query,
+        "course": course,
+        "results": found["results"],
+        "facets": found["facets"],
+        "total_pages": found["total_pages"],
+        "took_ms": took_ms,
         "pdfs": pdfs,
         "books": books
     })
 
 @app.route('/ai/materials')
+@rate_limited('ai_materials', '10/60')
 def ai_materials():
     """API endpoint for AI-generated study materials."""
     topic = request.args.get("topic")
@@ -2456,76 +3073,32 @@ End with: '📚 Here are materials to study further:'
 
     explanation = ""
     try:
-        headers = {
-            "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://nelavista.com",
-            "X-Title": "Nelavista AI Tutor"
-        }
-
-        payload = {
-            "model": "openai/gpt-4o-mini",
-            "messages": [
+        explanation = llm_client.chat(
+            [
                 {"role": "system", "content": "You are an educational AI assistant."},
                 {"role": "user", "content": prompt}
             ],
-            "temperature": 0.7,
-            "max_tokens": 500
-        }
-
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
+            temperature=0.7,
+            max_tokens=500,
             timeout=30
         )
-
-        if response.status_code == 200:
-            explanation = response.json()["choices"][0]["message"]["content"]
-        else:
-            explanation = f"Let me help you learn {topic}. Start with the basic concepts and build from there. 📚 Here are materials to study further:"
     except Exception as e:
         explanation = f"Let me help you learn {topic}. Start with the basic concepts and build from there. 📚 Here are materials to study further:"
 
-    # Search PDFDrive
-    pdfs = []
-    try:
-        pdf_html = requests.get(
-            f"https://www.pdfdrive.com/search?q={topic}",
-            headers={"User-Agent": "Mozilla/5.0"},
-            timeout=10
-        ).text
-        soup = BeautifulSoup(pdf_html, 'html.parser')
-        for book in soup.select('.file-left')[:10]:
-            title = book.select_one('img')['alt']
-            if is_academic_book(title, topic, department):
-                link = "https://www.pdfdrive.com" + book.parent['href']
-                pdfs.append({'title': title, 'link': link})
-    except Exception as e:
-        pdfs = [{"error": str(e)}]
+    # Local materials library first; scraping only as an optional fallback
+    query = topic if goal == "general" else f"{topic} {goal}"
+    found = search_local_materials(query, limit=10, course=request.args.get("course"))
 
-    # Search OpenLibrary
-    books = []
-    try:
-        ol_data = requests.get(
-            f"https://openlibrary.org/search.json?q={topic}",
-            timeout=10
-        ).json()
-        for doc in ol_data.get("docs", [])[:10]:
-            title = doc.get("title", "")
-            if is_academic_book(title, topic, department):
-                books.append({
-                    "title": doc.get("title"),
-                    "author": ', '.join(doc.get("author_name", [])) if doc.get("author_name") else "Unknown",
-                    "link": f"https://openlibrary.org{doc.get('key')}"
-                })
-    except Exception as e:
-        books = [{"error": str(e)}]
+    external = request.args.get("external", "").lower() in ('1', 'true', 'yes')
+    pdfs, books = [], []
+    if external or (not found["results"] and MATERIALS_EXTERNAL_FALLBACK):
+        pdfs, books = search_external_materials(topic, limit=10, department=department)
 
-    if not pdfs and not books:
+    if not found["results"] and not pdfs and not books:
         return jsonify({
             "query": topic,
             "ai_explanation": explanation,
+            "materials": [],
             "pdfs": [],
             "books": [],
             "message": "❌ No academic study materials found for this topic."
@@ -2534,6 +3107,8 @@ End with: '📚 Here are materials to study further:'
     return jsonify({
         "query": topic,
         "ai_explanation": explanation,
+        "materials": found["results"],
+        "facets": found["facets"],
         "pdfs": pdfs,
         "books": books
     })
@@ -2654,6 +3229,7 @@ def teach_me_ai():
     return render_template('teach-me-ai.html')
 
 @app.route('/api/ai-teach')
+@rate_limited('ai_teach', '10/60')
 def ai_teach():
     """API endpoint for AI teaching."""
     course = request.args.get("course")
@@ -2665,33 +3241,17 @@ def ai_teach():
     prompt = f"You're a tutor. Teach a {level} student the basics of {course} in a friendly and easy-to-understand way."
 
     try:
-        headers = {
-            "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://nelavista.com",
-            "X-Title": "Nelavista AI Tutor"
-        }
-
-        payload = {
-            "model": "openai/gpt-4o-mini",
-            "messages": [
-                {"role": "system", "content": "You are an educational AI assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 800
-        }
-
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-
-        if response.status_code == 200:
-            summary = response.json()["choices"][0]["message"]["content"]
-        else:
+        try:
+            summary = llm_client.chat(
+                [
+                    {"role": "system", "content": "You are an educational AI assistant."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=800,
+                timeout=30
+            )
+        except LLMError:
             summary = f"Let me teach you the basics of {course}. We'll start with fundamental concepts and build up from there. This is perfect for {level} students!"
 
         return jsonify({"summary": summary})
@@ -2866,6 +3426,10 @@ def clear_context():
             os.remove(file_path)
             debug_print(f"🗑️ Deleted file: {file_path}")
 
+        # Forget the registered upload; its file_id stops resolving
+        if session.get('last_file_id'):
+            file_registry.delete(session['last_file_id'], session['user']['username'])
+
         # Clear session variables
         session.pop('last_file_content', None)
         session.pop('last_file_type', None)
@@ -2907,15 +3471,74 @@ def health_check():
         ]
     })
 
+@app.route('/health/ai')
+def ai_health_check():
+    """Upstream health and cache metrics for the AI tutor and document extraction."""
+    return jsonify({
+        "upstream": llm_client.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "extraction_cache": extraction_cache.stats() if extraction_cache else None,
+        "content_store": content_store.stats(),
+        "sessions": app.session_interface.stats(),
+        "uploads": upload_stats(),
+        "analysis_progress": progress_channels.stats(),
+        "ocr": ocr_stats(),
+        "vision_images": image_prep_stats(),
+        "file_registry": file_registry.stats(),
+        "disk_janitor": disk_janitor.stats(),
+        "materials_corpus": materials_corpus.stats(),
+        "material_search": material_search.stats(),
+        "retrieval": {**retriever.stats(), "document_excerpts": document_passages.excerpts},
+        "rate_limit": rate_limiter.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+# ============================================
+# DISK QUOTAS (enforced in the background, see disk_janitor.py)
+# ============================================
+MB = 1024 * 1024
+UPLOADS_MAX_AGE = int(os.getenv('UPLOADS_MAX_AGE', str(24 * 3600)))
+UPLOADS_MAX_MB = int(os.getenv('UPLOADS_MAX_MB', '1024'))
+EXTRACTED_IMAGES_MAX_MB = int(os.getenv('EXTRACTED_IMAGES_MAX_MB', '2048'))
+FILE_REGISTRY_MAX_MB = int(os.getenv('FILE_REGISTRY_MAX_MB', '2048'))
+ORPHAN_VIDEO_MAX_AGE = int(os.getenv('ORPHAN_VIDEO_MAX_AGE', str(24 * 3600)))
+SPOOL_LEFTOVER_MAX_AGE = int(os.getenv('SPOOL_LEFTOVER_MAX_AGE', str(6 * 3600)))
+
+def referenced_video_files():
+    """Names of the files in static/uploads that a Video row points at; these are never deleted."""
+    with app.app_context():
+        return {os.path.basename(url) for (url,) in db.session.query(Video.video_url).all() if url}
+
+disk_janitor.add_quota('uploads', app.config['UPLOAD_FOLDER'], max_age=UPLOADS_MAX_AGE, max_bytes=UPLOADS_MAX_MB * MB)
+# Images are shared between documents; loading an analysis or serving an image marks it used
+disk_janitor.add_quota('extracted_images', app.config['IMAGE_FOLDER'],
+                       max_age=content_store.ttl, max_bytes=EXTRACTED_IMAGES_MAX_MB * MB)
+# Videos are user content: only files no Video row refers to (deleted or failed uploads) go
+disk_janitor.add_quota('orphan_videos', VIDEO_UPLOAD_FOLDER, max_age=ORPHAN_VIDEO_MAX_AGE,
+                       protected=referenced_video_files)
+disk_janitor.add_quota('file_registry', file_registry.blob_dir, max_bytes=FILE_REGISTRY_MAX_MB * MB)
+# Spool files left behind by crashed requests or analyses; only the app's own name patterns are swept
+disk_janitor.add_quota('upload_spool', UPLOAD_SPOOL_DIR, max_age=SPOOL_LEFTOVER_MAX_AGE,
+                       patterns=('upload-*', 'analysis-*.pdf'))
+disk_janitor.add_hook('file_registry', file_registry.purge_expired)
+disk_janitor.add_hook('content_store', content_store.purge_expired)
+disk_janitor.add_hook('sessions', app.session_interface.file_backend.purge_expired)
+
 # ============================================
 # STARTUP
 # ============================================
-cleanup_stale_files()
+job_queue.start()
+eventlet.spawn(material_search.warm)
+eventlet.spawn(retriever.warm)
 
 # Initialize database
 init_database()
 create_default_user()
 
+# The first sweep queries the videos table (referenced_video_files), so it starts after init_database()
+disk_janitor.start()
+
 if __name__ == '__main__':
     print(f"\n{'='*70}")
     print("🚀 NELLAVISTA + TELLAVISTA INTEGRATED PLATFORM")
@@ -0,0 +1,180 @@
+"""
+Background job queue for slow work such as /understand note generation.
+
+Jobs are queued in Redis when REDIS_URL is reachable, so any worker can pick
+them up and report their status; otherwise an in-process queue is used (local
+runs, single worker). Each app worker runs JOB_WORKERS consumer threads,
+which are green threads under eventlet.
+
+Job records: {"id", "task", "owner", "status", "result", "error", timestamps}
+with status one of queued, running, done, failed.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from utils import debug_print, get_redis
+
+# ============================================
+# Configuration
+# ============================================
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))  # keep finished job records for an hour
+JOB_QUEUE_KEY = 'jobs:queue'
+JOB_KEY_PREFIX = 'jobs:record:'
+
+# BLPOP timeout must stay below the Redis client's socket_timeout
+POLL_SECONDS = 1
+
+
+class JobQueue:
+    """Redis-backed job queue with an in-process fallback."""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._tasks = {}
+        self._records = {}  # in-process job records
+        self._local_queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def task(self, name):
+        """Decorator registering a function as a job handler."""
+        def decorator(fn):
+            self._tasks[name] = fn
+            return fn
+        return decorator
+
+    # ---- job records ----
+    def _save(self, record):
+        redis_client = get_redis()
+        if redis_client is not None and record.get('backend') == 'redis':
+            try:
+                redis_client.set(JOB_KEY_PREFIX + record['id'], json.dumps(record), ex=JOB_TTL)
+                return
+            except Exception as e:
+                debug_print(f"⚠️ Could not save job {record['id']} to Redis: {e}")
+        with self._lock:
+            self._records[record['id']] = record
+            self._expire_local()
+
+    def _expire_local(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [j for j, r in self._records.items() if r['created_at'] < cutoff]:
+            del self._records[job_id]
+
+    def get(self, job_id):
+        """Return the job record or None if unknown/expired."""
+        with self._lock:
+            record = self._records.get(job_id)
+        if record is not None:
+            return record
+
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                raw = redis_client.get(JOB_KEY_PREFIX + job_id)
+                return json.loads(raw) if raw else None
+            except Exception as e:
+                debug_print(f"⚠️ Could not read job {job_id}: {e}")
+        return None
+
+    def _update(self, record, **fields):
+        record.update(fields)
+        self._save(record)
+
+    # ---- producer ----
+    def enqueue(self, task_name, *args, owner=None, **kwargs):
+        """Queue a job and return its id immediately."""
+        if task_name not in self._tasks:
+            raise ValueError(f"Unknown job task: {task_name}")
+
+        record = {
+            "id": uuid.uuid4().hex,
+            "task": task_name,
+            "owner": owner,
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "backend": "local"
+        }
+        message = {"id": record["id"], "task": task_name, "args": args, "kwargs": kwargs}
+
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                record["backend"] = "redis"
+                self._save(record)
+                redis_client.rpush(JOB_QUEUE_KEY, json.dumps(message))
+                debug_print(f"📥 Queued job {record['id']} ({task_name}) in Redis")
+                return record["id"]
+            except Exception as e:
+                debug_print(f"⚠️ Redis enqueue failed, running job in-process: {e}")
+                record["backend"] = "local"
+
+        self._save(record)
+        self._local_queue.put(message)
+        debug_print(f"📥 Queued job {record['id']} ({task_name}) in-process")
+        return record["id"]
+
+    # ---- consumers ----
+    def start(self):
+        """Start the consumer threads once per process."""
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+        debug_print(f"👷 Started {self.workers} background job worker(s)")
+
+    def _next_message(self):
+        try:
+            return self._local_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                item = redis_client.blpop(JOB_QUEUE_KEY, timeout=POLL_SECONDS)
+                return json.loads(item[1]) if item else None
+            except Exception as e:
+                debug_print(f"⚠️ Redis job poll failed: {e}")
+
+        try:
+            return self._local_queue.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            return None
+
+    def _worker_loop(self):
+        while True:
+            message = self._next_message()
+            if message:
+                self._run(message)
+
+    def _run(self, message):
+        record = self.get(message["id"])
+        if record is None:
+            return
+
+        handler = self._tasks.get(message["task"])
+        self._update(record, status="running", started_at=time.time())
+        try:
+            result = handler(*message.get("args", []), **message.get("kwargs", {}))
+            self._update(record, status="done", result=result, finished_at=time.time())
+            debug_print(f"✅ Job {record['id']} done in {record['finished_at'] - record['started_at']:.1f}s")
+        except Exception as e:
+            traceback.print_exc()
+            self._update(record, status="failed", error=str(e), finished_at=time.time())
+
+
+# Process-wide queue shared by all routes
+job_queue = JobQueue()
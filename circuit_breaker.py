@@ -0,0 +1,163 @@
+"""
+Circuit breaker for the OpenRouter upstream.
+
+Tracks the outcome and latency of recent calls in a sliding window. When the
+error rate or the slow-call rate passes its threshold, the breaker opens and
+callers fail fast for BREAKER_OPEN_SECONDS. After that, a single probe call is
+let through (half-open): success closes the breaker, failure re-opens it.
+
+Callers report latency only for calls it says something about: time to
+first token for streams, nothing for long generations (latency=None), which
+then count towards the error rate but not the slow-call rate or percentiles.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', '60'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '20'))
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', '0.8'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+
+# Successful latencies kept for percentile estimates (used for hedging)
+LATENCY_SAMPLES = 200
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Sliding-window error-rate / latency circuit breaker."""
+
+    def __init__(self, name='openrouter', window_seconds=BREAKER_WINDOW_SECONDS, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 slow_rate=BREAKER_SLOW_RATE, open_seconds=BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.rejected = 0
+        self._calls = deque()  # (timestamp, ok, latency)
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go upstream now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN and time.time() - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+                debug_print(f"🟡 Circuit {self.name} half-open, probing upstream")
+
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency=None):
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            if self.state == HALF_OPEN:
+                self._close()
+                return
+            self._record(True, latency)
+
+    def record_failure(self, latency=None):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open("probe failed")
+                return
+            self._record(False, latency)
+
+    def release_probe(self):
+        """Free the half-open probe slot when the probe ended without a verdict."""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def retry_after(self):
+        """Seconds until the breaker next lets a probe through."""
+        if self.state != OPEN:
+            return 1
+        return max(1, self.open_seconds - (time.time() - self.opened_at))
+
+    def _record(self, ok, latency):
+        now = time.time()
+        self._calls.append((now, ok, latency))
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+        if self.state != CLOSED or len(self._calls) < self.min_calls:
+            return
+
+        total = len(self._calls)
+        failures = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+        slow = sum(1 for _, _, call_latency in self._calls
+                   if call_latency is not None and call_latency >= self.slow_call_seconds)
+        if failures / total >= self.error_rate:
+            self._open(f"error rate {failures}/{total}")
+        elif slow / total >= self.slow_rate:
+            self._open(f"slow calls {slow}/{total}")
+
+    def _open(self, reason):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.probe_in_flight = False
+        print(f"🔴 Circuit {self.name} opened: {reason}")
+
+    def _close(self):
+        self.state = CLOSED
+        self.probe_in_flight = False
+        self._calls.clear()
+        print(f"🟢 Circuit {self.name} closed")
+
+    def latency_percentile(self, percentile):
+        """Latency percentile (0-100) of recent successful calls, or None without samples."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self):
+        """Breaker state for monitoring."""
+        with self._lock:
+            calls = list(self._calls)
+            sample_count = len(self._latencies)
+        total = len(calls)
+        failures = sum(1 for _, ok, _ in calls if not ok)
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            "name": self.name,
+            "state": self.state,
+            "window_calls": total,
+            "window_error_rate": round(failures / total, 3) if total else 0.0,
+            "rejected_calls": self.rejected,
+            "opened_at": self.opened_at or None,
+            "latency_samples": sample_count,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None
+        }
@@ -0,0 +1,177 @@
+"""
+Server-side store for large per-session content such as /analyze results.
+
+The extracted text, tables, image manifest and generated notes of an
+analysed PDF used to live in session['analyzer_content'], i.e. in the
+session cookie sent with every request. They are now stored here under
+the analysis session_id, and the Flask session only keeps that id.
+
+Entries are zlib-compressed JSON. They are stored in Redis (with a TTL)
+when REDIS_URL is reachable, so every worker and host sees them; otherwise
+they are files under CONTENT_STORE_DIR shared by the workers on the host.
+Reads extend the TTL, so content stays available while it is being used.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from utils import debug_print, get_redis
+
+# ============================================
+# Configuration
+# ============================================
+CONTENT_STORE_DIR = os.getenv('CONTENT_STORE_DIR', os.path.join(os.getcwd(), 'content_store'))
+CONTENT_STORE_TTL = int(os.getenv('CONTENT_STORE_TTL', str(6 * 3600)))  # idle entries expire after 6 hours
+CONTENT_KEY_PREFIX = 'content:'
+
+VALID_KEY = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class ContentStore:
+    """Redis-backed key/value store for session content, with an on-disk fallback."""
+
+    def __init__(self, directory=CONTENT_STORE_DIR, ttl=CONTENT_STORE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes_written = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        if not VALID_KEY.match(key or ''):
+            raise ValueError(f"Invalid content key: {key!r}")
+        return os.path.join(self.directory, f"{key}.json.z")
+
+    @staticmethod
+    def _encode(value):
+        return zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'), 6)
+
+    @staticmethod
+    def _decode(raw):
+        return json.loads(zlib.decompress(raw).decode('utf-8'))
+
+    def put(self, key, value):
+        """Store value under key for ttl seconds (replacing any earlier value)."""
+        path = self._path(key)
+        raw = self._encode(value)
+        self.bytes_written += len(raw)
+
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                redis_client.set(CONTENT_KEY_PREFIX + key, raw, ex=self.ttl)
+                debug_print(f"🗄️ Stored content {key[:8]} in Redis ({len(raw) / 1024:.0f} KB)")
+                return
+            except Exception as e:
+                debug_print(f"⚠️ Could not store content {key[:8]} in Redis: {e}")
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+        debug_print(f"🗄️ Stored content {key[:8]} on disk ({len(raw) / 1024:.0f} KB)")
+
+    def get(self, key):
+        """Return the stored value, or None if it is unknown or expired."""
+        try:
+            path = self._path(key)
+        except ValueError:
+            return None
+
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                raw = redis_client.get(CONTENT_KEY_PREFIX + key)
+                if raw is not None:
+                    redis_client.expire(CONTENT_KEY_PREFIX + key, self.ttl)
+                    self.hits += 1
+                    return self._decode(raw)
+            except Exception as e:
+                debug_print(f"⚠️ Could not read content {key[:8]} from Redis: {e}")
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self._remove(path)
+                raise OSError("expired")
+            with open(path, 'rb') as f:
+                value = self._decode(f.read())
+            os.utime(path)  # sliding expiry
+        except (OSError, ValueError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def update(self, key, **fields):
+        """Merge fields into a stored dict; returns the new value, or None if the key is gone."""
+        value = self.get(key)
+        if value is None:
+            return None
+        value.update(fields)
+        self.put(key, value)
+        return value
+
+    def delete(self, key):
+        try:
+            path = self._path(key)
+        except ValueError:
+            return
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                redis_client.delete(CONTENT_KEY_PREFIX + key)
+            except Exception as e:
+                debug_print(f"⚠️ Could not delete content {key[:8]} from Redis: {e}")
+        self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def purge_expired(self):
+        """Delete on-disk entries idle for longer than ttl (Redis expires its own keys); run by the disk janitor."""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            debug_print(f"🧹 Removed {removed} expired content entries")
+        return removed
+
+    def stats(self):
+        sizes = []
+        try:
+            sizes = [entry.stat().st_size for entry in os.scandir(self.directory)]
+        except OSError:
+            pass
+        total = self.hits + self.misses
+        return {
+            "backend": "redis" if get_redis() is not None else "disk",
+            "ttl_seconds": self.ttl,
+            "disk_entries": len(sizes),
+            "disk_size_mb": round(sum(sizes) / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "mb_written": round(self.bytes_written / 1024 / 1024, 2)
+        }
+
+
+# Process-wide content store (analyzer content)
+content_store = ContentStore()
@@ -0,0 +1,276 @@
+"""
+Background disk janitor for uploaded and generated files.
+
+uploads/, extracted_images/<session_id>, static/uploads, the file registry
+and the upload spool all grow with use. Their cleanup is the janitor's
+job. It runs in a background (green) thread every JANITOR_INTERVAL
+seconds, so no request ever pays for it.
+
+Each directory gets a DiskQuota:
+
+1. Age: entries unused for `max_age` seconds are deleted.
+2. Size: while the directory is above `max_bytes`, the least recently used
+   entries are deleted until it is below 90% of the quota.
+
+An entry is a file, or a whole subdirectory for `unit="dir"` quotas such as
+per-session image folders; its last use is the newest atime/mtime inside.
+Entries touched within JANITOR_GRACE_SECONDS (uploads being written) and
+`protected` names are never deleted. Deletions run in batches of
+JANITOR_BATCH with a pause in between, so the hub keeps serving requests.
+
+Stores with their own expiry (content store, file registry records,
+sessions) register their purge_expired as hooks and are swept in the same
+pass. Only one process per host sweeps at a time (non-blocking flock on
+JANITOR_LOCK_FILE); the other workers skip the round. Reclaimed files and
+bytes are counted for /health/ai.
+"""
+import fnmatch
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every process sweeps
+    fcntl = None
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+JANITOR_INTERVAL = int(os.getenv('JANITOR_INTERVAL', '600'))             # seconds between sweeps
+JANITOR_BATCH = int(os.getenv('JANITOR_BATCH', '100'))                    # deletions per batch
+JANITOR_BATCH_PAUSE = float(os.getenv('JANITOR_BATCH_PAUSE', '0.05'))     # seconds between batches
+JANITOR_GRACE_SECONDS = int(os.getenv('JANITOR_GRACE_SECONDS', '300'))    # never touch entries this fresh
+JANITOR_LOCK_FILE = os.getenv('JANITOR_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'disk-janitor.lock'))
+
+SIZE_QUOTA_TARGET = 0.9  # evict down to 90% of max_bytes, so the next upload does not trigger eviction again
+
+
+class DiskQuota:
+    """Age and size limits for the entries (files or subdirectories) of one directory."""
+
+    def __init__(self, name, directory, max_age=None, max_bytes=None, unit="file", patterns=("*",), protected=None):
+        self.name = name
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.unit = unit
+        self.patterns = patterns
+        self.protected = protected  # callable returning entry names that must be kept
+        self.entries = 0
+        self.size_bytes = 0
+        self.removed = 0
+        self.reclaimed_bytes = 0
+
+    def _matches(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    @staticmethod
+    def _last_use(stat):
+        return max(stat.st_atime, stat.st_mtime)
+
+    def _directory_entry(self, path):
+        size, last_use = 0, self._last_use(os.stat(path))
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                size += stat.st_size
+                last_use = max(last_use, self._last_use(stat))
+        return last_use, size
+
+    def scan(self):
+        """[(last_use, size, path, name)] of every entry under the directory."""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        if self.unit == "dir":
+            for entry in os.scandir(self.directory):
+                if not self._matches(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        last_use, size = self._directory_entry(entry.path)
+                    else:
+                        stat = entry.stat()
+                        last_use, size = self._last_use(stat), stat.st_size
+                except OSError:
+                    continue
+                entries.append((last_use, size, entry.path, entry.name))
+            return entries
+
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not self._matches(name):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((self._last_use(stat), stat.st_size, path, name))
+            if root == self.directory and self.patterns != ("*",):
+                break  # pattern quotas (shared temp dirs) only cover the top level
+        return entries
+
+    def plan(self, now=None):
+        """Entries to delete: everything past max_age, then least recently used ones over max_bytes."""
+        now = now or time.time()
+        entries = self.scan()
+        protected = set(self.protected()) if self.protected else set()
+        self.entries = len(entries)
+        total = sum(size for _, size, _, _ in entries)
+
+        deletable = sorted(entry for entry in entries
+                           if entry[3] not in protected and now - entry[0] > JANITOR_GRACE_SECONDS)
+        doomed = []
+        if self.max_age is not None:
+            doomed = [entry for entry in deletable if now - entry[0] > self.max_age]
+            total -= sum(size for _, size, _, _ in doomed)
+        if self.max_bytes is not None and total > self.max_bytes:
+            for entry in deletable[len(doomed):]:  # oldest first, after the expired ones
+                if total <= self.max_bytes * SIZE_QUOTA_TARGET:
+                    break
+                doomed.append(entry)
+                total -= entry[1]
+        self.size_bytes = total
+        return doomed
+
+
+class DiskJanitor:
+    """Periodically enforces DiskQuotas and runs purge hooks in a background thread."""
+
+    def __init__(self, interval=JANITOR_INTERVAL, batch=JANITOR_BATCH, lock_file=JANITOR_LOCK_FILE):
+        self.interval = interval
+        self.batch = batch
+        self.lock_file = lock_file
+        self.quotas = []
+        self.hooks = []  # (name, purge function returning the number of removed entries)
+        self._started = False
+        self._sweeping = threading.Lock()
+        self.runs = 0
+        self.skipped = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.hook_removed = {}
+
+    def add_quota(self, name, directory, **limits):
+        quota = DiskQuota(name, directory, **limits)
+        self.quotas.append(quota)
+        return quota
+
+    def add_hook(self, name, purge):
+        self.hooks.append((name, purge))
+        self.hook_removed.setdefault(name, 0)
+
+    def start(self):
+        """Start the janitor thread once per process."""
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._loop, name="disk-janitor", daemon=True).start()
+        debug_print(f"🧹 Disk janitor sweeping {len(self.quotas)} director(ies) every {self.interval}s")
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                debug_print(f"⚠️ Disk janitor sweep failed: {e}")
+            time.sleep(self.interval)
+
+    def _delete(self, quota, doomed):
+        for start in range(0, len(doomed), self.batch):
+            for _, size, path, _ in doomed[start:start + self.batch]:
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    debug_print(f"⚠️ Janitor could not delete {path}: {e}")
+                    continue
+                quota.removed += 1
+                quota.reclaimed_bytes += size
+            time.sleep(JANITOR_BATCH_PAUSE)  # yield to requests between batches
+
+    def run_once(self):
+        """One sweep over all quotas and hooks; returns the bytes reclaimed (0 if another process holds the lock)."""
+        with self._sweeping:
+            lock = self._lock_host()
+            if lock is False:
+                self.skipped += 1
+                return 0
+            try:
+                started = time.time()
+                reclaimed = removed = 0
+                for quota in self.quotas:
+                    before_bytes, before_removed = quota.reclaimed_bytes, quota.removed
+                    try:
+                        self._delete(quota, quota.plan(started))
+                    except Exception as e:
+                        debug_print(f"⚠️ Janitor could not sweep {quota.name}: {e}")
+                    reclaimed += quota.reclaimed_bytes - before_bytes
+                    removed += quota.removed - before_removed
+                for name, purge in self.hooks:
+                    try:
+                        self.hook_removed[name] += purge() or 0
+                    except Exception as e:
+                        debug_print(f"⚠️ Janitor hook {name} failed: {e}")
+
+                self.runs += 1
+                self.last_run = time.time()
+                self.last_duration = self.last_run - started
+                if removed:
+                    print(f"🧹 Janitor removed {removed} entr(ies), reclaimed {reclaimed / 1024 / 1024:.1f} MB "
+                          f"in {self.last_duration:.2f}s")
+                return reclaimed
+            finally:
+                if lock:
+                    lock.close()
+
+    def _lock_host(self):
+        """An open, flock'ed lock file; False if another process is sweeping; None without fcntl."""
+        if fcntl is None:
+            return None
+        handle = open(self.lock_file, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        return handle
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "skipped_locked": self.skipped,
+            "last_run": self.last_run,
+            "last_duration_seconds": round(self.last_duration, 3),
+            "reclaimed_mb": round(sum(q.reclaimed_bytes for q in self.quotas) / 1024 / 1024, 2),
+            "quotas": {
+                quota.name: {
+                    "entries": quota.entries,
+                    "size_mb": round(quota.size_bytes / 1024 / 1024, 2),
+                    "max_mb": round(quota.max_bytes / 1024 / 1024, 1) if quota.max_bytes is not None else None,
+                    "max_age_seconds": quota.max_age,
+                    "removed": quota.removed,
+                    "reclaimed_mb": round(quota.reclaimed_bytes / 1024 / 1024, 2)
+                }
+                for quota in self.quotas
+            },
+            "purged": dict(self.hook_removed)
+        }
+
+
+# Process-wide janitor; app.py registers its directories and starts it
+disk_janitor = DiskJanitor()
@@ -0,0 +1,160 @@
+"""
+Content-addressed cache of document extraction results.
+
+Results are keyed by the sha256 of the uploaded file's bytes, so when a whole
+class uploads the same course PDF to /analyze, /upload or /ask_with_files it
+is only extracted once. Each result (text, tables, image manifest, document
+structure) is one JSON file under EXTRACTION_CACHE_DIR:
+
+    <dir>/<sha[:2]>/<sha>.v<EXTRACTOR_VERSION>.<kind>.json
+
+File mtimes double as LRU timestamps: reads touch the file, and once the
+directory grows past EXTRACTION_CACHE_MAX_MB the least recently used entries
+are deleted. The directory is shared by every worker on the host.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+EXTRACTION_CACHE_DIR = os.getenv('EXTRACTION_CACHE_DIR', os.path.join(os.getcwd(), 'extraction_cache'))
+EXTRACTION_CACHE_MAX_MB = float(os.getenv('EXTRACTION_CACHE_MAX_MB', '512'))
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'True').lower() == 'true'
+
+# Bump when an extractor changes output so stale results are never served
+EXTRACTOR_VERSION = 1
+
+# Re-measure the directory after this many bytes are written
+EVICT_CHECK_BYTES = 16 * 1024 * 1024
+
+
+def file_sha256(data):
+    """Hex sha256 of file bytes (or of a file object's remaining content)."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    for block in iter(lambda: data.read(1024 * 1024), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Size-bounded, LRU, on-disk cache of extraction results keyed by file hash."""
+
+    def __init__(self, directory=EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._written_since_check = EVICT_CHECK_BYTES  # measure on the first write
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, digest, kind):
+        return os.path.join(self.directory, digest[:2], f"{digest}.v{EXTRACTOR_VERSION}.{kind}.json")
+
+    def get(self, digest, kind):
+        """Return the cached result or None."""
+        path = self._path(digest, kind)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        debug_print(f"📦 Extraction cache hit: {kind} for {digest[:12]}")
+        return value
+
+    def set(self, digest, kind, value):
+        """Store a result atomically (readers never see a half-written file)."""
+        path = self._path(digest, kind)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except (OSError, TypeError, ValueError) as e:
+            debug_print(f"⚠️ Could not cache {kind} for {digest[:12]}: {e}")
+            return
+
+        with self._lock:
+            self._written_since_check += size
+            check = self._written_since_check >= EVICT_CHECK_BYTES
+            if check:
+                self._written_since_check = 0
+        if check:
+            self._evict()
+
+    def get_or_compute(self, digest, kind, compute, should_cache=lambda value: value is not None):
+        """Return the cached result, or compute and cache it."""
+        value = self.get(digest, kind)
+        if value is not None:
+            return value
+        value = compute()
+        if should_cache(value):
+            self.set(digest, kind, value)
+        return value
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits max_bytes."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        target = self.max_bytes * 0.9  # leave headroom so we do not evict on every write
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evicted += 1
+            except OSError:
+                pass
+        debug_print(f"🧹 Extraction cache trimmed to {total / 1024 / 1024:.1f} MB")
+
+    def stats(self):
+        entries = self._entries()
+        total = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evicted": self.evicted
+        }
+
+
+# Process-wide extraction cache
+extraction_cache = ExtractionCache() if EXTRACTION_CACHE_ENABLED else None
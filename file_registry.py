@@ -0,0 +1,194 @@
+"""
+Upload-once file handles for the tutor chat.
+
+Every PDF or image uploaded through /upload or /ask_with_files is
+registered here and gets a file_id. Follow-up questions to /ask and
+/ask_with_files send `file_ids` instead of the file. The registry returns
+the text extracted at upload time and, for images, the vision-ready copy
+(see image_prep.py). A follow-up costs no upload, PDF parsing or image
+processing.
+
+- The bytes are stored content-addressed under FILE_REGISTRY_DIR/blobs by
+  sha256, so a file uploaded twice is kept once. Spooled uploads are
+  hard-linked instead of copied.
+- Each record holds the owner, file name, type, size, sha256, extracted
+  text and, for images, the hash of the prepared vision image. Records are
+  ContentStore entries: in Redis when available, otherwise on disk.
+- Records and blobs expire FILE_REGISTRY_TTL seconds after their last use;
+  the disk janitor deletes them and caps the blob directory's size.
+- A file_id only resolves for the user who uploaded the file.
+"""
+import base64
+import os
+import threading
+import time
+import uuid
+
+from content_store import ContentStore
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+FILE_REGISTRY_DIR = os.getenv('FILE_REGISTRY_DIR', os.path.join(os.getcwd(), 'file_registry'))
+FILE_REGISTRY_TTL = int(os.getenv('FILE_REGISTRY_TTL', str(24 * 3600)))  # unused files expire after a day
+FILE_KEY_PREFIX = 'file-'
+
+
+class FileRegistry:
+    """file_id -> uploaded file (content-addressed bytes plus extracted text), with a sliding TTL."""
+
+    def __init__(self, directory=FILE_REGISTRY_DIR, ttl=FILE_REGISTRY_TTL):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.ttl = ttl
+        self.records = ContentStore(os.path.join(directory, 'records'), ttl=ttl)
+        self._lock = threading.Lock()
+        self.registered = 0
+        self.deduplicated = 0
+        self.resolved = 0
+        self.unresolved = 0
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _store_blob(self, source, digest):
+        """Store bytes (or a SpooledUpload) under its digest; returns True if it was already stored."""
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        if isinstance(source, (bytes, bytearray)):
+            with open(tmp_path, 'wb') as f:
+                f.write(source)
+        else:
+            source.keep(tmp_path)
+        os.replace(tmp_path, path)
+        return False
+
+    def register(self, source, owner, filename, file_type, sha256, size, text="", vision=None, **fields):
+        """
+        Store an upload and return its record (with a new file_id).
+
+        `source` is the file's bytes or its SpooledUpload. `vision` is the
+        prepare_vision_image() result for images; its bytes are stored too,
+        so follow-up questions reuse them as they are.
+        """
+        reused = self._store_blob(source, sha256)
+        record = {
+            "file_id": str(uuid.uuid4()),
+            "owner": owner,
+            "filename": filename,
+            "type": file_type,
+            "sha256": sha256,
+            "size": size,
+            "text": text or "",
+            "created_at": time.time(),
+            **fields
+        }
+        if vision is not None:
+            self._store_blob(base64.b64decode(vision["base64"]), vision["digest"])
+            record["vision_digest"] = vision["digest"]
+            record["vision_mime_type"] = vision["mime_type"]
+        self.records.put(FILE_KEY_PREFIX + record["file_id"], record)
+
+        with self._lock:
+            self.registered += 1
+            self.deduplicated += reused
+        debug_print(f"📁 Registered {file_type} {filename} as {record['file_id'][:8]}"
+                    f"{' (bytes already stored)' if reused else ''}")
+        return record
+
+    def get(self, file_id, owner):
+        """The record of a file_id owned by `owner`, or None if it is unknown, expired or someone else's."""
+        record = self.records.get(FILE_KEY_PREFIX + file_id) if isinstance(file_id, str) else None
+        if record is None or record.get("owner") != owner:
+            with self._lock:
+                self.unresolved += 1
+            return None
+        for digest in (record["sha256"], record.get("vision_digest")):
+            if digest:
+                try:
+                    os.utime(self._blob_path(digest))  # blobs expire with their last use, like records
+                except OSError:
+                    pass
+        with self._lock:
+            self.resolved += 1
+        return record
+
+    def update(self, file_id, **fields):
+        return self.records.update(FILE_KEY_PREFIX + file_id, **fields)
+
+    def delete(self, file_id, owner):
+        """Forget a file_id; the bytes stay until they expire, other ids may share them."""
+        if self.get(file_id, owner) is not None:
+            self.records.delete(FILE_KEY_PREFIX + file_id)
+
+    def read_bytes(self, record):
+        """The uploaded bytes of a record, or None if they expired or live on another host."""
+        try:
+            with open(self._blob_path(record["sha256"]), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def vision_image(self, record):
+        """The stored prepare_vision_image() result of an image record, or None."""
+        digest = record.get("vision_digest")
+        if not digest:
+            return None
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        return {
+            "base64": base64.b64encode(data).decode('utf-8'),
+            "mime_type": record.get("vision_mime_type", 'image/jpeg'),
+            "digest": digest
+        }
+
+    def purge_expired(self):
+        """Delete records and blobs unused for longer than ttl (run by the disk janitor)."""
+        removed = self.records.purge_expired()
+        cutoff = time.time() - self.ttl
+        for root, _, names in os.walk(self.blob_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            debug_print(f"🧹 Removed {removed} expired registered file(s)")
+        return removed
+
+    def stats(self):
+        blobs = blob_bytes = 0
+        for root, _, names in os.walk(self.blob_dir):
+            for name in names:
+                try:
+                    blob_bytes += os.path.getsize(os.path.join(root, name))
+                    blobs += 1
+                except OSError:
+                    pass
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl,
+                "registered": self.registered,
+                "deduplicated": self.deduplicated,
+                "resolved": self.resolved,
+                "unresolved": self.unresolved,
+                "blobs": blobs,
+                "blob_size_mb": round(blob_bytes / 1024 / 1024, 2),
+                "records": self.records.stats()["disk_entries"]
+            }
+
+
+# Process-wide registry of uploaded files
+file_registry = FileRegistry()
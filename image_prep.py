@@ -0,0 +1,157 @@
+"""
+Shrink images before they are base64-encoded into vision requests.
+
+Phone photos arrive as 4-8 MB JPEGs of 12+ megapixels. The vision model
+downsamples them anyway: OpenAI fits images into 2048 px and then scales
+the short side to 768 px. Sending the full file only slows the upload on
+mobile networks and lengthens model latency.
+
+prepare_vision_image:
+- applies the EXIF orientation, then drops all metadata, including GPS;
+- flattens transparency onto white and keeps the first frame of a GIF;
+- resizes to fit VISION_MAX_SIDE x VISION_MAX_SHORT_SIDE;
+- re-encodes as JPEG (or WebP) at VISION_IMAGE_QUALITY.
+
+Identical images in one request are sent once (see VisionImageSet).
+Savings are counted for /health/ai.
+"""
+import base64
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+VISION_MAX_SIDE = int(os.getenv('VISION_MAX_SIDE', '2048'))
+VISION_MAX_SHORT_SIDE = int(os.getenv('VISION_MAX_SHORT_SIDE', '768'))
+VISION_IMAGE_FORMAT = os.getenv('VISION_IMAGE_FORMAT', 'JPEG').upper()  # JPEG or WEBP
+VISION_IMAGE_QUALITY = int(os.getenv('VISION_IMAGE_QUALITY', '82'))
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png', 'GIF': 'image/gif'}
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "duplicates": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _count(**amounts):
+    with _stats_lock:
+        for key, amount in amounts.items():
+            _stats[key] += amount
+
+
+def _native(fn, *args):
+    """Run CPU-bound image work in a native thread so the eventlet hub keeps serving requests."""
+    try:
+        from eventlet import tpool
+    except ImportError:
+        return fn(*args)
+    return tpool.execute(fn, *args)
+
+
+def _fit(width, height):
+    """Target size within VISION_MAX_SIDE (long side) and VISION_MAX_SHORT_SIDE (short side)."""
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height), VISION_MAX_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _shrink(data):
+    image = Image.open(io.BytesIO(data))
+    image.seek(0)  # first frame of animated images
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    size = _fit(*image.size)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+
+    output = io.BytesIO()
+    if VISION_IMAGE_FORMAT == 'WEBP':
+        image.save(output, 'WEBP', quality=VISION_IMAGE_QUALITY, method=4)
+    else:
+        image.save(output, 'JPEG', quality=VISION_IMAGE_QUALITY, optimize=True, progressive=True)
+    return output.getvalue(), size
+
+
+def prepare_vision_image(data, mime_type='image/jpeg'):
+    """
+    Resized, re-encoded, metadata-free copy of an image for a vision request.
+
+    Returns {"base64", "mime_type", "digest", "bytes_in", "bytes_out", "size"}.
+    If the image cannot be decoded, the original bytes are passed through.
+    """
+    try:
+        shrunk, size = _native(_shrink, data)
+        mime_type = MIME_TYPES.get(VISION_IMAGE_FORMAT, 'image/jpeg')
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        debug_print(f"⚠️ Could not shrink image, sending it unchanged: {e}")
+        _count(failed=1)
+        shrunk, size = data, None
+
+    _count(images=1, bytes_in=len(data), bytes_out=len(shrunk))
+    debug_print(f"🗜️ Vision image {len(data) / 1024:.0f} KB -> {len(shrunk) / 1024:.0f} KB {size or ''}")
+    return {
+        "base64": base64.b64encode(shrunk).decode('utf-8'),
+        "mime_type": mime_type,
+        "digest": hashlib.sha256(shrunk).hexdigest(),
+        "bytes_in": len(data),
+        "bytes_out": len(shrunk),
+        "size": size
+    }
+
+
+class VisionImageSet:
+    """Prepared images of one request, with exact duplicates (same pixels or same file) dropped."""
+
+    def __init__(self):
+        self.images = []
+        self._seen = set()
+
+    def add(self, data, filename=None, mime_type='image/jpeg'):
+        """Prepare and keep an image; returns False if it duplicates one already added."""
+        original_digest = hashlib.sha256(data).hexdigest()
+        if original_digest in self._seen:
+            _count(duplicates=1)
+            return False
+        return self.add_prepared(prepare_vision_image(data, mime_type), filename, original_digest)
+
+    def add_prepared(self, prepared, filename=None, original_digest=None):
+        """Keep an image prepared earlier (e.g. by the file registry); returns False for a duplicate."""
+        if prepared["digest"] in self._seen or original_digest in self._seen:
+            _count(duplicates=1)
+            return False
+        self._seen.update(digest for digest in (original_digest, prepared["digest"]) if digest)
+        self.images.append(dict(prepared, filename=filename))
+        return True
+
+    def __bool__(self):
+        return bool(self.images)
+
+    def __iter__(self):
+        return iter(self.images)
+
+
+def image_prep_stats():
+    with _stats_lock:
+        saved = _stats["bytes_in"] - _stats["bytes_out"]
+        return {
+            "images": _stats["images"],
+            "duplicates_dropped": _stats["duplicates"],
+            "failed": _stats["failed"],
+            "mb_in": round(_stats["bytes_in"] / 1024 / 1024, 2),
+            "mb_out": round(_stats["bytes_out"] / 1024 / 1024, 2),
+            "mb_saved": round(saved / 1024 / 1024, 2),
+            "saved_ratio": round(saved / _stats["bytes_in"], 3) if _stats["bytes_in"] else 0.0
+        }
@@ -0,0 +1,429 @@
+"""
+Shared OpenRouter client used by every LLM call site in app.py.
+
+One pooled requests.Session is kept per worker process so repeated questions
+reuse warm keep-alive connections instead of paying a fresh TCP+TLS handshake.
+"""
+import json
+import os
+import threading
+import time
+
+import eventlet
+import eventlet.queue
+import requests
+from requests.adapters import HTTPAdapter
+
+from answer_cache import answer_cache, make_cache_key
+from circuit_breaker import CircuitBreaker
+from singleflight import SingleFlight
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+OPENROUTER_URL = os.getenv('OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
+OPENROUTER_REFERER = os.getenv('OPENROUTER_REFERER', 'https://nelavista.com')
+DEFAULT_MODEL = "openai/gpt-4o-mini"
+DEFAULT_TITLE = "Nelavista AI Tutor"
+
+# Connections kept alive per eventlet worker (one greenlet holds one connection per call)
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '20'))
+LLM_DEFAULT_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '30'))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+
+# Coalesce identical concurrent prompts; set LLM_SINGLEFLIGHT_REDIS to share across workers
+LLM_SINGLEFLIGHT_REDIS = os.getenv('LLM_SINGLEFLIGHT_REDIS', 'False').lower() == 'true'
+
+# Hedged requests: fire a second identical request if the first is slower than the recent p95
+LLM_HEDGE = os.getenv('LLM_HEDGE', 'False').lower() == 'true'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '2'))
+LLM_HEDGE_MAX_DELAY = float(os.getenv('LLM_HEDGE_MAX_DELAY', '15'))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_MAX_TOKENS = int(os.getenv('LLM_HEDGE_MAX_TOKENS', '2000'))  # never hedge long note generation
+
+# Calls allowed more tokens or time than this are long generations (notes, map-reduce sections):
+# their latency is neither hedged against nor counted as slow by the circuit breaker
+LLM_LONG_CALL_TOKENS = int(os.getenv('LLM_LONG_CALL_TOKENS', str(LLM_HEDGE_MAX_TOKENS)))
+
+# Admission control: cap concurrent upstream calls per worker, shed load instead of queueing forever
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '2'))
+
+
+class LLMError(Exception):
+    """Raised when the upstream LLM call fails or returns no usable content."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMUnavailableError(LLMError):
+    """Raised without calling upstream; the caller should retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message, status_code=503)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised while the circuit breaker is open."""
+
+
+class LLMOverloadedError(LLMUnavailableError):
+    """Raised when every upstream call slot stayed busy for LLM_QUEUE_TIMEOUT."""
+
+
+def is_upstream_failure(error):
+    """Errors that say OpenRouter is unhealthy (not that our request was bad)."""
+    if isinstance(error, LLMUnavailableError):
+        return False
+    return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+
+
+class OpenRouterClient:
+    """Thin keep-alive client around the OpenRouter chat completions API."""
+
+    def __init__(self, api_key=None, pool_size=LLM_POOL_SIZE, default_timeout=LLM_DEFAULT_TIMEOUT, cache=None,
+                 max_concurrency=LLM_MAX_CONCURRENCY):
+        self._api_key = api_key
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.in_flight = 0
+        self.shed = 0
+        self.default_timeout = default_timeout
+        self.cache = cache
+        self.flights = SingleFlight(distributed=LLM_SINGLEFLIGHT_REDIS, prefix='llm')
+        self.breaker = CircuitBreaker('openrouter')
+        self.hedge_enabled = LLM_HEDGE
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self._session = None
+
+    @property
+    def api_key(self):
+        return self._api_key or os.getenv('OPENROUTER_API_KEY')
+
+    @property
+    def session(self):
+        """Create the pooled session lazily so forked workers never share sockets."""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def headers(self, title=DEFAULT_TITLE):
+        """Headers shared by every OpenRouter request."""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": OPENROUTER_REFERER,
+            "X-Title": title
+        }
+
+    def build_payload(self, messages, model=DEFAULT_MODEL, temperature=0.5, max_tokens=1500, **extra):
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        payload.update(extra)
+        return payload
+
+    def post(self, payload, timeout=None, title=DEFAULT_TITLE, stream=False):
+        """POST a payload through the pooled session and return the raw response."""
+        read_timeout = timeout or self.default_timeout
+        return self.session.post(
+            OPENROUTER_URL,
+            headers=self.headers(title),
+            json=payload,
+            timeout=(LLM_CONNECT_TIMEOUT, read_timeout),
+            stream=stream
+        )
+
+    def cache_key(self, messages, model=DEFAULT_MODEL, temperature=0.5, max_tokens=1500):
+        return make_cache_key(model, messages, temperature=temperature, max_tokens=max_tokens)
+
+    def chat(self, messages, model=DEFAULT_MODEL, temperature=0.5, max_tokens=1500,
+             timeout=None, title=DEFAULT_TITLE, use_cache=True, queue_timeout=None):
+        """
+        Run a chat completion and return the assistant message content.
+
+        `queue_timeout` is how long to wait for a free upstream slot before
+        raising LLMOverloadedError; background jobs pass a longer wait.
+        """
+        key = self.cache_key(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+        use_cache = use_cache and self.cache is not None
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                debug_print(f"⚡ Answer cache hit ({key[:12]})")
+                return cached
+
+        def call_upstream():
+            content = self._complete_hedged(messages, model, temperature, max_tokens, timeout, title, queue_timeout)
+            if use_cache:
+                self.cache.set(key, content)
+            return content
+
+        # Identical concurrent prompts share one upstream call
+        return self.flights.do(key, call_upstream)
+
+    def is_long_call(self, max_tokens, timeout=None):
+        """True for long generations, whose duration says nothing about upstream health."""
+        return max_tokens > LLM_LONG_CALL_TOKENS or (timeout or self.default_timeout) > self.default_timeout
+
+    def hedge_delay(self, max_tokens, timeout=None):
+        """Seconds to wait before hedging, or None when hedging does not apply."""
+        if not self.hedge_enabled or max_tokens > LLM_HEDGE_MAX_TOKENS or self.is_long_call(max_tokens, timeout):
+            return None
+        if self.breaker.snapshot()["latency_samples"] < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        delay = self.breaker.latency_percentile(LLM_HEDGE_PERCENTILE)
+        return min(max(delay, LLM_HEDGE_MIN_DELAY), LLM_HEDGE_MAX_DELAY)
+
+    def _complete_hedged(self, messages, model, temperature, max_tokens, timeout, title, queue_timeout=None):
+        """
+        Call upstream, sending a duplicate request if the first is slower than p95.
+
+        The first successful answer wins and the other request is killed.
+        """
+        args = (messages, model, temperature, max_tokens, timeout, title, queue_timeout)
+        delay = self.hedge_delay(max_tokens, timeout)
+        if delay is None:
+            return self._guarded_complete(*args)
+
+        results = eventlet.queue.LightQueue()
+
+        def attempt(tag):
+            try:
+                results.put((tag, self._guarded_complete(*args), None))
+            except LLMError as e:
+                results.put((tag, None, e))
+
+        attempts = [eventlet.spawn(attempt, 'primary')]
+        try:
+            try:
+                tag, content, error = results.get(timeout=delay)
+            except eventlet.queue.Empty:
+                debug_print(f"🏁 Hedging OpenRouter request after {delay:.1f}s")
+                self.hedges_sent += 1
+                attempts.append(eventlet.spawn(attempt, 'hedge'))
+                tag, content, error = results.get()
+
+            # If the first finisher failed, wait for the other attempt
+            pending = len(attempts) - 1
+            while error is not None and pending:
+                tag, content, error = results.get()
+                pending -= 1
+
+            if error is not None:
+                raise error
+            if tag == 'hedge':
+                self.hedges_won += 1
+            return content
+        finally:
+            for greenthread in attempts:
+                greenthread.kill()
+
+    def _acquire_slot(self, queue_timeout=None):
+        """Wait briefly for an upstream call slot, or shed the call."""
+        queue_timeout = LLM_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        if not self._slots.acquire(timeout=queue_timeout):
+            self.shed += 1
+            debug_print(f"🚧 Shedding LLM call: {self.max_concurrency} calls already in flight")
+            raise LLMOverloadedError("AI service is busy, please retry shortly", retry_after=LLM_QUEUE_TIMEOUT)
+        self.in_flight += 1
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("AI service temporarily unavailable (circuit open)",
+                                   retry_after=self.breaker.retry_after())
+
+    def _guarded_complete(self, messages, model, temperature, max_tokens, timeout, title, queue_timeout=None):
+        """One upstream call through admission control and the circuit breaker."""
+        self._acquire_slot(queue_timeout)
+        try:
+            self._check_breaker()
+
+            long_call = self.is_long_call(max_tokens, timeout)
+            started = time.time()
+            try:
+                content = self._complete(messages, model, temperature, max_tokens, timeout, title)
+            except LLMError as e:
+                if is_upstream_failure(e):
+                    self.breaker.record_failure(None if long_call else time.time() - started)
+                else:
+                    self.breaker.release_probe()
+                raise
+            except BaseException:
+                # Killed hedge loser or unexpected error: no verdict on upstream health
+                self.breaker.release_probe()
+                raise
+
+            self.breaker.record_success(None if long_call else time.time() - started)
+            return content
+        finally:
+            self._release_slot()
+
+    def _complete(self, messages, model, temperature, max_tokens, timeout, title):
+        """One uncached round trip to OpenRouter."""
+        payload = self.build_payload(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+        try:
+            response = self.post(payload, timeout=timeout, title=title)
+        except requests.exceptions.RequestException as e:
+            debug_print(f"❌ OpenRouter request failed: {e}")
+            raise LLMError(f"AI service unreachable: {e}")
+
+        if response.status_code != 200:
+            debug_print(f"❌ OpenRouter error: {response.status_code}")
+            raise LLMError(f"AI service error: {response.status_code}", status_code=response.status_code)
+
+        try:
+            content = ((response.json().get("choices") or [{}])[0].get("message") or {}).get("content", "")
+        except ValueError:
+            raise LLMError("AI service returned invalid JSON")
+
+        if not content or not content.strip():
+            raise LLMError("AI service returned an empty answer")
+
+        return content
+
+    def stream_chat(self, messages, model=DEFAULT_MODEL, temperature=0.5, max_tokens=1500,
+                    timeout=None, title=DEFAULT_TITLE, use_cache=True):
+        """Run a streaming chat completion, yielding content deltas as they arrive."""
+        key = self.cache_key(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+        use_cache = use_cache and self.cache is not None
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                debug_print(f"⚡ Answer cache hit ({key[:12]})")
+                yield cached
+                return
+
+        # An identical prompt is already streaming in this worker: wait and send its full answer
+        call, leader = self.flights.begin(key)
+        if not leader:
+            yield self.flights.wait(call)
+            return
+
+        try:
+            self._acquire_slot()
+        except LLMUnavailableError as e:
+            self.flights.finish(key, call, error=e)
+            raise
+
+        parts = []
+        try:
+            try:
+                self._check_breaker()
+            except LLMUnavailableError as e:
+                self.flights.finish(key, call, error=e)
+                raise
+
+            # Streams are judged by time to first token: the rest depends on the answer's length
+            long_call = self.is_long_call(max_tokens, timeout)
+            started = time.time()
+            first_token = None
+            try:
+                for delta in self._stream(messages, model, temperature, max_tokens, timeout, title):
+                    if first_token is None:
+                        first_token = time.time() - started
+                    parts.append(delta)
+                    yield delta
+            except BaseException as e:
+                # Includes GeneratorExit when the client disconnects mid-stream
+                if isinstance(e, LLMError) and is_upstream_failure(e):
+                    self.breaker.record_failure(None if long_call else first_token or time.time() - started)
+                else:
+                    self.breaker.release_probe()
+                self.flights.finish(key, call, error=e if isinstance(e, LLMError) else LLMError("AI stream aborted"))
+                raise
+
+            if first_token is None:
+                first_token = time.time() - started
+            self.breaker.record_success(None if long_call else first_token)
+        finally:
+            self._release_slot()
+
+        content = "".join(parts)
+        if use_cache:
+            self.cache.set(key, content)
+        self.flights.finish(key, call, result=content)
+
+    def _stream(self, messages, model, temperature, max_tokens, timeout, title):
+        """One uncached streaming round trip to OpenRouter."""
+        payload = self.build_payload(messages, model=model, temperature=temperature,
+                                     max_tokens=max_tokens, stream=True)
+
+        try:
+            response = self.post(payload, timeout=timeout, title=title, stream=True)
+        except requests.exceptions.RequestException as e:
+            debug_print(f"❌ OpenRouter stream request failed: {e}")
+            raise LLMError(f"AI service unreachable: {e}")
+
+        if response.status_code != 200:
+            response.close()
+            debug_print(f"❌ OpenRouter stream error: {response.status_code}")
+            raise LLMError(f"AI service error: {response.status_code}", status_code=response.status_code)
+
+        try:
+            for raw_line in response.iter_lines():
+                # OpenRouter sends ": OPENROUTER PROCESSING" keep-alive comments between events
+                line = raw_line.decode('utf-8', errors='replace').strip() if raw_line else ''
+                if not line.startswith('data:'):
+                    continue
+
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+
+                if chunk.get('error'):
+                    raise LLMError(f"AI service stream error: {chunk['error']}")
+
+                delta = ((chunk.get("choices") or [{}])[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+        except requests.exceptions.RequestException as e:
+            debug_print(f"❌ OpenRouter stream interrupted: {e}")
+            raise LLMError(f"AI stream interrupted: {e}")
+        finally:
+            response.close()
+
+    def stats(self):
+        """Upstream health for monitoring."""
+        return {
+            "admission": {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "shed": self.shed
+            },
+            "circuit_breaker": self.breaker.snapshot(),
+            "hedging": {
+                "enabled": self.hedge_enabled,
+                "sent": self.hedges_sent,
+                "won": self.hedges_won
+            },
+            "single_flight": self.flights.stats()
+        }
+
+
+# Process-wide client shared by all routes
+llm_client = OpenRouterClient(cache=answer_cache)
@@ -0,0 +1,222 @@
+"""
+Local BM25 full-text search over the study materials corpus.
+
+Every page of the materials corpus (see materials_corpus.py) is a search
+document. The inverted index is built in memory on first use, with one
+NumPy array of page ids and term frequencies per term. It is rebuilt
+automatically when the corpus is rebuilt. A query scores only the pages
+containing its terms, so searches take a few milliseconds instead of the
+two sequential 10 s scraping calls they replace.
+
+Results are page-level hits with <mark>-highlighted snippets. Course-code
+facets (CSC-323, MAT-161, ...) come from the material filenames.
+"""
+import html
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from materials_corpus import materials_corpus
+from text_embeddings import embedder
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+SEARCH_MAX_PAGES_PER_DOCUMENT = int(os.getenv('SEARCH_MAX_PAGES_PER_DOCUMENT', '2'))
+SNIPPET_CHARS = 240
+
+COURSE_CODE = re.compile(r"\b([a-z]{3})[\s_\-]?(\d{3})\b")
+
+
+def course_codes(title):
+    """Course codes mentioned in a material title, e.g. "csc 323 note i" -> ["CSC-323"]."""
+    return sorted({f"{letters.upper()}-{digits}" for letters, digits in COURSE_CODE.findall(title.lower())})
+
+
+def make_snippet(text, terms, length=SNIPPET_CHARS):
+    """HTML-escaped excerpt around the densest cluster of query terms, with <mark> highlights."""
+    text = " ".join(text.split())
+    if not terms:
+        return html.escape(text[:length])
+
+    pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)) + r")\b",
+                         re.IGNORECASE)
+    positions = [m.start() for m in pattern.finditer(text)]
+    if positions:
+        # Window start that covers the most matches
+        best_start, best_count = positions[0], 0
+        for i, start in enumerate(positions):
+            count = sum(1 for p in positions[i:] if p < start + length)
+            if count > best_count:
+                best_start, best_count = start, count
+        start = max(0, best_start - length // 4)
+    else:
+        start = 0
+
+    excerpt = text[start:start + length]
+    parts, last = [], 0
+    for match in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[last:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group(0))}</mark>")
+        last = match.end()
+    parts.append(html.escape(excerpt[last:]))
+    snippet = "".join(parts)
+    return ("…" if start > 0 else "") + snippet + ("…" if start + length < len(text) else "")
+
+
+class MaterialSearchIndex:
+    """In-memory BM25 inverted index over corpus pages."""
+
+    def __init__(self, corpus=materials_corpus):
+        self.corpus = corpus
+        self._lock = threading.Lock()
+        self._built_for = None
+        self.pages = []        # (relative_path, page_number)
+        self.page_lengths = None
+        self.avg_length = 0.0
+        self.postings = {}     # term -> (page ids, term frequencies)
+        self.documents = {}    # relative_path -> {"title", "pages", "course_codes"}
+        self.build_seconds = 0.0
+        self.searches = 0
+
+    def _build(self):
+        started = time.time()
+        pages, lengths = [], []
+        postings = defaultdict(lambda: ([], []))
+        documents = {}
+
+        for relative_path, doc in self.corpus.documents().items():
+            documents[relative_path] = {
+                "title": doc["title"],
+                "pages": doc["pages"],
+                "course_codes": course_codes(doc["title"])
+            }
+        for relative_path, page_number, text in self.corpus.iter_pages():
+            tokens = embedder.tokens(text)
+            if not tokens:
+                continue
+            page_id = len(pages)
+            pages.append((relative_path, page_number))
+            lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                ids, tfs = postings[term]
+                ids.append(page_id)
+                tfs.append(count)
+
+        self.postings = {
+            term: (np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for term, (ids, tfs) in postings.items()
+        }
+        self.pages = pages
+        self.page_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_length = float(self.page_lengths.mean()) if lengths else 0.0
+        self.documents = documents
+        self.build_seconds = round(time.time() - started, 2)
+        print(f"🔎 Materials search index: {len(pages)} pages, {len(self.postings)} terms in {self.build_seconds}s")
+
+    def ensure_built(self):
+        """Build (or rebuild after a corpus rebuild) the index; False if there is no corpus."""
+        if not self.corpus.available:
+            return False
+        built_at = self.corpus.index.get("built_at")
+        if self._built_for == built_at:
+            return True
+        with self._lock:
+            if self._built_for != built_at:
+                try:
+                    from eventlet import tpool
+                    tpool.execute(self._build)  # keep the hub responsive while indexing
+                except ImportError:
+                    self._build()
+                self._built_for = built_at
+        return True
+
+    def search(self, query, limit=10, course=None):
+        """
+        BM25 search. Returns {"results": [...], "facets": {"course_codes": {...}}, "total_pages": n}.
+
+        `course` restricts results to materials whose filename carries that course code.
+        """
+        empty = {"results": [], "facets": {"course_codes": {}}, "total_pages": 0}
+        if not self.ensure_built() or not self.pages:
+            return empty
+        self.searches += 1
+
+        terms = [t for t in dict.fromkeys(embedder.tokens(query)) if t in self.postings]
+        if not terms:
+            return empty
+
+        n_pages = len(self.pages)
+        scores = np.zeros(n_pages, dtype=np.float32)
+        for term in terms:
+            ids, tfs = self.postings[term]
+            idf = math.log(1 + (n_pages - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.page_lengths[ids] / self.avg_length)
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+
+        matched = np.nonzero(scores)[0]
+
+        # Facets over every matching document, before the course filter is applied
+        facet_counts = Counter()
+        matched_documents = {self.pages[i][0] for i in matched}
+        for relative_path in matched_documents:
+            facet_counts.update(self.documents[relative_path]["course_codes"])
+
+        if course:
+            course = course.strip().upper().replace(" ", "-").replace("_", "-")
+            matched = np.array([i for i in matched if course in self.documents[self.pages[i][0]]["course_codes"]],
+                               dtype=np.int64)
+
+        ranked = matched[np.argsort(-scores[matched], kind='stable')] if len(matched) else matched
+        results, per_document = [], Counter()
+        for page_id in ranked:
+            relative_path, page_number = self.pages[page_id]
+            if per_document[relative_path] >= SEARCH_MAX_PAGES_PER_DOCUMENT:
+                continue
+            per_document[relative_path] += 1
+            document = self.documents[relative_path]
+            results.append({
+                "path": relative_path,
+                "title": document["title"],
+                "page": page_number,
+                "pages": document["pages"],
+                "score": round(float(scores[page_id]), 3),
+                "course_codes": document["course_codes"],
+                "snippet": make_snippet(self.corpus.page_text(relative_path, page_number), terms)
+            })
+            if len(results) >= limit:
+                break
+
+        return {
+            "results": results,
+            "facets": {"course_codes": dict(facet_counts.most_common())},
+            "total_pages": int(len(matched))
+        }
+
+    def warm(self):
+        """Build the index ahead of the first search (call from a background thread)."""
+        try:
+            self.ensure_built()
+        except Exception as e:
+            debug_print(f"⚠️ Could not build materials search index: {e}")
+
+    def stats(self):
+        return {
+            "pages": len(self.pages),
+            "terms": len(self.postings),
+            "documents": len(self.documents),
+            "build_seconds": self.build_seconds,
+            "searches": self.searches
+        }
+
+
+# Process-wide search index
+material_search = MaterialSearchIndex()
@@ -0,0 +1,388 @@
+"""
+Offline corpus of the static/materials library.
+
+`python materials_corpus.py` extracts the text of every PDF, DOCX and PPTX
+under static/materials once and writes a compact, page-addressable store to
+MATERIALS_CORPUS_DIR:
+
+    corpus-<build>.txt   all page texts back to back (UTF-8, memory-mapped by readers)
+    index.json           per document: mtime, size, sha256, title and the byte
+                         offsets of each page in the blob
+
+Runs are incremental. A file whose mtime and size are unchanged is not
+touched. A file whose bytes hash the same is not re-parsed either. In both
+cases its pages are copied from the previous blob. Legacy binary .ppt files
+cannot be read by any of our parsers and are listed as unsupported.
+
+Readers use MaterialsCorpus, which reloads automatically after a rebuild.
+The passage index used by /ask (retrieval.py) is rebuilt at the end of each run.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree import ElementTree
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MATERIALS_DIR = os.getenv('MATERIALS_DIR', os.path.join(BASE_DIR, 'static', 'materials'))
+MATERIALS_CORPUS_DIR = os.getenv('MATERIALS_CORPUS_DIR', os.path.join(BASE_DIR, 'materials_corpus'))
+
+CORPUS_VERSION = 1
+SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.pptx'}
+UNSUPPORTED_EXTENSIONS = {'.ppt', '.doc'}
+DOCX_PAGE_CHARS = 3000  # DOCX has no stored pages; split into pages of about this size
+
+SLIDE_NAME = re.compile(r"ppt/slides/slide(\d+)\.xml$")
+DRAWING_TEXT = '{http://schemas.openxmlformats.org/drawingml/2006/main}t'
+DRAWING_PARAGRAPH = '{http://schemas.openxmlformats.org/drawingml/2006/main}p'
+
+
+# ============================================
+# Extractors (run in worker processes)
+# ============================================
+def extract_pdf_pages(path):
+    from pdf_extraction import fitz, extract_page_range
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    return [text for _, text in extract_page_range(path, 0, page_count)]
+
+
+def extract_docx_pages(path):
+    import docx
+    document = docx.Document(path)
+    blocks = [p.text.strip() for p in document.paragraphs if p.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells]
+            if any(cells):
+                blocks.append(" | ".join(cells))
+
+    pages, current = [], []
+    for block in blocks:
+        if current and sum(len(b) for b in current) + len(block) > DOCX_PAGE_CHARS:
+            pages.append("\n".join(current))
+            current = []
+        current.append(block)
+    if current:
+        pages.append("\n".join(current))
+    return pages
+
+
+def extract_pptx_pages(path):
+    """One page per slide, read straight from the slide XML."""
+    with zipfile.ZipFile(path) as archive:
+        slides = sorted(
+            (int(match.group(1)), name)
+            for name in archive.namelist()
+            for match in [SLIDE_NAME.match(name)] if match
+        )
+        pages = []
+        for _, name in slides:
+            root = ElementTree.fromstring(archive.read(name))
+            lines = []
+            for paragraph in root.iter(DRAWING_PARAGRAPH):
+                line = "".join(node.text or "" for node in paragraph.iter(DRAWING_TEXT)).strip()
+                if line:
+                    lines.append(line)
+            pages.append("\n".join(lines))
+    return pages
+
+
+EXTRACTORS = {
+    '.pdf': extract_pdf_pages,
+    '.docx': extract_docx_pages,
+    '.pptx': extract_pptx_pages,
+}
+
+
+def extract_document(path):
+    """(pages, error) for one file; never raises, so one bad file cannot stop a build."""
+    try:
+        extension = os.path.splitext(path)[1].lower()
+        return EXTRACTORS[extension](path), None
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+
+
+# ============================================
+# Builder
+# ============================================
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_title(relative_path):
+    """Readable title from a filename like 1769475091_csc_323_note_i.pdf."""
+    name = os.path.splitext(os.path.basename(relative_path))[0]
+    name = re.sub(r"\.pdf$", "", name, flags=re.IGNORECASE)
+    name = re.sub(r"^\d{9,}_", "", name)  # upload timestamp prefix
+    return re.sub(r"[_\-]+", " ", name).strip()
+
+
+def scan_materials(materials_dir):
+    """Relative paths of every file under the materials directory, sorted."""
+    found = []
+    for root, _, files in os.walk(materials_dir):
+        for name in files:
+            if not name.startswith('.'):
+                found.append(os.path.relpath(os.path.join(root, name), materials_dir).replace(os.sep, '/'))
+    return sorted(found)
+
+
+def load_index(corpus_dir):
+    try:
+        with open(os.path.join(corpus_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == CORPUS_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return {"version": CORPUS_VERSION, "blob": None, "documents": {}}
+
+
+def build_corpus(materials_dir=MATERIALS_DIR, corpus_dir=MATERIALS_CORPUS_DIR, full=False, workers=None):
+    """Extract new or changed materials and write a fresh blob + index. Returns build stats."""
+    started = time.time()
+    os.makedirs(corpus_dir, exist_ok=True)
+    previous = {"version": CORPUS_VERSION, "blob": None, "documents": {}} if full else load_index(corpus_dir)
+    old_documents = previous.get("documents", {})
+    old_blob = None
+    old_blob_path = os.path.join(corpus_dir, previous["blob"]) if previous.get("blob") else None
+    if old_blob_path and os.path.exists(old_blob_path) and os.path.getsize(old_blob_path):
+        with open(old_blob_path, 'rb') as f:
+            old_blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    stats = {"reused": 0, "extracted": 0, "unsupported": 0, "failed": 0, "removed": 0}
+    documents = {}
+    to_extract = []
+
+    for relative_path in scan_materials(materials_dir):
+        path = os.path.join(materials_dir, relative_path)
+        extension = os.path.splitext(relative_path)[1].lower()
+        stat = os.stat(path)
+        entry = {
+            "title": document_title(relative_path),
+            "extension": extension,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime
+        }
+
+        if extension not in SUPPORTED_EXTENSIONS:
+            entry.update(status="unsupported", pages=0, offsets=[0],
+                         note="legacy binary format, convert to PDF or PPTX" if extension in UNSUPPORTED_EXTENSIONS else "not a document")
+            documents[relative_path] = entry
+            stats["unsupported"] += 1
+            continue
+
+        old = old_documents.get(relative_path)
+        unchanged = old and old_blob is not None and old.get("status") == "ok"
+        if unchanged and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_digest(path)
+            unchanged = unchanged and old.get("sha256") == entry["sha256"]
+
+        if unchanged:
+            entry.update(status="ok", pages=old["pages"], old_offsets=old["offsets"])
+            stats["reused"] += 1
+        else:
+            to_extract.append(relative_path)
+        documents[relative_path] = entry
+
+    stats["removed"] = len(set(old_documents) - set(documents))
+
+    # Parse changed files in parallel (this is a CLI, so a real process pool is fine)
+    extracted = {}
+    if to_extract:
+        print(f"📚 Extracting {len(to_extract)} file(s), reusing {stats['reused']}")
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            futures = {
+                pool.submit(extract_document, os.path.join(materials_dir, relative_path)): relative_path
+                for relative_path in to_extract
+            }
+            for future in as_completed(futures):
+                relative_path = futures[future]
+                pages, error = future.result()
+                extracted[relative_path] = (pages, error)
+                mark = "❌" if error else "✅"
+                print(f"   {mark} {relative_path}: {error or f'{len(pages)} page(s)'}")
+
+    # Write the new blob: reused pages are copied from the old blob, new pages appended
+    blob_name = f"corpus-{uuid.uuid4().hex[:12]}.txt"
+    offset = 0
+    with open(os.path.join(corpus_dir, blob_name + '.tmp'), 'wb') as blob:
+        for relative_path, entry in documents.items():
+            if entry.get("status") == "unsupported":
+                continue
+
+            if "old_offsets" in entry:
+                old_offsets = entry.pop("old_offsets")
+                page_bytes = [old_blob[old_offsets[i]:old_offsets[i + 1]] for i in range(len(old_offsets) - 1)]
+            else:
+                pages, error = extracted[relative_path]
+                if error:
+                    entry.update(status="failed", pages=0, offsets=[offset], note=error)
+                    stats["failed"] += 1
+                    continue
+                page_bytes = [text.encode('utf-8') for text in pages]
+                entry.update(status="ok", pages=len(page_bytes))
+                stats["extracted"] += 1
+
+            offsets = [offset]
+            for data in page_bytes:
+                blob.write(data)
+                offset += len(data)
+                offsets.append(offset)
+            entry["offsets"] = offsets
+
+    if old_blob is not None:
+        old_blob.close()
+    os.replace(os.path.join(corpus_dir, blob_name + '.tmp'), os.path.join(corpus_dir, blob_name))
+    index = {
+        "version": CORPUS_VERSION,
+        "built_at": time.time(),
+        "blob": blob_name,
+        "blob_bytes": offset,
+        "materials_dir": os.path.abspath(materials_dir),
+        "documents": documents
+    }
+    index_tmp = os.path.join(corpus_dir, 'index.json.tmp')
+    with open(index_tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(index_tmp, os.path.join(corpus_dir, 'index.json'))
+
+    # Older blobs are only deleted once the new index points elsewhere
+    for name in os.listdir(corpus_dir):
+        if name.startswith('corpus-') and name != blob_name:
+            try:
+                os.remove(os.path.join(corpus_dir, name))
+            except OSError:
+                pass
+
+    stats.update(documents=len(documents), blob_mb=round(offset / 1024 / 1024, 2),
+                 seconds=round(time.time() - started, 2))
+    return stats
+
+
+# ============================================
+# Reader
+# ============================================
+class MaterialsCorpus:
+    """Read-only access to the corpus store; the blob is memory-mapped, not loaded."""
+
+    def __init__(self, corpus_dir=MATERIALS_CORPUS_DIR):
+        self.corpus_dir = corpus_dir
+        self.index = None
+        self._blob = None
+        self._blob_file = None
+        self._index_mtime = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """(Re)load the index and remap the blob after a rebuild."""
+        index_path = os.path.join(self.corpus_dir, 'index.json')
+        try:
+            mtime = os.path.getmtime(index_path)
+        except OSError:
+            return False
+        if mtime == self._index_mtime:
+            return True
+
+        with self._lock:
+            if mtime == self._index_mtime:
+                return True
+            index = load_index(self.corpus_dir)
+            blob_file, blob = None, None
+            if index.get("blob") and index.get("blob_bytes"):
+                try:
+                    blob_file = open(os.path.join(self.corpus_dir, index["blob"]), 'rb')
+                    blob = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError) as e:
+                    debug_print(f"⚠️ Could not map materials corpus: {e}")
+                    if blob_file:
+                        blob_file.close()
+                    return False
+            # Old maps are left to the garbage collector; readers may still hold slices
+            self.index, self._blob, self._blob_file = index, blob, blob_file
+            self._index_mtime = mtime
+            debug_print(f"📚 Loaded materials corpus: {len(index['documents'])} documents")
+        return True
+
+    @property
+    def available(self):
+        return self._refresh() and self._blob is not None
+
+    def documents(self):
+        """{relative_path: metadata} for every readable document."""
+        if not self._refresh():
+            return {}
+        return {path: doc for path, doc in self.index["documents"].items() if doc.get("status") == "ok"}
+
+    def page_text(self, relative_path, page_number):
+        """Text of one page (1-based), or "" if unknown."""
+        if not self.available:
+            return ""
+        doc = self.index["documents"].get(relative_path)
+        if not doc or doc.get("status") != "ok" or not 1 <= page_number <= doc["pages"]:
+            return ""
+        offsets = doc["offsets"]
+        return self._blob[offsets[page_number - 1]:offsets[page_number]].decode('utf-8', errors='replace')
+
+    def iter_pages(self):
+        """Yield (relative_path, page_number, text) for the whole corpus."""
+        for relative_path, doc in self.documents().items():
+            for page_number in range(1, doc["pages"] + 1):
+                yield relative_path, page_number, self.page_text(relative_path, page_number)
+
+    def stats(self):
+        documents = self.documents()
+        return {
+            "available": self.available,
+            "documents": len(documents),
+            "pages": sum(doc["pages"] for doc in documents.values()),
+            "blob_mb": round((self.index or {}).get("blob_bytes", 0) / 1024 / 1024, 2),
+            "built_at": (self.index or {}).get("built_at")
+        }
+
+
+# Process-wide reader
+materials_corpus = MaterialsCorpus()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract static/materials into the materials corpus store.")
+    parser.add_argument('--materials', default=MATERIALS_DIR, help="materials directory to index")
+    parser.add_argument('--out', default=MATERIALS_CORPUS_DIR, help="corpus output directory")
+    parser.add_argument('--full', action='store_true', help="ignore the previous build and re-extract everything")
+    parser.add_argument('--workers', type=int, default=None, help="parallel extraction processes")
+    parser.add_argument('--skip-passages', action='store_true', help="do not rebuild the /ask passage index")
+    args = parser.parse_args(argv)
+
+    stats = build_corpus(args.materials, args.out, full=args.full, workers=args.workers)
+    print(f"✅ Materials corpus built: {json.dumps(stats)}")
+
+    if not args.skip_passages:
+        from retrieval import build_passage_index
+        build_passage_index(MaterialsCorpus(args.out))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
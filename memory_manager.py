@@ -0,0 +1,137 @@
+"""
+Token-aware compaction of the AI tutor's session memory.
+
+Past answers are stored as plain text (HTML stripped). When the recent turns
+go over MEMORY_TOKEN_BUDGET, the oldest exchanges are folded into a short
+running summary, so each /ask resends a bounded prompt instead of up to five
+full 1500-token HTML answers.
+"""
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '1500'))     # recent turns + summary
+MEMORY_SUMMARY_TOKENS = int(os.getenv('MEMORY_SUMMARY_TOKENS', '300'))  # running summary cap
+MEMORY_MESSAGE_TOKENS = int(os.getenv('MEMORY_MESSAGE_TOKENS', '500'))  # any single stored message
+MEMORY_TOKENIZER = os.getenv('MEMORY_TOKENIZER', 'gpt2')
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def get_tokenizer():
+    """Load the local Hugging Face tokenizer once; None if it is not cached on disk."""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            from transformers import AutoTokenizer
+            # Never download inside a request; pre-fetch the tokenizer at build time
+            _tokenizer = AutoTokenizer.from_pretrained(MEMORY_TOKENIZER, local_files_only=True)
+        except Exception as e:
+            debug_print(f"⚠️ Tokenizer '{MEMORY_TOKENIZER}' unavailable, estimating tokens: {e}")
+            _tokenizer = None
+    return _tokenizer
+
+
+def count_tokens(text):
+    """Count tokens with the local tokenizer, or estimate when it is unavailable."""
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return max(len(TOKEN_PATTERN.findall(text)), len(text) // 4)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, on a word boundary."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " …"
+
+
+def html_to_text(html):
+    """Strip HTML tags from an answer, keeping LaTeX and the visible text."""
+    if not html or '<' not in html:
+        return html or ""
+    text = BeautifulSoup(html, 'html.parser').get_text(" ")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def compact_message(role, content):
+    """Plain-text, length-capped form of a message for session memory."""
+    if not isinstance(content, str):
+        return content
+    if role == "assistant":
+        content = html_to_text(content)
+    return truncate_to_tokens(content.strip(), MEMORY_MESSAGE_TOKENS)
+
+
+def summarize_exchange(question, answer):
+    """One-line extractive summary of a question/answer pair."""
+    question_text = truncate_to_tokens(" ".join((question or "").split()), 40)
+    sentences = SENTENCE_END.split(" ".join((answer or "").split()))
+    gist = truncate_to_tokens(" ".join(sentences[:2]), 60)
+    return f"- Student asked: {question_text} | Tutor explained: {gist}"
+
+
+def compact_memory(memory, summary="", budget=MEMORY_TOKEN_BUDGET, max_messages=None):
+    """
+    Fold the oldest exchanges into the running summary until the memory fits.
+
+    Returns (memory, summary). The latest exchange is always kept verbatim.
+    """
+    memory = list(memory)
+    summary_lines = [line for line in (summary or "").split("\n") if line.strip()]
+
+    def total_tokens():
+        return count_tokens("\n".join(summary_lines)) + sum(
+            count_tokens(m["content"]) for m in memory if isinstance(m.get("content"), str)
+        )
+
+    while len(memory) > 2 and (
+        total_tokens() > budget or (max_messages and len(memory) > max_messages)
+    ):
+        oldest = memory.pop(0)
+        if oldest["role"] == "user" and memory and memory[0]["role"] == "assistant":
+            answer = memory.pop(0)
+            summary_lines.append(summarize_exchange(oldest["content"], answer["content"]))
+        else:
+            summary_lines.append(summarize_exchange(oldest["content"], ""))
+
+    # The summary itself is capped; the oldest lines go first
+    while len(summary_lines) > 1 and count_tokens("\n".join(summary_lines)) > MEMORY_SUMMARY_TOKENS:
+        summary_lines.pop(0)
+
+    return memory, "\n".join(summary_lines)
+
+
+def build_memory_messages(memory, summary=""):
+    """Chat messages for the prompt: running summary (if any) then recent turns."""
+    messages = []
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": "Summary of the earlier conversation with this student:\n" + summary
+        })
+    for mem in memory:
+        messages.append({"role": mem["role"], "content": mem["content"]})
+    return messages
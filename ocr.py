@@ -0,0 +1,240 @@
+"""
+OCR for uploaded images (photos of notes, screenshots, scanned pages).
+
+Pipeline per image:
+
+1. classify_image: a fast look at a 256 px thumbnail (colourfulness,
+   midtones, rows of ink separated by blank rows) sorts images into text,
+   diagram or mixed. Obvious diagrams and photos skip OCR entirely; the
+   vision model handles them.
+2. preprocess_for_ocr: fix EXIF orientation, convert to grayscale,
+   downscale to OCR_MAX_SIDE, stretch the contrast and binarize with an Otsu
+   threshold. Tesseract is faster and more accurate on the result.
+3. tesseract runs as a child process (pytesseract). At most
+   OCR_MAX_PROCESSES run at once per app worker, each limited to one
+   OpenMP thread.
+
+Results are cached in the extraction cache by the sha256 of the image bytes.
+CPU-bound image work runs in eventlet's native thread pool.
+"""
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from extraction_cache import extraction_cache, file_sha256
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '2000'))          # px; larger images are downscaled first
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', '20'))
+OCR_MAX_PROCESSES = int(os.getenv('OCR_MAX_PROCESSES', str(min(2, os.cpu_count() or 1))))
+
+# Tesseract parallelises with OpenMP by default, which oversubscribes the CPU
+# when several OCR processes run side by side
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+CLASSIFY_SIDE = 256
+COLORFUL_SATURATION = 0.30   # mean saturation above which an image is a chart, diagram or photo
+PHOTO_MIDTONES = 0.45        # share of mid-gray pixels above which an image is a photo
+SOLID_INK = 0.15             # ink coverage of filled shapes; a few lines of text stay well below
+MIN_TEXT_LINES = 3
+
+_ocr_slots = threading.BoundedSemaphore(OCR_MAX_PROCESSES)
+_stats_lock = threading.Lock()
+_stats = {"ocr_runs": 0, "skipped_diagrams": 0, "failures": 0, "ocr_seconds": 0.0}
+_tesseract_missing = False
+
+
+def _native(fn, *args):
+    """Run CPU-bound image work in a native thread so the eventlet hub keeps serving requests."""
+    try:
+        from eventlet import tpool
+    except ImportError:
+        return fn(*args)
+    return tpool.execute(fn, *args)
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def otsu_threshold(gray):
+    """Otsu's threshold (0-255) of a uint8 grayscale array."""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = histogram.sum()
+    if total == 0:
+        return 128
+    levels = np.arange(256)
+    weight_background = np.cumsum(histogram)
+    weight_foreground = total - weight_background
+    mass = np.cumsum(histogram * levels)
+    mean_background = mass / np.maximum(weight_background, 1)
+    mean_foreground = (mass[-1] - mass) / np.maximum(weight_foreground, 1)
+    between = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    return int(np.argmax(between))
+
+
+def load_image(source):
+    """Open a path, bytes or file object as an upright PIL image."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif hasattr(source, 'seek'):
+        source.seek(0)
+    image = Image.open(source)
+    image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def classify_image(image):
+    """
+    Classify an image as "text", "diagram" or "mixed" from a small thumbnail.
+
+    Returns (label, features). Only "diagram" skips OCR, so uncertain
+    images fall into "mixed".
+    """
+    small = image.convert('RGB')
+    small.thumbnail((CLASSIFY_SIDE, CLASSIFY_SIDE))
+    rgb = np.asarray(small, dtype=np.float32) / 255.0
+
+    brightest, darkest = rgb.max(axis=2), rgb.min(axis=2)
+    saturation = float(np.where(brightest > 0, (brightest - darkest) / np.maximum(brightest, 1e-6), 0).mean())
+
+    gray = (rgb.mean(axis=2) * 255).astype(np.uint8)
+    threshold = otsu_threshold(gray)
+    ink = gray < threshold
+    if ink.mean() > 0.5:  # light text on a dark background
+        ink = ~ink
+    ink_ratio = float(ink.mean())
+    midtones = float(((gray > 64) & (gray < 192)).mean())
+
+    # Lines of text show up as alternating inked and blank pixel rows
+    inked_rows = ink.mean(axis=1) > 0.02
+    text_lines = int(np.count_nonzero(inked_rows[1:] != inked_rows[:-1]) // 2)
+
+    features = {
+        "saturation": round(saturation, 3),
+        "ink_ratio": round(ink_ratio, 3),
+        "midtones": round(midtones, 3),
+        "text_lines": text_lines
+    }
+    if ink_ratio < 0.003:
+        label = "diagram"  # blank or nearly blank
+    elif text_lines < MIN_TEXT_LINES and (saturation > COLORFUL_SATURATION or midtones > PHOTO_MIDTONES
+                                          or ink_ratio > SOLID_INK):
+        label = "diagram"
+    elif text_lines >= MIN_TEXT_LINES and saturation <= COLORFUL_SATURATION and ink_ratio < 0.4:
+        label = "text"
+    else:
+        label = "mixed"
+    return label, features
+
+
+def preprocess_for_ocr(image):
+    """Grayscale, downscale to OCR_MAX_SIDE, autocontrast and Otsu-binarize an image for tesseract."""
+    gray = image.convert('L')
+    if max(gray.size) > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / max(gray.size)
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))), Image.LANCZOS)
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+    threshold = otsu_threshold(np.asarray(gray))
+    return gray.point(lambda value: 255 if value > threshold else 0)
+
+
+def _prepare(source):
+    image = load_image(source)
+    label, features = classify_image(image)
+    return label, features, (preprocess_for_ocr(image) if label != "diagram" else None)
+
+
+def run_tesseract(image):
+    """OCR a preprocessed image in a tesseract child process (bounded by OCR_MAX_PROCESSES)."""
+    global _tesseract_missing
+    if _tesseract_missing:
+        return None
+    with _ocr_slots:
+        started = time.time()
+        try:
+            text = pytesseract.image_to_string(image, lang=OCR_LANG, config='--psm 3', timeout=OCR_TIMEOUT)
+        except pytesseract.TesseractNotFoundError:
+            _tesseract_missing = True
+            print("⚠️ tesseract is not installed; image OCR is disabled")
+            return None
+        except (RuntimeError, pytesseract.TesseractError) as e:  # RuntimeError: timeout
+            _count("failures")
+            debug_print(f"⚠️ OCR failed: {e}")
+            return None
+        _count("ocr_runs")
+        _count("ocr_seconds", time.time() - started)
+    return "\n".join(line.rstrip() for line in text.splitlines()).strip()
+
+
+def _ocr_uncached(source):
+    try:
+        label, features, prepared = _native(_prepare, source)
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        debug_print(f"⚠️ Unreadable image: {e}")
+        return {"text": "", "classification": "unreadable", "is_diagram": True, "ocr": False, "features": {}}
+
+    if prepared is None:
+        _count("skipped_diagrams")
+        debug_print(f"🖼️ Diagram detected ({features}), skipping OCR")
+        return {"text": "", "classification": label, "is_diagram": True, "ocr": False, "features": features}
+
+    text = run_tesseract(prepared)
+    if text is None:  # OCR unavailable or failed: keep the classifier's verdict, but do not cache
+        return {"text": "", "classification": label, "is_diagram": label != "text", "ocr": False,
+                "features": features}
+    words = [word for word in text.split() if sum(ch.isalpha() for ch in word) >= 2]
+    return {
+        "text": text,
+        "classification": label,
+        "is_diagram": label != "text" and len(words) < 5,
+        "ocr": True,
+        "features": features
+    }
+
+
+def ocr_image(source, digest=None):
+    """
+    OCR an image given as a path, bytes or file object.
+
+    Returns {"text", "classification", "is_diagram", "ocr", "features"}.
+    "ocr" is False when OCR was skipped (diagram) or unavailable.
+    """
+    if digest is None:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                digest = file_sha256(f)
+        else:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            digest = file_sha256(source)
+
+    if extraction_cache is None:
+        return _ocr_uncached(source)
+    return extraction_cache.get_or_compute(
+        digest, f"ocr-{OCR_LANG}", lambda: _ocr_uncached(source),
+        should_cache=lambda result: result["ocr"] or result["classification"] in ("diagram", "unreadable")
+    )
+
+
+def ocr_stats():
+    with _stats_lock:
+        runs = _stats["ocr_runs"]
+        return {
+            "tesseract_available": not _tesseract_missing,
+            "max_processes": OCR_MAX_PROCESSES,
+            "ocr_runs": runs,
+            "skipped_diagrams": _stats["skipped_diagrams"],
+            "failures": _stats["failures"],
+            "avg_ocr_seconds": round(_stats["ocr_seconds"] / runs, 3) if runs else 0.0
+        }
@@ -0,0 +1,221 @@
+"""
+PDF text extraction with PyMuPDF.
+
+Small documents are read in a native thread (eventlet.tpool). Larger ones
+are split into page ranges, each parsed by a worker process
+(`python pdf_extraction.py PATH START STOP`) that streams one JSON line per
+page back over a green pipe. The CPU-bound parsing of 100-300 page lecture
+notes then uses every core and never blocks the eventlet hub.
+
+concurrent.futures' ProcessPoolExecutor is not used on purpose: its
+management thread becomes a green thread under monkey_patch and deadlocks
+the hub.
+
+Pages are yielded in order as soon as they arrive (iter_pdf_pages), and at
+most PDF_MAX_PAGES pages are read per document.
+"""
+import json
+import os
+import queue
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+
+try:
+    import pymupdf as fitz
+except ImportError:  # PyMuPDF < 1.24.3
+    import fitz
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', '400'))
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(min(4, os.cpu_count() or 1))))  # processes per document
+PDF_MAX_PROCESSES = int(os.getenv('PDF_MAX_PROCESSES', str(PDF_WORKERS)))      # across all requests
+PDF_PAGES_PER_WORKER = int(os.getenv('PDF_PAGES_PER_WORKER', '24'))           # fewer pages are read in-process
+
+HYPHENATED_BREAK = re.compile(r"(\w)-\n(\w)")
+TRAILING_SPACES = re.compile(r"[ \t]+\n")
+EXTRA_BLANK_LINES = re.compile(r"\n{3,}")
+
+_process_slots = threading.BoundedSemaphore(PDF_MAX_PROCESSES)
+
+
+def clean_page_text(text):
+    """Normalise PyMuPDF page text: join hyphenated line breaks, drop extra blank lines."""
+    text = text.replace("\x00", "").replace("\r", "")
+    text = HYPHENATED_BREAK.sub(r"\1\2", text)
+    text = TRAILING_SPACES.sub("\n", text)
+    return EXTRA_BLANK_LINES.sub("\n\n", text).strip()
+
+
+def extract_page_range(path, start, stop):
+    """Extract pages [start, stop) of the PDF at path as (page_number, text) pairs."""
+    pages = []
+    with fitz.open(path) as doc:
+        for number in range(start, stop):
+            pages.append((number + 1, clean_page_text(doc.load_page(number).get_text("text"))))
+    return pages
+
+
+def extract_page_range_native(path, start, stop):
+    """extract_page_range in a native thread so the hub keeps serving other requests."""
+    try:
+        from eventlet import tpool
+    except ImportError:
+        return extract_page_range(path, start, stop)
+    return tpool.execute(extract_page_range, path, start, stop)
+
+
+class PdfSource:
+    """
+    Context manager giving a file path for a PDF passed as a path, bytes or file object.
+
+    Worker processes open the document by path, so uploads are written to one
+    temporary file instead of being piped into every worker.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.path = None
+        self._temporary = False
+
+    def __enter__(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            self.path = os.fspath(self.source)
+            return self.path
+
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            data = self.source
+        else:
+            self.source.seek(0)
+            data = self.source.read()
+
+        handle = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+        with handle:
+            handle.write(data)
+        self.path = handle.name
+        self._temporary = True
+        return self.path
+
+    def __exit__(self, *exc):
+        if self._temporary and self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class RangeWorker:
+    """One worker process extracting a page range, read by a (green) reader thread."""
+
+    def __init__(self, path, start, stop):
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.process = None
+        self.failed = False
+        self._pages = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            with _process_slots:
+                self.process = subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), self.path, str(self.start), str(self.stop)],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+                # eventlet's green pipe is unbuffered, so read large chunks instead of line by line
+                pending = b""
+                while True:
+                    chunk = self.process.stdout.read(65536)
+                    if not chunk:
+                        break
+                    *lines, pending = (pending + chunk).split(b"\n")
+                    for line in lines:
+                        self._pages.put(tuple(json.loads(line)))
+                self.failed = self.process.wait() != 0
+        except Exception as e:
+            debug_print(f"⚠️ PDF worker for pages {self.start + 1}-{self.stop} failed: {e}")
+            self.failed = True
+        finally:
+            self._pages.put(None)
+
+    def pages(self):
+        """Yield pages as the worker sends them; re-read anything it did not deliver in-process."""
+        received = 0
+        while True:
+            page = self._pages.get()
+            if page is None:
+                break
+            received += 1
+            yield page
+
+        if self.failed or received < self.stop - self.start:
+            debug_print(f"⚠️ Re-reading pages {self.start + received + 1}-{self.stop} in-process")
+            yield from extract_page_range_native(self.path, self.start + received, self.stop)
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+
+def pdf_page_count(path, max_pages=PDF_MAX_PAGES):
+    """Number of pages that will be read from the PDF at path; ValueError if encrypted or unreadable."""
+    try:
+        with fitz.open(path) as doc:
+            if doc.needs_pass:
+                raise ValueError("PDF is password protected")
+            page_count = doc.page_count
+    except (fitz.FileDataError, RuntimeError) as e:
+        raise ValueError(f"Unreadable PDF: {e}")
+
+    if max_pages and page_count > max_pages:
+        debug_print(f"✂️ PDF has {page_count} pages, reading the first {max_pages}")
+        return max_pages
+    return page_count
+
+
+def iter_pdf_pages(source, max_pages=PDF_MAX_PAGES):
+    """
+    Yield (page_number, text) for each page in order, up to max_pages.
+
+    `source` may be a path, bytes or a file object. Raises ValueError for
+    encrypted or unreadable PDFs.
+    """
+    with PdfSource(source) as path:
+        page_count = pdf_page_count(path, max_pages)
+
+        workers = min(PDF_WORKERS, page_count // PDF_PAGES_PER_WORKER)
+        if workers <= 1:
+            yield from extract_page_range_native(path, 0, page_count)
+            return
+
+        step = -(-page_count // workers)
+        range_workers = [RangeWorker(path, start, min(start + step, page_count))
+                         for start in range(0, page_count, step)]
+        try:
+            for worker in range_workers:
+                yield from worker.pages()
+        finally:
+            for worker in range_workers:
+                worker.kill()
+
+
+def extract_pdf_text(source, max_pages=PDF_MAX_PAGES):
+    """Full text of a PDF, pages separated by blank lines."""
+    return "\n\n".join(text for _, text in iter_pdf_pages(source, max_pages) if text)
+
+
+if __name__ == '__main__':
+    # Worker process: python pdf_extraction.py PATH START STOP
+    pdf_path, first, last = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+    with fitz.open(pdf_path) as document:
+        for page_index in range(first, last):
+            page_text = clean_page_text(document.load_page(page_index).get_text("text"))
+            sys.stdout.write(json.dumps([page_index + 1, page_text]) + "\n")
+            sys.stdout.flush()
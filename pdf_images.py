@@ -0,0 +1,259 @@
+"""
+Deduplicated image extraction for the PDF analyzer.
+
+Lecture decks repeat the same logo, header band and slide background on
+every page, and a department's decks share them across documents. Writing
+every embedded image per analysis fills the disk with copies nobody looks
+at. The extractor therefore:
+
+1. skips images that cannot carry content: fewer than PDF_IMAGE_MIN_SIDE
+   pixels on a side, banner-shaped (aspect ratio above PDF_IMAGE_MAX_ASPECT),
+   drawn smaller than PDF_IMAGE_MIN_AREA of the page, or nearly uniform
+   (backgrounds, fills);
+2. decodes each image stream once: a stream reused on many pages (same
+   xref) or embedded twice (same raw bytes) is only looked at once;
+3. computes a 128-bit difference hash (horizontal + vertical dHash) and
+   treats images within PDF_IMAGE_HASH_DISTANCE bits of an earlier one as
+   the same picture. They are listed once, with all their pages;
+4. stores images content-addressed by that hash under PDF_IMAGE_DIR as
+   <hash>.webp (at most PDF_IMAGE_MAX_SIDE px) plus <hash>.thumb.webp
+   (PDF_THUMB_SIDE px). An image seen in an earlier document is not
+   re-encoded; the stored files are reused.
+
+The manifest of a document is cached in the extraction cache by the file's
+sha256. It is recomputed when the disk janitor has since deleted its files.
+The janitor expires stored images by their last use. touch_images() marks
+the images of an analysis as used whenever the analysis is loaded, and
+serving an image marks that image as used.
+"""
+import hashlib
+import os
+import time
+import uuid
+
+import numpy as np
+from PIL import Image
+
+try:
+    import pymupdf as fitz
+except ImportError:  # PyMuPDF < 1.24.3
+    import fitz
+
+from extraction_cache import extraction_cache, file_sha256
+from pdf_extraction import PDF_MAX_PAGES, PdfSource
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+PDF_IMAGE_DIR = os.getenv('PDF_IMAGE_DIR', os.path.join(os.getcwd(), 'extracted_images'))
+PDF_IMAGE_URL_PREFIX = '/static/extracted_images'
+PDF_IMAGE_LIMIT = int(os.getenv('PDF_IMAGE_LIMIT', '40'))            # distinct images kept per document
+PDF_IMAGE_MAX_SIDE = int(os.getenv('PDF_IMAGE_MAX_SIDE', '1600'))
+PDF_THUMB_SIDE = int(os.getenv('PDF_THUMB_SIDE', '320'))
+PDF_IMAGE_QUALITY = int(os.getenv('PDF_IMAGE_QUALITY', '85'))
+
+PDF_IMAGE_MIN_SIDE = 64           # px; icons, bullets, spacer pixels
+PDF_IMAGE_MAX_ASPECT = 8.0        # header bands, rules and strips
+PDF_IMAGE_MIN_AREA = 0.01         # share of the page area the image is drawn on
+PDF_IMAGE_MIN_CONTRAST = 6.0      # grayscale standard deviation of a (nearly) uniform fill
+PDF_IMAGE_HASH_DISTANCE = 6       # bits of 128 within which two images are the same picture
+PDF_IMAGE_TOUCH_INTERVAL = 600    # seconds; last-use times are refreshed at most this often
+
+
+def _native(fn, *args):
+    """Run CPU-bound decoding in a native thread so the eventlet hub keeps serving requests."""
+    try:
+        from eventlet import tpool
+    except ImportError:
+        return fn(*args)
+    return tpool.execute(fn, *args)
+
+
+def difference_hash(image):
+    """128-bit perceptual hash (horizontal and vertical dHash) of a PIL image, as an int."""
+    gray = image.convert('L')
+    wide = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    tall = np.asarray(gray.resize((8, 9), Image.LANCZOS), dtype=np.int16)
+    bits = np.concatenate([(wide[:, 1:] > wide[:, :-1]).ravel(), (tall[1:, :] > tall[:-1, :]).ravel()])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def _is_uniform(image):
+    small = image.convert('L')
+    small.thumbnail((64, 64))
+    return float(np.asarray(small, dtype=np.float32).std()) < PDF_IMAGE_MIN_CONTRAST
+
+
+def _to_pil(doc, xref, smask=0):
+    """Decode an image XObject, flattening its soft mask onto white as the page shows it."""
+    pixmap = fitz.Pixmap(doc, xref)
+    if pixmap.n - pixmap.alpha not in (1, 3):
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)  # CMYK, indexed, separation
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    mode = 'L' if pixmap.n == 1 else 'RGB'
+    image = Image.frombytes(mode, (pixmap.width, pixmap.height), pixmap.samples)
+
+    if smask:
+        mask = fitz.Pixmap(doc, smask)
+        if mask.n == 1:
+            alpha = Image.frombytes('L', (mask.width, mask.height), mask.samples)
+            if alpha.size != image.size:
+                alpha = alpha.resize(image.size)
+            background = Image.new(mode, image.size, 'white')
+            background.paste(image, mask=alpha)
+            image = background
+    return image
+
+
+def image_paths(key):
+    """(image, thumbnail) paths of a stored picture."""
+    directory = os.path.join(PDF_IMAGE_DIR, key[:2])
+    return os.path.join(directory, f"{key}.webp"), os.path.join(directory, f"{key}.thumb.webp")
+
+
+def touch_image(key):
+    """Mark a stored picture (image and thumbnail) as recently used, for the janitor's LRU."""
+    now = time.time()
+    for path in image_paths(key):
+        try:
+            if now - os.path.getmtime(path) > PDF_IMAGE_TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+
+
+def touch_images(images):
+    """Mark every picture of an extract_pdf_images() manifest as recently used."""
+    for image in images or []:
+        if image.get("hash"):
+            touch_image(image["hash"])
+
+
+def _store(image, key):
+    """Write the WebP image and thumbnail unless an earlier document already stored them."""
+    path, thumbnail_path = image_paths(key)
+    if os.path.exists(path) and os.path.exists(thumbnail_path):
+        touch_image(key)
+        return True
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    for target, side, quality in ((path, PDF_IMAGE_MAX_SIDE, PDF_IMAGE_QUALITY), (thumbnail_path, PDF_THUMB_SIDE, 70)):
+        copy = image.copy()
+        copy.thumbnail((side, side), Image.LANCZOS)
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        copy.save(tmp_path, 'WEBP', quality=quality, method=4)
+        os.replace(tmp_path, target)
+    return False
+
+
+def _add_page(images, found, page_number):
+    if found is not None and page_number not in images[found]["pages"]:
+        images[found]["pages"].append(page_number)
+
+
+def _extract(path, max_pages):
+    images, kept_hashes = [], []
+    seen_xrefs, seen_streams = {}, {}  # xref / raw stream sha1 -> index in images (None: skipped)
+    counts = {"references": 0, "skipped": 0, "duplicates": 0, "reused": 0}
+
+    with fitz.open(path) as doc:
+        for index in range(min(doc.page_count, max_pages)):
+            page = doc.load_page(index)
+            page_area = abs(page.rect) or 1
+            for xref, smask, width, height, *_ in page.get_images(full=True):
+                counts["references"] += 1
+                if xref in seen_xrefs:  # the same image object drawn again (logos, backgrounds)
+                    _add_page(images, seen_xrefs[xref], index + 1)
+                    continue
+                seen_xrefs[xref] = None
+
+                if (min(width, height) < PDF_IMAGE_MIN_SIDE
+                        or max(width, height) > PDF_IMAGE_MAX_ASPECT * min(width, height)
+                        or max((abs(rect) for rect in page.get_image_rects(xref)), default=0)
+                        < PDF_IMAGE_MIN_AREA * page_area):
+                    counts["skipped"] += 1
+                    continue
+
+                stream_key = hashlib.sha1(doc.xref_stream_raw(xref) or b"").hexdigest()
+                if stream_key in seen_streams:  # the same bytes embedded again
+                    seen_xrefs[xref] = seen_streams[stream_key]
+                    _add_page(images, seen_xrefs[xref], index + 1)
+                    counts["duplicates"] += 1
+                    continue
+                seen_streams[stream_key] = None
+
+                try:
+                    image = _to_pil(doc, xref, smask)
+                except (RuntimeError, ValueError, KeyError) as e:
+                    debug_print(f"⚠️ Could not decode PDF image {xref}: {e}")
+                    continue
+                if _is_uniform(image):
+                    counts["skipped"] += 1
+                    continue
+
+                image_hash = difference_hash(image)
+                match = next((i for i, kept in enumerate(kept_hashes)
+                              if bin(kept ^ image_hash).count("1") <= PDF_IMAGE_HASH_DISTANCE), None)
+                if match is not None:  # the same picture, re-encoded or rescaled
+                    seen_xrefs[xref] = seen_streams[stream_key] = match
+                    _add_page(images, match, index + 1)
+                    counts["duplicates"] += 1
+                    continue
+                if len(images) >= PDF_IMAGE_LIMIT:
+                    continue
+
+                key = f"{image_hash:032x}"
+                counts["reused"] += _store(image, key)
+                image_path, thumbnail_path = image_paths(key)
+                seen_xrefs[xref] = seen_streams[stream_key] = len(images)
+                kept_hashes.append(image_hash)
+                images.append({
+                    "hash": key,
+                    "page": index + 1,
+                    "pages": [index + 1],
+                    "width": image.width,
+                    "height": image.height,
+                    "path": image_path,
+                    "thumbnail_path": thumbnail_path,
+                    "url": f"{PDF_IMAGE_URL_PREFIX}/{key[:2]}/{key}.webp",
+                    "thumbnail_url": f"{PDF_IMAGE_URL_PREFIX}/{key[:2]}/{key}.thumb.webp",
+                    "alt": f"Figure from page {index + 1}"
+                })
+
+    debug_print(f"🖼️ {len(images)} distinct image(s) from {counts['references']} reference(s): "
+                f"{counts['skipped']} decorative, {counts['duplicates']} duplicate(s), "
+                f"{counts['reused']} already stored")
+    return images
+
+
+def _files_present(images):
+    return all(os.path.exists(image["path"]) and os.path.exists(image["thumbnail_path"]) for image in images)
+
+
+def extract_pdf_images(source, digest=None, max_pages=PDF_MAX_PAGES):
+    """
+    Distinct content images of a PDF (path, bytes or file object) in page order.
+
+    Each entry has page, pages, width, height, path, url, thumbnail_path,
+    thumbnail_url, hash and alt.
+    """
+    with PdfSource(source) as path:
+        if digest is None:
+            with open(path, 'rb') as f:
+                digest = file_sha256(f)
+
+        kind = f"pdf-images-p{max_pages}"
+        if extraction_cache is not None:
+            images = extraction_cache.get(digest, kind)
+            if images is not None and _files_present(images):
+                touch_images(images)
+                return images
+
+        images = _native(_extract, path, max_pages)
+        if extraction_cache is not None:
+            extraction_cache.set(digest, kind, images)
+        return images
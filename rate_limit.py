@@ -0,0 +1,165 @@
+"""
+Per-user, per-route token-bucket rate limiting for the AI routes.
+
+Each (route, user) pair gets a bucket of `capacity` tokens that refills over
+`period` seconds. Buckets live in Redis when REDIS_URL is reachable, so every
+worker enforces the same limit; otherwise they are kept in process memory.
+A request that finds its bucket empty gets a 429 with Retry-After.
+"""
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request, session
+
+from utils import debug_print, get_redis
+
+# ============================================
+# Configuration
+# ============================================
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMIT_KEY_PREFIX = 'ratelimit:'
+LOCAL_BUCKET_LIMIT = 10000  # prune the in-memory fallback beyond this many buckets
+
+# Atomically refill and take tokens; returns {allowed, retry_after_ms}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) / 1000 * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('hset', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('pexpire', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, retry_after}
+"""
+
+
+def parse_limit(spec):
+    """Parse "capacity/seconds" (e.g. "20/60") into (capacity, refill per second)."""
+    capacity, _, period = spec.partition('/')
+    capacity = float(capacity)
+    period = float(period or 60)
+    return capacity, capacity / period
+
+
+class RateLimiter:
+    """Token buckets in Redis with an in-process fallback."""
+
+    def __init__(self):
+        self._buckets = {}  # key -> [tokens, last refill time]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def consume(self, key, capacity, rate, cost=1):
+        """Take `cost` tokens from a bucket; returns (allowed, retry_after seconds)."""
+        cost = min(cost, capacity)  # an oversized request must still be possible on a full bucket
+        allowed, retry_after = self._consume_redis(key, capacity, rate, cost)
+        if allowed is None:
+            allowed, retry_after = self._consume_local(key, capacity, rate, cost)
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return allowed, retry_after
+
+    def _consume_redis(self, key, capacity, rate, cost):
+        redis_client = get_redis()
+        if redis_client is None:
+            return None, 0
+        try:
+            allowed, retry_after_ms = redis_client.eval(
+                TOKEN_BUCKET_SCRIPT, 1, RATE_LIMIT_KEY_PREFIX + key,
+                capacity, rate, int(time.time() * 1000), cost
+            )
+            return bool(allowed), int(retry_after_ms) / 1000
+        except Exception as e:
+            debug_print(f"⚠️ Redis rate limit failed, using local bucket: {e}")
+            return None, 0
+
+    def _consume_local(self, key, capacity, rate, cost):
+        now = time.time()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                allowed, retry_after = True, 0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (cost - tokens) / rate
+
+            if len(self._buckets) > LOCAL_BUCKET_LIMIT:
+                # Buckets idle long enough to be full again carry no state
+                for stale in [k for k, (_, ts) in self._buckets.items() if now - ts > 3600]:
+                    del self._buckets[stale]
+        return allowed, retry_after
+
+    def stats(self):
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "local_buckets": len(self._buckets)
+        }
+
+
+def client_identity():
+    """Rate-limit identity: the logged-in username, else the client address."""
+    username = session.get('user', {}).get('username')
+    if username:
+        return f"user:{username}"
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return f"ip:{forwarded.split(',')[0].strip() or request.remote_addr}"
+
+
+def rate_limited(name, default_limit, cost=None):
+    """
+    Decorator applying a token bucket per user to a route.
+
+    The limit is "capacity/seconds", overridable with RATE_LIMIT_<NAME>.
+    `cost` is an optional callable returning how many tokens the current
+    request takes (e.g. one per uploaded file).
+    """
+    capacity, rate = parse_limit(os.getenv(f'RATE_LIMIT_{name.upper()}', default_limit))
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+
+            identity = client_identity()
+            allowed, retry_after = rate_limiter.consume(
+                f"{name}:{identity}", capacity, rate, cost() if cost else 1
+            )
+            if not allowed:
+                retry_after = max(1, math.ceil(retry_after))
+                debug_print(f"🚦 Rate limited {identity} on {name} (retry in {retry_after}s)")
+                response = jsonify({
+                    "success": False,
+                    "error": "You're sending requests too quickly. Please wait a moment and try again.",
+                    "retry_after": retry_after
+                })
+                return response, 429, {"Retry-After": str(retry_after)}
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# Process-wide limiter shared by all routes
+rate_limiter = RateLimiter()
@@ -0,0 +1,365 @@
+"""
+Passage retrieval over the study materials corpus for grounded /ask answers.
+
+Each corpus page is cut into overlapping passages of about RAG_CHUNK_WORDS
+words. Every passage is embedded with the local hashing embedder, and the
+vectors are saved next to the corpus as one float32 matrix:
+
+    rag-<corpus build>.npy    (n_passages, RAG_EMBEDDING_DIM) unit vectors
+    rag-<corpus build>.json   per passage: document path, page, character span
+
+Workers open the matrix memory-mapped, so it lives in the page cache once
+per host. A question is embedded and scored against every passage with a
+single matrix-vector product, which takes a few milliseconds for our
+corpus. The best passages are kept until RAG_TOKEN_BUDGET is used up.
+
+Hashed character trigrams make short questions noisy ("and another" scores
+0.35 against a trigonometry page), so a passage must also contain two of
+the question's content terms (one for questions with one or two). Questions
+without any ("give me another example", "simplify it") are not looked up
+at all; /ask retrieves for the previous question instead.
+
+The index is built by `python materials_corpus.py` after the corpus. If it
+is missing, the app builds it once in the background.
+
+Uploaded documents that follow-up questions refer to get the same
+treatment on the fly (DocumentPassages): a PDF too long for the prompt is
+cut into passages, and only the ones most relevant to the question are
+sent, within RAG_FILE_TOKEN_BUDGET.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from materials_corpus import MATERIALS_CORPUS_DIR, materials_corpus
+from material_search import course_codes
+from memory_manager import count_tokens, truncate_to_tokens
+from text_embeddings import TOKEN_PATTERN, HashingEmbedder
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+RAG_ENABLED = os.getenv('RAG_ENABLED', 'True').lower() == 'true'
+RAG_EMBEDDING_DIM = int(os.getenv('RAG_EMBEDDING_DIM', '1024'))
+RAG_CHUNK_WORDS = int(os.getenv('RAG_CHUNK_WORDS', '160'))
+RAG_CHUNK_OVERLAP = int(os.getenv('RAG_CHUNK_OVERLAP', '30'))
+RAG_TOP_K = int(os.getenv('RAG_TOP_K', '4'))
+RAG_TOKEN_BUDGET = int(os.getenv('RAG_TOKEN_BUDGET', '1200'))
+RAG_MIN_SCORE = float(os.getenv('RAG_MIN_SCORE', '0.25'))
+RAG_FILE_TOKEN_BUDGET = int(os.getenv('RAG_FILE_TOKEN_BUDGET', '8000'))  # uploaded document text per question
+RAG_FILE_CACHE_DOCS = int(os.getenv('RAG_FILE_CACHE_DOCS', '4'))         # embedded uploads kept per worker
+# Passages of a document the student chose are only ranked against each other: a lower bar than RAG_MIN_SCORE
+RAG_FILE_MIN_SCORE = float(os.getenv('RAG_FILE_MIN_SCORE', '0.1'))
+
+MIN_CHUNK_WORDS = 25  # shorter page tails are merged into the previous passage
+WORD = re.compile(r"\S+")
+
+# Words of follow-up requests that say nothing about the topic
+FOLLOW_UP_WORDS = {
+    "another", "more", "example", "examples", "again", "continue", "next", "previous", "last", "first",
+    "second", "third", "one", "ones", "simplify", "simpler", "simple", "easier", "elaborate", "expand",
+    "detail", "details", "further", "briefly", "brief", "shorter", "longer", "give", "show", "say", "said",
+    "mean", "means", "meant", "them", "they", "then", "also", "other", "same", "just", "like", "than",
+    "not", "yes", "okay", "thanks", "thank", "where", "there", "here", "get", "got", "don", "understand",
+    "help", "way", "ways", "some", "any", "all", "now", "still", "why", "answer", "question", "part",
+    # question framing shared by every topic
+    "difference", "differences", "between", "compare", "versus", "describe", "discuss", "list", "state",
+    "write", "meaning", "note", "notes", "work", "works"
+}
+
+# Passages use their own (smaller) hashing space than the semantic cache
+passage_embedder = HashingEmbedder(dim=RAG_EMBEDDING_DIM)
+
+
+def content_terms(question):
+    """The words of a question that can tie it to a passage (no stopwords or follow-up filler)."""
+    return {word for word in passage_embedder.tokens(question)
+            if len(word) > 2 and word not in FOLLOW_UP_WORDS}
+
+
+def chunk_page(text):
+    """Split one page into overlapping (start, end) character spans of about RAG_CHUNK_WORDS words."""
+    words = [(m.start(), m.end()) for m in WORD.finditer(text)]
+    if not words:
+        return []
+
+    step = max(1, RAG_CHUNK_WORDS - RAG_CHUNK_OVERLAP)
+    spans = []
+    for first in range(0, len(words), step):
+        last = min(first + RAG_CHUNK_WORDS, len(words))
+        if spans and last - first < MIN_CHUNK_WORDS:
+            spans[-1] = (spans[-1][0], words[last - 1][1])
+            break
+        spans.append((words[first][0], words[last - 1][1]))
+        if last == len(words):
+            break
+    return spans
+
+
+def index_paths(corpus_dir, blob_name):
+    stem = os.path.splitext(blob_name)[0].replace('corpus-', 'rag-')
+    return os.path.join(corpus_dir, stem + '.npy'), os.path.join(corpus_dir, stem + '.json')
+
+
+def build_passage_index(corpus=materials_corpus):
+    """Chunk and embed the whole corpus; writes the .npy/.json pair for the current build."""
+    if not corpus.available:
+        return None
+
+    started = time.time()
+    passages, vectors = [], []
+    for relative_path, page_number, text in corpus.iter_pages():
+        for start, end in chunk_page(text):
+            passages.append([relative_path, page_number, start, end])
+            vectors.append(passage_embedder.embed(text[start:end]))
+
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, RAG_EMBEDDING_DIM), np.float32)
+    matrix_path, meta_path = index_paths(corpus.corpus_dir, corpus.index["blob"])
+
+    np.save(matrix_path + '.tmp.npy', matrix)
+    os.replace(matrix_path + '.tmp.npy', matrix_path)
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({"dim": RAG_EMBEDDING_DIM, "chunk_words": RAG_CHUNK_WORDS, "passages": passages}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+    # Drop indexes of older corpus builds
+    keep = {os.path.basename(matrix_path), os.path.basename(meta_path)}
+    for name in os.listdir(corpus.corpus_dir):
+        if name.startswith('rag-') and name not in keep:
+            try:
+                os.remove(os.path.join(corpus.corpus_dir, name))
+            except OSError:
+                pass
+
+    seconds = round(time.time() - started, 2)
+    print(f"🧭 Passage index: {len(passages)} passages from {corpus.stats()['pages']} pages in {seconds}s")
+    return {"passages": len(passages), "seconds": seconds}
+
+
+class PassageRetriever:
+    """Top-k passage retrieval against the memory-mapped passage matrix."""
+
+    def __init__(self, corpus=materials_corpus):
+        self.corpus = corpus
+        self._lock = threading.Lock()
+        self._loaded_for = None
+        self._building = False
+        self.matrix = None
+        self.passages = []
+        self.passage_courses = None  # course codes per passage, for scoped retrieval
+        self.retrievals = 0
+        self.skipped = 0  # questions without content terms
+        self.total_ms = 0.0
+
+    def _load(self):
+        """Map the index for the current corpus build; False if it does not exist yet."""
+        if not self.corpus.available:
+            return False
+        blob = self.corpus.index["blob"]
+        if self._loaded_for == blob:
+            return True
+
+        matrix_path, meta_path = index_paths(self.corpus.corpus_dir, blob)
+        with self._lock:
+            if self._loaded_for == blob:
+                return True
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get("dim") != RAG_EMBEDDING_DIM:
+                    return False
+                matrix = np.load(matrix_path, mmap_mode='r')
+            except (OSError, ValueError):
+                return False
+
+            titles = {path: doc["title"] for path, doc in self.corpus.documents().items()}
+            self.passages = meta["passages"]
+            self.passage_courses = [set(course_codes(titles.get(p[0], ""))) for p in self.passages]
+            self.matrix = matrix
+            self._loaded_for = blob
+            debug_print(f"🧭 Loaded passage index: {len(self.passages)} passages")
+        return True
+
+    def warm(self):
+        """Load the index, building it in a native thread first if the corpus has none yet."""
+        try:
+            if self._load() or not self.corpus.available or self._building:
+                return
+            self._building = True
+            try:
+                from eventlet import tpool
+                tpool.execute(build_passage_index, self.corpus)
+            except ImportError:
+                build_passage_index(self.corpus)
+            finally:
+                self._building = False
+            self._load()
+        except Exception as e:
+            debug_print(f"⚠️ Could not build passage index: {e}")
+
+    def retrieve(self, question, top_k=RAG_TOP_K, token_budget=RAG_TOKEN_BUDGET,
+                 min_score=RAG_MIN_SCORE, course=None):
+        """
+        Best passages for a question, most relevant first, within token_budget.
+
+        Returns a list of {"id", "path", "title", "page", "score", "text"}; empty
+        when there is no index, the question has no content terms or nothing
+        is relevant enough.
+        """
+        terms = content_terms(question)
+        if not terms:
+            self.skipped += 1
+            return []
+        needed = min(2, (len(terms) + 1) // 2)
+        if not RAG_ENABLED or not self._load() or not self.passages:
+            return []
+
+        started = time.time()
+        scores = self.matrix @ passage_embedder.embed(question)
+        if course:
+            course = course.strip().upper().replace(" ", "-").replace("_", "-")
+            mask = np.fromiter((course in codes for codes in self.passage_courses), dtype=bool,
+                               count=len(self.passages))
+            scores = np.where(mask, scores, -1.0)
+
+        candidates = min(len(scores), top_k * 4)
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        best = best[np.argsort(-scores[best])]
+
+        titles = {path: doc["title"] for path, doc in self.corpus.documents().items()}
+        results, used_tokens, seen = [], 0, set()
+        for row in best:
+            score = float(scores[row])
+            if score < min_score or len(results) >= top_k:
+                break
+            path, page, start, end = self.passages[row]
+            if (path, page) in seen:  # overlapping passages of one page add little
+                continue
+            text = " ".join(self.corpus.page_text(path, page)[start:end].split())
+            if len(terms.intersection(TOKEN_PATTERN.findall(text.lower()))) < needed:
+                continue  # similar only by character trigrams or a single shared word
+            tokens = count_tokens(text)
+            if used_tokens + tokens > token_budget:
+                if results:
+                    break
+                text = truncate_to_tokens(text, token_budget)
+                tokens = token_budget
+            seen.add((path, page))
+            used_tokens += tokens
+            results.append({
+                "id": int(row),
+                "path": path,
+                "title": titles.get(path, path),
+                "page": page,
+                "score": round(score, 3),
+                "text": text
+            })
+
+        elapsed_ms = (time.time() - started) * 1000
+        self.retrievals += 1
+        self.total_ms += elapsed_ms
+        debug_print(f"🧭 Retrieved {len(results)} passage(s), {used_tokens} tokens in {elapsed_ms:.1f}ms")
+        return results
+
+    def stats(self):
+        return {
+            "enabled": RAG_ENABLED,
+            "passages": len(self.passages),
+            "building": self._building,
+            "retrievals": self.retrievals,
+            "skipped_no_terms": self.skipped,
+            "avg_ms": round(self.total_ms / self.retrievals, 2) if self.retrievals else 0.0
+        }
+
+
+class DocumentPassages:
+    """Question-relevant excerpts of long uploaded documents, for questions about them."""
+
+    def __init__(self, max_documents=RAG_FILE_CACHE_DOCS):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()  # sha256 -> (passage spans, passage matrix)
+        self._lock = threading.Lock()
+        self.excerpts = 0
+
+    def _index(self, text, digest):
+        with self._lock:
+            if digest in self._documents:
+                self._documents.move_to_end(digest)
+                return self._documents[digest]
+
+        spans = chunk_page(text)
+        texts = [text[start:end] for start, end in spans]
+        try:
+            from eventlet import tpool
+            matrix = tpool.execute(passage_embedder.embed_many, texts)
+        except ImportError:
+            matrix = passage_embedder.embed_many(texts)
+
+        with self._lock:
+            self._documents[digest] = (spans, matrix)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return spans, matrix
+
+    def excerpt(self, text, question, digest=None, token_budget=RAG_FILE_TOKEN_BUDGET,
+                min_score=RAG_FILE_MIN_SCORE):
+        """
+        The whole text if it fits token_budget. Otherwise the passages most
+        relevant to the question, topped up with the opening passages, in
+        document order and separated by "[…]".
+        """
+        if not text or (len(text) <= token_budget * 4 and count_tokens(text) <= token_budget):
+            return text
+        spans, matrix = self._index(text, digest or hashlib.sha256(text.encode('utf-8')).hexdigest())
+        if not spans:
+            return truncate_to_tokens(text, token_budget)
+
+        scores = matrix @ passage_embedder.embed(question or "")
+        relevant = [int(row) for row in np.argsort(-scores, kind='stable') if scores[row] >= min_score]
+        ranked = relevant + sorted(set(range(len(spans))) - set(relevant))
+
+        chosen, used_tokens = [], 0
+        for row in ranked:
+            start, end = spans[row]
+            tokens = count_tokens(text[start:end])
+            if used_tokens + tokens > token_budget:
+                break
+            chosen.append(row)
+            used_tokens += tokens
+        if not chosen:
+            return truncate_to_tokens(text[slice(*spans[ranked[0]])], token_budget)
+
+        merged = []  # neighbouring passages overlap by RAG_CHUNK_OVERLAP words
+        for start, end in sorted(spans[row] for row in chosen):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.excerpts += 1
+        debug_print(f"🧭 Sent {len(chosen)} of {len(spans)} passages ({len(relevant)} relevant, "
+                    f"{used_tokens} tokens) of an uploaded document")
+        return "\n[…]\n".join(text[start:end] for start, end in merged)
+
+
+def format_passages(passages):
+    """Prompt block listing retrieved passages as numbered, citable sources."""
+    lines = ["Relevant excerpts from this student's course materials. Base your answer on them when they "
+             "apply, and cite them as [1], [2] after the sentences that use them. Ignore excerpts that are "
+             "not relevant to the question."]
+    for number, passage in enumerate(passages, 1):
+        lines.append(f"\n[{number}] {passage['title']}, page {passage['page']}:\n{passage['text']}")
+    return "\n".join(lines)
+
+
+# Process-wide retriever used by /ask
+retriever = PassageRetriever()
+
+# Process-wide excerpter for uploaded documents referenced by follow-up questions
+document_passages = DocumentPassages()
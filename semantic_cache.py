@@ -0,0 +1,153 @@
+"""
+Semantic near-duplicate question cache for /ask.
+
+Questions are embedded locally (text_embeddings.HashingEmbedder) and kept in
+one NumPy matrix per scope (course or department). A new question reuses a
+stored answer when its cosine similarity to a cached question passes
+SEMANTIC_CACHE_THRESHOLD. Questions containing numbers or math are never
+matched semantically. An answer is stored with the course material sources
+it cites as [1], [2], so a hit returns them too.
+"""
+import os
+import re
+import threading
+
+import numpy as np
+
+from text_embeddings import embedder
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_MAX_PER_SCOPE = int(os.getenv('SEMANTIC_CACHE_MAX_PER_SCOPE', '2000'))
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'True').lower() == 'true'
+
+# Questions made only of stopwords ("what is it?") carry nothing to match on
+MIN_QUESTION_TOKENS = 1
+
+# Numbers, operators and signs are invisible to the word embedding, so
+# "2x^2 + 5x - 3 = 0" and "2x^2 + 5x + 3 = 0" look identical. Such questions
+# are only answered from the exact-match answer cache.
+EXACT_ONLY_PATTERN = re.compile(r"[0-9+*/^=<>%]|(?<![A-Za-z])-|-(?![A-Za-z])")
+
+
+class ScopeIndex:
+    """Fixed-capacity ring buffer of (question vector, answer entry) rows."""
+
+    def __init__(self, dim, capacity):
+        self.capacity = capacity
+        self.vectors = np.zeros((min(64, capacity), dim), dtype=np.float32)
+        self.questions = []
+        self.answers = []
+        self.next_slot = 0
+
+    def __len__(self):
+        return len(self.answers)
+
+    def search(self, vector):
+        """Return (row, similarity) of the closest cached question."""
+        if not self.answers:
+            return None, 0.0
+        scores = self.vectors[:len(self.answers)] @ vector
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+    def add(self, vector, question, entry):
+        if len(self.answers) < self.capacity:
+            row = len(self.answers)
+            if row >= self.vectors.shape[0]:
+                grown = np.zeros((min(self.vectors.shape[0] * 2, self.capacity), self.vectors.shape[1]), dtype=np.float32)
+                grown[:row] = self.vectors
+                self.vectors = grown
+            self.questions.append(question)
+            self.answers.append(entry)
+        else:
+            # Full: overwrite the oldest row
+            row = self.next_slot
+            self.next_slot = (self.next_slot + 1) % self.capacity
+            self.questions[row] = question
+            self.answers[row] = entry
+        self.vectors[row] = vector
+
+
+class SemanticCache:
+    """Per-scope semantic answer cache with hit/miss metrics."""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_per_scope=SEMANTIC_CACHE_MAX_PER_SCOPE):
+        self.threshold = threshold
+        self.max_per_scope = max_per_scope
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.scope_hits = {}
+        self.scope_misses = {}
+
+    def _usable(self, question):
+        if EXACT_ONLY_PATTERN.search(question or ""):
+            return False
+        return len(embedder.tokens(question)) >= MIN_QUESTION_TOKENS
+
+    def lookup(self, question, scope="global"):
+        """Return the cached {"answer", "sources"} of a near-duplicate question, or None."""
+        if not self._usable(question):
+            return None
+
+        vector = embedder.embed(question)
+        with self._lock:
+            index = self._scopes.get(scope)
+            row, score = index.search(vector) if index else (None, 0.0)
+
+            if row is not None and score >= self.threshold:
+                self.hits += 1
+                self.scope_hits[scope] = self.scope_hits.get(scope, 0) + 1
+                debug_print(f"🧲 Semantic cache hit in {scope} ({score:.3f}): {index.questions[row][:50]}")
+                return index.answers[row]
+
+            self.misses += 1
+            self.scope_misses[scope] = self.scope_misses.get(scope, 0) + 1
+            return None
+
+    def add(self, question, answer, scope="global", sources=None):
+        """Cache an answer, and the sources it cites, under its question's embedding."""
+        if not answer or not self._usable(question):
+            return
+
+        vector = embedder.embed(question)
+        with self._lock:
+            index = self._scopes.get(scope)
+            if index is None:
+                index = self._scopes[scope] = ScopeIndex(embedder.dim, self.max_per_scope)
+            index.add(vector, question, {"answer": answer, "sources": sources or []})
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "scopes": {
+                scope: {
+                    "entries": len(index),
+                    "hits": self.scope_hits.get(scope, 0),
+                    "misses": self.scope_misses.get(scope, 0)
+                }
+                for scope, index in self._scopes.items()
+            }
+        }
+
+
+def semantic_scope(course=None, department=None):
+    """Build the cache scope key: course first, then department, else global."""
+    if course:
+        return f"course:{course.strip().upper()}"
+    if department:
+        return f"department:{department.strip().lower()}"
+    return "global"
+
+
+# Process-wide semantic cache used by /ask
+semantic_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
@@ -0,0 +1,369 @@
+"""
+Server-side Flask sessions with lazily loaded, compactly encoded values.
+
+The session cookie only carries a random session id. The values live in
+Redis when REDIS_URL is reachable (one hash per session, one field per
+key), otherwise under SESSION_DIR (one file per key) for local runs.
+
+Each value is encoded with msgpack (msgspec) and zlib-compressed when it is
+larger than SESSION_COMPRESS_MIN_BYTES. Values are read and decoded one key
+at a time, on first access. A request that only checks session['user'] never
+loads the chat memory or an uploaded image. On save only the keys that
+were set or deleted are written.
+
+Sessions expire after SESSION_TTL seconds without a request. A cookie whose
+id the backend does not know gets a fresh id, so a client cannot choose its
+own session id, and login moves the session to a new id (regenerate()).
+"""
+import os
+import re
+import secrets
+import shutil
+import time
+import zlib
+
+import msgspec
+from flask.sessions import SessionInterface, SessionMixin
+
+from utils import debug_print, get_redis
+
+# ============================================
+# Configuration
+# ============================================
+SESSION_DIR = os.getenv('SESSION_DIR', os.path.join(os.getcwd(), 'flask_sessions'))
+SESSION_TTL = int(os.getenv('SESSION_TTL', str(7 * 24 * 3600)))  # idle sessions expire after 7 days
+SESSION_COMPRESS_MIN_BYTES = int(os.getenv('SESSION_COMPRESS_MIN_BYTES', '512'))
+SESSION_KEY_PREFIX = 'session:'
+
+VALID_SID = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+RAW, COMPRESSED = b'm', b'z'
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder()
+
+
+def encode_value(value):
+    """msgpack-encode a session value, zlib-compressing large ones."""
+    packed = _encoder.encode(value)
+    if len(packed) >= SESSION_COMPRESS_MIN_BYTES:
+        return COMPRESSED + zlib.compress(packed, 6)
+    return RAW + packed
+
+
+def decode_value(raw):
+    raw = bytes(raw)
+    if raw[:1] == COMPRESSED:
+        return _decoder.decode(zlib.decompress(raw[1:]))
+    return _decoder.decode(raw[1:])
+
+
+class RedisSessionBackend:
+    """One Redis hash per session: field = session key, value = encoded value."""
+
+    name = "redis"
+
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, sid):
+        return bool(self.client.exists(SESSION_KEY_PREFIX + sid))
+
+    def get(self, sid, key):
+        return self.client.hget(SESSION_KEY_PREFIX + sid, key)
+
+    def keys(self, sid):
+        return {k.decode('utf-8') for k in self.client.hkeys(SESSION_KEY_PREFIX + sid)}
+
+    def save(self, sid, values, deleted, ttl, replace=False):
+        name = SESSION_KEY_PREFIX + sid
+        pipe = self.client.pipeline()
+        if replace:
+            pipe.delete(name)
+        elif deleted:
+            pipe.hdel(name, *deleted)
+        if values:
+            pipe.hset(name, mapping=values)
+        pipe.expire(name, ttl)
+        pipe.execute()
+
+    def touch(self, sid, ttl):
+        self.client.expire(SESSION_KEY_PREFIX + sid, ttl)
+
+    def delete(self, sid):
+        self.client.delete(SESSION_KEY_PREFIX + sid)
+
+
+class FileSessionBackend:
+    """One directory per session and one file per key; the directory mtime is the last access."""
+
+    name = "disk"
+
+    def __init__(self, directory=SESSION_DIR, ttl=SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _dir(self, sid):
+        return os.path.join(self.directory, sid[:2], sid)
+
+    @staticmethod
+    def _filename(key):
+        return key.encode('utf-8').hex()
+
+    def _expired(self, sid):
+        try:
+            return time.time() - os.path.getmtime(self._dir(sid)) > self.ttl
+        except OSError:
+            return True
+
+    def exists(self, sid):
+        return not self._expired(sid)
+
+    def get(self, sid, key):
+        if self._expired(sid):
+            return None
+        try:
+            with open(os.path.join(self._dir(sid), self._filename(key)), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def keys(self, sid):
+        if self._expired(sid):
+            return set()
+        try:
+            return {bytes.fromhex(name).decode('utf-8') for name in os.listdir(self._dir(sid))
+                    if not name.endswith('.tmp')}
+        except (OSError, ValueError):
+            return set()
+
+    def save(self, sid, values, deleted, ttl, replace=False):
+        directory = self._dir(sid)
+        if replace:
+            shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        for key in deleted:
+            try:
+                os.remove(os.path.join(directory, self._filename(key)))
+            except OSError:
+                pass
+        for key, raw in values.items():
+            tmp_path = os.path.join(directory, self._filename(key) + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, os.path.join(directory, self._filename(key)))
+        os.utime(directory)
+
+    def touch(self, sid, ttl):
+        try:
+            os.utime(self._dir(sid))
+        except OSError:
+            pass
+
+    def delete(self, sid):
+        shutil.rmtree(self._dir(sid), ignore_errors=True)
+
+    def purge_expired(self):
+        """Remove session directories idle for longer than ttl (run by the disk janitor)."""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for sid in os.listdir(shard_path):
+                path = os.path.join(shard_path, sid)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        shutil.rmtree(path, ignore_errors=True)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            debug_print(f"🧹 Removed {removed} expired session(s)")
+        return removed
+
+
+class ServerSession(SessionMixin):
+    """Session dict whose values are fetched from the backend one key at a time."""
+
+    def __init__(self, backend, sid, new=False):
+        self.backend = backend
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self._values = {}       # decoded or newly assigned values
+        self._missing = set()   # keys known not to exist
+        self._dirty = set()     # keys to write on save
+        self._deleted = set()   # keys to remove on save
+        self._stored_keys = None
+        self._cleared = False
+
+    def _load(self, key):
+        """True if key exists, decoding its stored value on first access."""
+        self.accessed = True
+        if key in self._values:
+            return True
+        if key in self._missing or self.new or self._cleared:
+            return False
+
+        raw = None
+        try:
+            raw = self.backend.get(self.sid, key)
+        except Exception as e:
+            debug_print(f"⚠️ Could not read session key {key}: {e}")
+        if raw is None:
+            self._missing.add(key)
+            return False
+        try:
+            self._values[key] = decode_value(raw)
+        except (msgspec.DecodeError, zlib.error, ValueError) as e:
+            debug_print(f"⚠️ Dropping undecodable session key {key}: {e}")
+            self._missing.add(key)
+            return False
+        return True
+
+    def __getitem__(self, key):
+        if not self._load(key):
+            raise KeyError(key)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self.accessed = self.modified = True
+        self._values[key] = value
+        self._dirty.add(key)
+        self._deleted.discard(key)
+        self._missing.discard(key)
+
+    def __delitem__(self, key):
+        if not self._load(key):
+            raise KeyError(key)
+        self.modified = True
+        del self._values[key]
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        self._missing.add(key)
+
+    def __contains__(self, key):
+        return self._load(key)
+
+    def _keys(self):
+        self.accessed = True
+        if self._stored_keys is None:
+            self._stored_keys = set()
+            if not self.new and not self._cleared:
+                try:
+                    self._stored_keys = self.backend.keys(self.sid)
+                except Exception as e:
+                    debug_print(f"⚠️ Could not list session keys: {e}")
+        return (self._stored_keys - self._deleted - self._missing) | set(self._values)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def clear(self):
+        self.accessed = self.modified = True
+        self._values, self._dirty, self._deleted, self._missing = {}, set(), set(), set()
+        self._stored_keys = set()
+        self._cleared = True
+
+    def regenerate(self):
+        """Keep the values but store them under a fresh id on save (call on login against session fixation)."""
+        for key in list(self._keys()):
+            if self._load(key):
+                self._dirty.add(key)
+        self.accessed = self.modified = True
+        self._cleared = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface storing ServerSession values in Redis or on disk."""
+
+    def __init__(self, directory=SESSION_DIR, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.file_backend = FileSessionBackend(directory, ttl)
+        self.saves = 0
+        self.bytes_written = 0
+
+    def backend(self):
+        redis_client = get_redis()
+        return RedisSessionBackend(redis_client) if redis_client is not None else self.file_backend
+
+    def open_session(self, app, request):
+        backend = self.backend()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and VALID_SID.match(sid):
+            try:
+                if backend.exists(sid):
+                    return ServerSession(backend, sid)
+            except Exception as e:
+                debug_print(f"⚠️ Could not look up session: {e}")
+        # No cookie, or an id this server never issued or has expired: never adopt it
+        return ServerSession(backend, secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session.modified:
+            # Sliding expiry for sessions that were only read
+            if session.accessed and not session.new:
+                try:
+                    session.backend.touch(session.sid, self.ttl)
+                except Exception as e:
+                    debug_print(f"⚠️ Could not refresh session: {e}")
+            if session.new or not self.should_set_cookie(app, session):
+                return
+        else:
+            if not session:
+                try:
+                    session.backend.delete(session.sid)
+                except Exception as e:
+                    debug_print(f"⚠️ Could not delete session: {e}")
+                if not session.new:
+                    response.delete_cookie(name, domain=domain, path=path,
+                                           secure=self.get_cookie_secure(app),
+                                           samesite=self.get_cookie_samesite(app),
+                                           httponly=self.get_cookie_httponly(app))
+                return
+
+            values = {key: encode_value(session._values[key]) for key in session._dirty}
+            try:
+                if session._cleared and not session.new:
+                    # Cleared (logout) or regenerated (login): continue under a fresh id so the old cookie is worthless
+                    session.backend.delete(session.sid)
+                    session.sid = secrets.token_urlsafe(32)
+                session.backend.save(session.sid, values, session._deleted, self.ttl, replace=session._cleared)
+            except Exception as e:
+                debug_print(f"⚠️ Could not save session: {e}")
+                return
+            self.saves += 1
+            self.bytes_written += sum(len(raw) for raw in values.values())
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def stats(self):
+        return {
+            "backend": self.backend().name,
+            "ttl_seconds": self.ttl,
+            "saves": self.saves,
+            "kb_written": round(self.bytes_written / 1024, 1)
+        }
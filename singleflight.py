@@ -0,0 +1,153 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+When many greenlets ask for the same key at once, one of them (the leader)
+does the work and the rest wait on it and share its result. With
+`distributed=True` a Redis lock extends this across gunicorn workers: the
+worker holding the lock calls upstream and publishes the result, the others
+poll for it.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from utils import debug_print, get_redis
+
+# ============================================
+# Configuration
+# ============================================
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv('SINGLEFLIGHT_LOCK_TTL', '60'))
+SINGLEFLIGHT_RESULT_TTL = int(os.getenv('SINGLEFLIGHT_RESULT_TTL', '30'))
+SINGLEFLIGHT_POLL_INTERVAL = 0.1
+
+# Only delete the lock if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key."""
+
+    def __init__(self, distributed=False, lock_ttl=SINGLEFLIGHT_LOCK_TTL,
+                 result_ttl=SINGLEFLIGHT_RESULT_TTL, prefix='singleflight'):
+        self.distributed = distributed
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.prefix = prefix
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    # ---- in-process coalescing ----
+    def begin(self, key):
+        """Register interest in key; returns (call, is_leader)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.followers += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """Publish the leader's outcome and wake every follower."""
+        call.result = result
+        call.error = error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def wait(self, call, timeout=None):
+        """Block (cooperatively under eventlet) until the leader finishes."""
+        if not call.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for in-flight request")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn):
+        """Run fn() once per key across concurrent callers and share its result."""
+        call, leader = self.begin(key)
+        if not leader:
+            debug_print(f"🔗 Joined in-flight request {key[:12]}")
+            return self.wait(call)
+
+        try:
+            result = self._lead(key, fn)
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    # ---- cross-worker coalescing ----
+    def _lead(self, key, fn):
+        redis_client = get_redis() if self.distributed else None
+        if redis_client is None:
+            return fn()
+
+        lock_key = f"{self.prefix}:lock:{key}"
+        result_key = f"{self.prefix}:result:{key}"
+        token = uuid.uuid4().hex
+
+        try:
+            acquired = redis_client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            debug_print(f"⚠️ Single-flight lock failed, calling directly: {e}")
+            return fn()
+
+        if acquired:
+            try:
+                result = fn()
+                try:
+                    redis_client.set(result_key, json.dumps(result), ex=self.result_ttl)
+                except Exception as e:
+                    debug_print(f"⚠️ Could not publish single-flight result: {e}")
+                return result
+            finally:
+                try:
+                    redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception:
+                    pass
+
+        # Another worker is already calling upstream: wait for its result
+        debug_print(f"🔗 Waiting on another worker for {key[:12]}")
+        deadline = time.time() + self.lock_ttl
+        try:
+            while time.time() < deadline:
+                value = redis_client.get(result_key)
+                if value is not None:
+                    return json.loads(value)
+                if not redis_client.exists(lock_key):
+                    # Leader finished without a result (it failed); one last look, then do it ourselves
+                    value = redis_client.get(result_key)
+                    if value is not None:
+                        return json.loads(value)
+                    break
+                time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+        except Exception as e:
+            debug_print(f"⚠️ Single-flight wait failed: {e}")
+        return fn()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
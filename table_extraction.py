@@ -0,0 +1,209 @@
+"""
+Lazy, per-page table extraction for the PDF analyzer.
+
+pdfplumber's table finder is accurate but slow, often a second or more per
+page, while /understand only uses the first few tables. Extraction
+therefore runs in two passes:
+
+1. A cheap PyMuPDF pass scores every page for table-like layout: ruling
+   lines from the vector drawings, or rows of text split into three or more
+   aligned columns.
+2. pdfplumber runs only on candidate pages, strongest candidates first,
+   and stops once `limit` tables are found or TABLE_MAX_PARSED_PAGES pages
+   have been parsed. Tables are returned in page order.
+
+Both the candidate list and each page's tables (with their markdown
+rendering) are kept in the extraction cache. Asking again for the same
+file, or for more tables, only touches pages not looked at before.
+"""
+import os
+import re
+
+import pdfplumber
+
+try:
+    import pymupdf as fitz
+except ImportError:  # PyMuPDF < 1.24.3
+    import fitz
+
+from extraction_cache import extraction_cache, file_sha256
+from pdf_extraction import PDF_MAX_PAGES, PdfSource
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+TABLE_LIMIT = int(os.getenv('TABLE_LIMIT', '5'))                     # tables returned by default
+TABLE_MAX_PARSED_PAGES = int(os.getenv('TABLE_MAX_PARSED_PAGES', '8'))  # pdfplumber pages per call
+
+MIN_RULE_LENGTH = 30       # points; shorter strokes are underlines, bullets, glyph art
+MIN_COLUMN_GAP = 15        # points between words that start a new column
+MIN_ALIGNED_ROWS = 4       # rows with 3+ columns that make a borderless table candidate
+MIN_FILLED_CELLS = 0.4     # sparser grids are slide layouts, not tables
+
+# Line and rectangle operators in a page content stream
+PATH_OPERATORS = re.compile(rb"\s(?:re|l)\s")
+
+
+def _ruling_lines(page):
+    """Count long horizontal and vertical strokes among the page's vector drawings."""
+    horizontal = vertical = 0
+    # Parsing drawings is the slow part; most text pages have (almost) no paths at all
+    if len(PATH_OPERATORS.findall(page.read_contents())) < 4:
+        return horizontal, vertical
+
+    page_width = page.rect.width
+    for drawing in page.get_cdrawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                (x0, y0), (x1, y1) = item[1], item[2]
+            elif item[0] == "re":
+                x0, y0, x1, y1 = item[1]
+            else:
+                continue
+            width, height = abs(x1 - x0), abs(y1 - y0)
+            if height < 2 and width >= MIN_RULE_LENGTH:
+                horizontal += 1
+            elif width < 2 and height >= MIN_RULE_LENGTH:
+                vertical += 1
+            elif item[0] == "re" and MIN_RULE_LENGTH <= width < page_width * 0.9 and height >= 8:
+                # Bordered cell: two horizontal and two vertical edges
+                horizontal += 2
+                vertical += 2
+    return horizontal, vertical
+
+
+def _aligned_rows(page):
+    """Count text lines that split into three or more columns separated by wide gaps."""
+    lines = {}
+    for x0, _, x1, _, _, block, line, _ in page.get_text("words"):
+        lines.setdefault((block, line), []).append((x0, x1))
+
+    rows = 0
+    for words in lines.values():
+        words.sort()
+        columns = 1 + sum(1 for (_, prev_end), (start, _) in zip(words, words[1:])
+                          if start - prev_end >= MIN_COLUMN_GAP)
+        if columns >= 3:
+            rows += 1
+    return rows
+
+
+def page_table_score(page):
+    """Heuristic table likelihood of a PyMuPDF page (0 = no table)."""
+    horizontal, vertical = _ruling_lines(page)
+    if horizontal >= 3 and vertical >= 2:
+        return horizontal + vertical
+    if horizontal >= 4:  # tables ruled with horizontal lines only
+        return horizontal
+    rows = _aligned_rows(page)
+    return rows if rows >= MIN_ALIGNED_ROWS else 0
+
+
+def find_candidate_pages(path, max_pages=PDF_MAX_PAGES):
+    """[page_number, score] of pages that probably contain a table, strongest first."""
+    candidates = []
+    with fitz.open(path) as doc:
+        for index in range(min(doc.page_count, max_pages)):
+            score = page_table_score(doc.load_page(index))
+            if score > 0:
+                candidates.append([index + 1, score])
+    candidates.sort(key=lambda candidate: (-candidate[1], candidate[0]))
+    return candidates
+
+
+def _clean_cell(cell):
+    return " ".join(str(cell).split()).replace("|", "\\|") if cell is not None else ""
+
+
+def table_to_markdown(rows):
+    """Render table rows as GitHub markdown; the first non-empty row is the header."""
+    width = max(len(row) for row in rows)
+    cells = [[_clean_cell(cell) for cell in row] + [""] * (width - len(row)) for row in rows]
+    header = cells[0] if any(cells[0]) else [f"Column {i}" for i in range(1, width + 1)]
+    body = cells[1:] if any(cells[0]) else cells
+
+    lines = ["| " + " | ".join(header) + " |", "|" + "|".join(["---"] * width) + "|"]
+    lines.extend("| " + " | ".join(row) + " |" for row in body)
+    return "\n".join(lines)
+
+
+def extract_page_tables(page):
+    """Tables of one pdfplumber page as dicts with page, rows, cols, markdown and plain text."""
+    page_number = page.page_number
+    tables = []
+    for rows in page.extract_tables():
+        rows = [row for row in rows if row and any(cell not in (None, "") for cell in row)]
+        if len(rows) < 2 or max(len(row) for row in rows) < 2:
+            continue  # single rows/columns are ruled text, not tables
+        cells = [cell for row in rows for cell in row]
+        if sum(1 for cell in cells if cell not in (None, "")) < MIN_FILLED_CELLS * len(cells):
+            continue
+        tables.append({
+            "page": page_number,
+            "rows": len(rows),
+            "cols": max(len(row) for row in rows),
+            "markdown": table_to_markdown(rows),
+            "text": "\n".join(" | ".join(_clean_cell(cell) for cell in row) for row in rows)
+        })
+    return tables
+
+
+def _native(fn, *args):
+    """Run CPU-bound parsing in a native thread so the eventlet hub keeps serving requests."""
+    try:
+        from eventlet import tpool
+    except ImportError:
+        return fn(*args)
+    return tpool.execute(fn, *args)
+
+
+def _cached(digest, kind, compute):
+    if extraction_cache is None:
+        return compute()
+    return extraction_cache.get_or_compute(digest, kind, compute)
+
+
+def extract_tables(source, digest=None, limit=TABLE_LIMIT):
+    """
+    Up to `limit` tables of a PDF (path, bytes or file object), in page order.
+
+    `digest` is the file's sha256 when the caller already has it; results of
+    the detector and of every page looked at are cached under it.
+    """
+    with PdfSource(source) as path:
+        if digest is None:
+            with open(path, 'rb') as f:
+                digest = file_sha256(f)
+
+        candidates = _cached(digest, "table-candidates", lambda: _native(find_candidate_pages, path))
+        if not candidates:
+            return []
+
+        candidate_pages = [page_number for page_number, _ in candidates]
+        tables, pdf, pages, parsed = [], None, {}, 0
+        try:
+            for page_number in candidate_pages:
+                if len(tables) >= limit:
+                    break
+
+                def compute(page_number=page_number):
+                    nonlocal pdf, pages, parsed
+                    if parsed >= TABLE_MAX_PARSED_PAGES:
+                        return None  # over budget: not cached, may be parsed by a later call
+                    if pdf is None:
+                        # Only candidate pages are loaded into pdfplumber
+                        pdf = pdfplumber.open(path, pages=candidate_pages)
+                        pages = {page.page_number: page for page in pdf.pages}
+                    parsed += 1
+                    return _native(extract_page_tables, pages[page_number])
+
+                tables.extend(_cached(digest, f"tables-page{page_number}", compute) or [])
+        finally:
+            if pdf is not None:
+                pdf.close()
+
+        tables = sorted(tables[:limit], key=lambda table: table["page"])
+        debug_print(f"📊 {len(tables)} table(s) from {len(candidates)} candidate page(s), {parsed} parsed")
+        return tables
+
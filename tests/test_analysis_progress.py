@@ -0,0 +1,33 @@
+import time
+
+from analysis_progress import ProgressRegistry
+
+
+def test_stream_ends_after_failure():
+    registry = ProgressRegistry()
+    channel = registry.create("analysis-1")
+    channel.publish('stage', {"stage": "text", "status": "running"})
+    channel.publish('failed', {"success": False, "error": "Processing failed: boom"})
+
+    events = [event for event, _ in channel.follow(keepalive=0.01)]
+
+    assert events == ['stage', 'failed']
+    assert channel.finished
+    assert registry.stats() == {"running": 0, "channels": 1}
+
+
+def test_failed_channels_expire():
+    registry = ProgressRegistry(ttl=0)
+    registry.create("analysis-1").publish('failed', {"success": False})
+    time.sleep(0.01)
+    registry.create("analysis-2")
+    assert registry.get("analysis-1") is None
+    assert registry.get("analysis-2") is not None
+
+
+def test_follow_sends_keepalives_until_done():
+    channel = ProgressRegistry().create("analysis-1")
+    stream = channel.follow(keepalive=0.01)
+    assert next(stream) == (None, None)
+    channel.publish('done', {"success": True})
+    assert list(stream) == [('done', {"success": True})]
@@ -0,0 +1,34 @@
+from memory_manager import count_tokens
+from retrieval import DocumentPassages
+
+FILLER = ("The lecture continues with general remarks on the history of the course, its assessment "
+          "scheme, reading lists and the timetable for the laboratory sessions this semester. ")
+OSMOSIS = ("Osmosis is the movement of water molecules across a semi-permeable membrane from a region "
+           "of low solute concentration to a region of high solute concentration. ")
+
+
+def long_document():
+    pages = [FILLER * 12 for _ in range(200)]
+    pages[137] = OSMOSIS * 12
+    return "\n".join(pages)
+
+
+def test_short_documents_are_sent_whole():
+    text = OSMOSIS * 3
+    assert DocumentPassages().excerpt(text, "what is osmosis?", token_budget=2000) == text
+
+
+def test_long_documents_are_cut_to_the_budget_around_the_question():
+    text = long_document()
+    excerpt = DocumentPassages().excerpt(text, "explain osmosis across a membrane", token_budget=1500)
+
+    assert count_tokens(excerpt) <= 1600
+    assert "Osmosis is the movement of water" in excerpt
+    assert len(excerpt) < len(text) / 20
+
+
+def test_questions_without_matches_get_the_opening_passages():
+    text = long_document()
+    excerpt = DocumentPassages().excerpt(text, "", token_budget=1000)
+    assert excerpt.startswith(text[:200])
+    assert "Osmosis" not in excerpt
@@ -0,0 +1,45 @@
+import time
+
+from circuit_breaker import CLOSED, CircuitBreaker
+from llm_client import OpenRouterClient
+
+
+def test_long_calls_do_not_open_the_breaker():
+    breaker = CircuitBreaker('test', min_calls=3, slow_call_seconds=20)
+    for _ in range(10):
+        breaker.record_success(None)
+    assert breaker.state == CLOSED
+    assert breaker.latency_percentile(95) is None
+
+
+def test_slow_short_calls_still_open_the_breaker():
+    breaker = CircuitBreaker('test', min_calls=3, slow_call_seconds=0.5)
+    for _ in range(3):
+        breaker.record_success(1.0)
+    assert breaker.state != CLOSED
+
+
+def test_stream_records_time_to_first_token():
+    client = OpenRouterClient(api_key="test")
+
+    def slow_stream(*args):
+        yield "Hello"
+        time.sleep(0.3)
+        yield " world"
+
+    client._stream = slow_stream
+    answer = "".join(client.stream_chat([{"role": "user", "content": "hi"}], use_cache=False))
+
+    assert answer == "Hello world"
+    assert client.breaker.latency_percentile(50) < 0.1
+
+
+def test_note_generation_latency_is_not_sampled():
+    client = OpenRouterClient(api_key="test")
+    client._complete = lambda *args: "notes"
+    client.chat([{"role": "user", "content": "notes"}], max_tokens=7000, timeout=180, use_cache=False)
+    client.chat([{"role": "user", "content": "section"}], max_tokens=1500, timeout=120, use_cache=False)
+    assert client.breaker.snapshot()["latency_samples"] == 0
+
+    client.chat([{"role": "user", "content": "question"}], max_tokens=1500, timeout=30, use_cache=False)
+    assert client.breaker.snapshot()["latency_samples"] == 1
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from llm_client import LLMError, OpenRouterClient
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body=None, lines=()):
+        self.body = body
+        self.lines = lines
+
+    def json(self):
+        return self.body
+
+    def iter_lines(self):
+        for line in self.lines:
+            yield line.encode('utf-8')
+
+    def close(self):
+        pass
+
+
+def client_returning(response):
+    client = OpenRouterClient(api_key="test")
+    client.post = lambda *args, **kwargs: response
+    return client
+
+
+def test_stream_skips_chunks_without_choices():
+    lines = [
+        'data: ' + json.dumps({"choices": [{"delta": {"content": "Hello"}}]}),
+        'data: ' + json.dumps({"choices": [], "usage": {"total_tokens": 12}}),
+        'data: ' + json.dumps({"choices": [{"delta": None}]}),
+        'data: [DONE]',
+    ]
+    client = client_returning(FakeResponse(lines=lines))
+    assert list(client._stream([], "model", 0.5, 100, None, "test")) == ["Hello"]
+
+
+def test_completion_without_choices_is_an_empty_answer():
+    client = client_returning(FakeResponse(body={"choices": []}))
+    with pytest.raises(LLMError, match="empty answer"):
+        client._complete([], "model", 0.5, 100, None, "test")
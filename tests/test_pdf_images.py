@@ -0,0 +1,124 @@
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import pdf_images
+from pdf_images import fitz
+
+
+def encoded(image, fmt='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=80)
+    return buffer.getvalue()
+
+
+def diagram(size=240):
+    """A picture with structure: gradient background, a dark disc and a bar."""
+    y, x = np.mgrid[0:size, 0:size]
+    pixels = (x * 255 // size).astype(np.uint8)
+    pixels[(x - size // 3) ** 2 + (y - size // 3) ** 2 < (size // 5) ** 2] = 20
+    pixels[size * 2 // 3:size * 3 // 4, size // 8:size * 7 // 8] = 235
+    return Image.fromarray(pixels).convert('RGB')
+
+
+def retouched(image):
+    """The same diagram with a small mark added: a few hash bits differ."""
+    pixels = np.array(image)
+    pixels[200:215, 200:215] = 0
+    return Image.fromarray(pixels)
+
+
+def checkerboard(size=240, square=30):
+    y, x = np.mgrid[0:size, 0:size]
+    return Image.fromarray((((x // square + y // square) % 2) * 255).astype(np.uint8)).convert('RGB')
+
+
+@pytest.fixture
+def lecture_pdf(tmp_path):
+    """
+    Page 1: the diagram and a tiny icon. Page 2: a retouched copy of the
+    diagram as a smaller JPEG and a plain grey fill. Page 3: the page-1
+    diagram again (same bytes) and a checkerboard.
+    """
+    picture = encoded(diagram())
+    doc = fitz.open()
+    for contents in (
+        [(picture, (50, 50, 290, 290)), (encoded(checkerboard(32, 4)), (300, 50, 332, 82))],
+        [(encoded(retouched(diagram()).resize((200, 200)), 'JPEG'), (50, 50, 290, 290)),
+         (encoded(Image.new('RGB', (240, 240), (128, 128, 128))), (300, 300, 540, 540))],
+        [(picture, (50, 50, 290, 290)), (encoded(checkerboard()), (300, 300, 540, 540))],
+    ):
+        page = doc.new_page()
+        for data, rect in contents:
+            page.insert_image(fitz.Rect(*rect), stream=data)
+    path = str(tmp_path / "lecture.pdf")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_extract_merges_duplicates_and_skips_decorative_images(lecture_pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_images, 'PDF_IMAGE_DIR', str(tmp_path / "images"))
+
+    images = pdf_images._extract(lecture_pdf, 10)
+
+    # The icon (too small) and the grey fill (uniform) are gone; the retouched
+    # JPEG is the same picture within PDF_IMAGE_HASH_DISTANCE
+    assert [image["pages"] for image in images] == [[1, 2, 3], [3]]
+    for image in images:
+        assert os.path.exists(image["path"]) and os.path.exists(image["thumbnail_path"])
+
+
+def test_hash_distance_decides_what_is_the_same_picture(lecture_pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_images, 'PDF_IMAGE_DIR', str(tmp_path / "images"))
+    monkeypatch.setattr(pdf_images, 'PDF_IMAGE_HASH_DISTANCE', 0)
+
+    images = pdf_images._extract(lecture_pdf, 10)
+
+    assert [image["pages"] for image in images] == [[1, 3], [2], [3]]
+
+
+def test_extract_reuses_stored_images(lecture_pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_images, 'PDF_IMAGE_DIR', str(tmp_path / "images"))
+    first = pdf_images._extract(lecture_pdf, 10)
+    written = {image["path"]: os.stat(image["path"]).st_mtime_ns for image in first}
+
+    second = pdf_images._extract(lecture_pdf, 10)
+
+    assert [image["hash"] for image in second] == [image["hash"] for image in first]
+    assert {path: os.stat(path).st_mtime_ns for path in written} == written
+
+
+def stored_image(key, age):
+    old = time.time() - age
+    for path in pdf_images.image_paths(key):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b"RIFF")
+        os.utime(path, (old, old))
+
+
+def test_loading_an_analysis_keeps_its_images_alive(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_images, 'PDF_IMAGE_DIR', str(tmp_path))
+    key = "ab" + "0" * 30
+    stored_image(key, age=5 * 3600)
+
+    pdf_images.touch_images([{"hash": key}])
+
+    for path in pdf_images.image_paths(key):
+        assert time.time() - os.path.getmtime(path) < 60
+
+
+def test_recently_used_images_are_not_touched_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_images, 'PDF_IMAGE_DIR', str(tmp_path))
+    key = "cd" + "0" * 30
+    stored_image(key, age=60)
+    before = [os.path.getmtime(path) for path in pdf_images.image_paths(key)]
+
+    pdf_images.touch_images([{"hash": key}, {"hash": "ef" + "0" * 30}])  # the second one is gone
+
+    assert [os.path.getmtime(path) for path in pdf_images.image_paths(key)] == before
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from retrieval import PassageRetriever, content_terms, passage_embedder
+
+PAGES = {
+    ("trig.pdf", 1): "Another addition formula: sin(a + b) = sin a cos b + cos a sin b, and another one for cos.",
+    ("bio.pdf", 1): "Osmosis is the movement of water through a semi-permeable membrane.",
+}
+
+
+class StubCorpus:
+    available = True
+    index = {"blob": "corpus-test.json"}
+
+    def documents(self):
+        return {"trig.pdf": {"title": "Addition Formulas"}, "bio.pdf": {"title": "BIO 101 Cells"}}
+
+    def page_text(self, path, page):
+        return PAGES[(path, page)]
+
+
+@pytest.fixture
+def retriever():
+    retriever = PassageRetriever(corpus=StubCorpus())
+    retriever.passages = [[path, page, 0, len(text)] for (path, page), text in PAGES.items()]
+    retriever.matrix = passage_embedder.embed_many(list(PAGES.values()))
+    retriever.passage_courses = [set() for _ in PAGES]
+    retriever._loaded_for = StubCorpus.index["blob"]
+    return retriever
+
+
+@pytest.mark.parametrize("question", ["and another", "give me another example", "simplify it", "why?"])
+def test_follow_ups_without_content_terms_are_not_looked_up(retriever, question):
+    assert content_terms(question) == set()
+    assert retriever.retrieve(question, min_score=0.0) == []
+
+
+def test_passages_must_share_content_terms(retriever):
+    results = retriever.retrieve("what is osmosis", min_score=0.0)
+    assert [passage["path"] for passage in results] == ["bio.pdf"]
+
+
+def test_content_terms_skip_question_framing():
+    assert content_terms("difference between CISC and RISC") == {"cisc", "risc"}
@@ -0,0 +1,48 @@
+import pytest
+
+from semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache()
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Solve 2x^2 + 5x - 3 = 0 step by step", "Solve 2x^2 + 5x + 3 = 0 step by step"),
+    ("What is 15% of 200?", "What is 25% of 200?"),
+    ("mitosis in plant vs animal cells", "meiosis in plant vs animal cells"),
+    ("mitosis in plant vs animal cells", "mitosis in plant cells"),
+    ("advantages of object oriented programming", "disadvantages of object oriented programming"),
+    ("Explain the causes of the first world war", "Explain the causes of the second world war"),
+    ("What is an ionic bond?", "What is a covalent bond?"),
+])
+def test_near_miss_questions_do_not_share_answers(cache, cached, asked):
+    cache.add(cached, "<p>cached answer</p>")
+    assert cache.lookup(asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("define osmosis", "what is osmosis"),
+    ("What is the capital of Nigeria?", "what is the capital of nigeria"),
+])
+def test_rephrased_questions_share_answers(cache, cached, asked):
+    cache.add(cached, "<p>cached answer</p>")
+    assert cache.lookup(asked)["answer"] == "<p>cached answer</p>"
+
+
+def test_math_questions_are_not_cached_semantically(cache):
+    question = "Solve 2x^2 + 5x - 3 = 0 step by step"
+    cache.add(question, "<p>x = 1/2 or x = -3</p>")
+    assert cache.lookup(question) is None
+
+
+def test_hyphenated_words_are_not_math(cache):
+    cache.add("explain object-oriented programming", "<p>cached answer</p>")
+    assert cache.lookup("explain object-oriented programming")["answer"] == "<p>cached answer</p>"
+
+
+def test_hits_return_the_sources_the_answer_cites(cache):
+    sources = [{"id": 1, "chunk": 812, "title": "BIO 101 Cells", "page": 4}]
+    cache.add("what is osmosis", "<p>Osmosis is ... [1]</p>", sources=sources)
+    assert cache.lookup("What is osmosis?") == {"answer": "<p>Osmosis is ... [1]</p>", "sources": sources}
@@ -0,0 +1,65 @@
+import pytest
+from flask import Flask, session
+
+from server_session import ServerSessionInterface
+
+PLANTED_SID = "A" * 43
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    app.secret_key = "test"
+    interface = ServerSessionInterface(directory=str(tmp_path))
+    interface.backend = lambda: interface.file_backend
+    app.session_interface = interface
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['theme'] = value
+        return "ok"
+
+    @app.route('/login')
+    def login():
+        session.regenerate()
+        session['user'] = {"username": "victim"}
+        return "ok"
+
+    @app.route('/whoami')
+    def whoami():
+        return session.get('user', {}).get('username', "anonymous")
+
+    return app.test_client()
+
+
+def session_cookie(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie else None
+
+
+def test_unknown_session_ids_are_not_adopted(client):
+    client.set_cookie('session', PLANTED_SID)
+    client.get('/set/dark')
+    assert session_cookie(client) != PLANTED_SID
+
+
+def test_login_moves_the_session_to_a_new_id(client):
+    client.get('/set/dark')
+    before = session_cookie(client)
+
+    client.get('/login')
+    after = session_cookie(client)
+
+    assert after != before
+    assert client.get('/whoami').get_data(as_text=True) == "victim"
+
+    # The pre-login id, which an attacker may know, is not logged in
+    client.set_cookie('session', before)
+    assert client.get('/whoami').get_data(as_text=True) == "anonymous"
+
+
+def test_values_survive_regeneration(client):
+    client.get('/set/dark')
+    client.get('/login')
+    with client.session_transaction() as stored:
+        assert stored['theme'] == "dark"
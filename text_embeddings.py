@@ -0,0 +1,80 @@
+"""
+Local text embeddings using the hashing trick.
+
+No model download and no network: word unigrams, word bigrams and character
+trigrams are hashed into a fixed-size signed vector, then L2-normalised so a
+dot product between two vectors is their cosine similarity.
+"""
+import math
+import os
+import re
+import zlib
+
+import numpy as np
+
+# ============================================
+# Configuration
+# ============================================
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '2048'))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "of", "to", "in",
+    "on", "for", "and", "or", "what", "which", "who", "how", "why", "when", "does",
+    "do", "did", "can", "could", "please", "me", "i", "you", "it", "its", "this",
+    "that", "about", "explain", "tell", "define", "with", "by", "as", "at"
+}
+
+
+class HashingEmbedder:
+    """Turn text into normalised float32 vectors of size `dim`."""
+
+    def __init__(self, dim=EMBEDDING_DIM, char_weight=0.5):
+        self.dim = dim
+        self.char_weight = char_weight
+
+    def tokens(self, text):
+        words = TOKEN_PATTERN.findall((text or "").lower())
+        return [w for w in words if w not in STOPWORDS]
+
+    def features(self, text):
+        """Yield (feature, weight) pairs for one text."""
+        words = self.tokens(text)
+        for word in words:
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3], self.char_weight
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 1.0
+
+    def embed(self, text):
+        """Embed one text into a unit-length vector (all zeros for empty text)."""
+        counts = {}
+        for feature, weight in self.features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            index = h % self.dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            counts[index] = counts.get(index, 0.0) + sign * weight
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for index, value in counts.items():
+            # Sub-linear term frequency keeps long texts from dominating
+            vector[index] = math.copysign(math.log1p(abs(value)), value)
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_many(self, texts):
+        """Embed a list of texts into an (n, dim) float32 matrix."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = self.embed(text)
+        return matrix
+
+
+# Shared embedder so every index uses the same hashing space
+embedder = HashingEmbedder()
@@ -0,0 +1,181 @@
+"""
+Disk-spooled uploads and per-request memory instrumentation.
+
+Uploads larger than UPLOAD_SPOOL_MIN_BYTES are streamed by the form parser
+straight into a named temporary file (SpoolingRequest) instead of an
+in-memory buffer. SpooledUpload then hands that file's path to every
+extractor. The PDF text workers, image and table extraction all open the
+same file, which the OS page cache shares between them and across
+processes. The upload is never read into a Python bytes object or copied
+per extractor, so a 100 MB PDF costs about the same memory as a 1 MB one.
+
+MemoryProbe samples the process RSS while a request runs and records the
+peak growth per endpoint. Concurrent requests share the process, so the
+figure is an upper bound for any single request.
+"""
+import hashlib
+import mmap
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from flask import Request
+
+from utils import debug_print
+
+# ============================================
+# Configuration
+# ============================================
+# The app's own directory: the disk janitor deletes leftovers here, which must never touch other programs' files
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR') or os.path.join(os.getcwd(), 'upload_spool')
+UPLOAD_SPOOL_MIN_BYTES = int(os.getenv('UPLOAD_SPOOL_MIN_BYTES', str(256 * 1024)))  # smaller bodies stay in memory
+MEMORY_SAMPLE_SECONDS = float(os.getenv('MEMORY_SAMPLE_SECONDS', '0.05'))
+
+COPY_CHUNK_BYTES = 1024 * 1024
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_stats_lock = threading.Lock()
+_memory_stats = {}  # probe name -> {"requests", "max_peak_mb", "total_peak_mb"}
+_spool_stats = {"uploads": 0, "spooled_mb": 0.0}
+
+os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+
+
+class SpoolingRequest(Request):
+    """Flask request whose multipart file parts are written to named temporary files."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length < UPLOAD_SPOOL_MIN_BYTES:
+            return BytesIO()
+        # Removed when the request closes its files at teardown
+        return tempfile.NamedTemporaryFile(mode='w+b', dir=UPLOAD_SPOOL_DIR, prefix='upload-')
+
+
+class SpooledUpload:
+    """
+    Context manager exposing an uploaded FileStorage as a file on disk.
+
+    `path` is the spooled request file itself when the parser wrote one;
+    small in-memory uploads are written out once. `sha256` is computed over
+    an mmap of that file, without reading it into Python memory.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.path = None
+        self.size = 0
+        self._sha256 = None
+        self._temporary = False
+
+    def __enter__(self):
+        stream = self.file.stream
+        name = getattr(stream, 'name', None)
+        if isinstance(name, str) and os.path.isfile(name):
+            stream.flush()
+            self.path = name
+        else:
+            suffix = os.path.splitext(self.file.filename or '')[1]
+            handle = tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, prefix='upload-', suffix=suffix, delete=False)
+            with handle:
+                stream.seek(0)
+                shutil.copyfileobj(stream, handle, COPY_CHUNK_BYTES)
+            self.path = handle.name
+            self._temporary = True
+
+        self.size = os.path.getsize(self.path)
+        with _stats_lock:
+            _spool_stats["uploads"] += 1
+            _spool_stats["spooled_mb"] += self.size / 1024 / 1024
+        return self
+
+    def __exit__(self, *exc):
+        if self._temporary and self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def keep(self, path):
+        """Give the upload a path that outlives the request (hard link when possible, else a copy)."""
+        try:
+            os.link(self.path, path)
+        except OSError:
+            shutil.copyfile(self.path, path)
+        return path
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            if self.size == 0:
+                self._sha256 = hashlib.sha256(b"").hexdigest()
+            else:
+                with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    self._sha256 = hashlib.sha256(view).hexdigest()
+        return self._sha256
+
+
+def current_rss_bytes():
+    """Resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryProbe:
+    """Record the peak RSS growth of a block of work, sampled from a (green) thread."""
+
+    def __init__(self, name, interval=MEMORY_SAMPLE_SECONDS):
+        self.name = name
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, current_rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss_bytes()
+        threading.Thread(target=self._sample, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        peak_mb = self.peak_mb
+        with _stats_lock:
+            stats = _memory_stats.setdefault(self.name, {"requests": 0, "max_peak_mb": 0.0, "total_peak_mb": 0.0})
+            stats["requests"] += 1
+            stats["max_peak_mb"] = max(stats["max_peak_mb"], peak_mb)
+            stats["total_peak_mb"] += peak_mb
+        debug_print(f"📈 {self.name}: peak memory +{peak_mb:.1f} MB (RSS {self.peak_rss / 1024 / 1024:.0f} MB)")
+
+    @property
+    def peak_mb(self):
+        return round(max(0, self.peak_rss - self.start_rss) / 1024 / 1024, 2)
+
+
+def upload_stats():
+    with _stats_lock:
+        return {
+            "spool_dir": UPLOAD_SPOOL_DIR,
+            "uploads": _spool_stats["uploads"],
+            "spooled_mb": round(_spool_stats["spooled_mb"], 2),
+            "rss_mb": round(current_rss_bytes() / 1024 / 1024, 1),
+            "peak_memory": {
+                name: {
+                    "requests": s["requests"],
+                    "max_peak_mb": round(s["max_peak_mb"], 2),
+                    "avg_peak_mb": round(s["total_peak_mb"] / s["requests"], 2)
+                }
+                for name, s in _memory_stats.items()
+            }
+        }
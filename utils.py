@@ -1,7 +1,42 @@
 import json
 import os
+import time
 from datetime import datetime
 
+DEBUG_MODE = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+
+REDIS_URL = os.getenv('REDIS_URL')
+REDIS_RETRY_SECONDS = 30
+
+_redis_client = None
+_redis_failed_at = 0
+
+def debug_print(*args, **kwargs):
+    if DEBUG_MODE:
+        print(*args, **kwargs)
+
+def get_redis():
+    """Return a shared Redis client, or None when REDIS_URL is unset or Redis is down."""
+    global _redis_client, _redis_failed_at
+    if not REDIS_URL:
+        return None
+    if _redis_client is not None:
+        return _redis_client
+    if time.time() - _redis_failed_at < REDIS_RETRY_SECONDS:
+        return None
+
+    try:
+        import redis
+        client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+        client.ping()
+        _redis_client = client
+        print("✅ Connected to Redis")
+    except Exception as e:
+        _redis_failed_at = time.time()
+        print(f"⚠️ Redis unavailable, using in-process fallback: {e}")
+        return None
+    return _redis_client
+
 def save_question_and_answer(username, question, answer, file_path='user.json'):
     # Ensure file exists with proper structure
     if not os.path.exists(file_path):